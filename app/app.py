@@ -1,4 +1,3 @@
-import gzip
 import logging
 import time
 
@@ -11,6 +10,10 @@ from flask import request
 
 from app import settings
 from app.helpers.otel import initialize_tracing
+from app.helpers.response_cache import STALE_HEADER
+from app.helpers.utils import JSONProvider
+from app.helpers.utils import accepts_gzip
+from app.helpers.utils import gzip_response
 from app.helpers.utils import make_error_msg
 
 logger = logging.getLogger(__name__)
@@ -20,6 +23,7 @@ route_logger = logging.getLogger('app.routes')
 
 app = Flask(__name__)
 app.config.from_object(settings)
+app.json = JSONProvider(app)
 
 initialize_tracing(app)
 
@@ -37,8 +41,8 @@ def log_route():
 # Add CORS Headers to all request
 @app.after_request
 def add_cors_header(response):
-    # Do not add CORS header to internal /checker endpoint.
-    if request.endpoint == 'checker':
+    # Do not add CORS header to internal /checker endpoints.
+    if request.endpoint in ('checker', 'stats'):
         return response
 
     response.headers['Access-Control-Allow-Methods'] = 'GET, HEAD, OPTIONS'
@@ -50,15 +54,18 @@ def add_cors_header(response):
 # Add Cache-Control Headers to all request except for checker
 @app.after_request
 def add_cache_control_header(response):
-    # Do not add Cache-Control header to internal /checker endpoint.
+    # Do not add Cache-Control header to internal /checker endpoints.
     if request.endpoint == 'checker':
         return response
+    if request.endpoint == 'stats':
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
 
     # no cache on these 5xx errors, they are supposed to be temporary
     if response.status_code in (502, 503, 504, 507):
         response.headers['Cache-Control'] = 'no-cache'
-    # short cache duration for other 5xx errors
-    elif response.status_code >= 500:
+    # short cache duration for other 5xx errors and the stale responses, see ResponseCache
+    elif response.status_code >= 500 or response.headers.get(STALE_HEADER[0]) == STALE_HEADER[1]:
         response.headers['Cache-Control'] = 'public, max-age=10'
     else:
         response.headers['Cache-Control'] = settings.CACHE_CONTROL_HEADER
@@ -67,19 +74,13 @@ def add_cache_control_header(response):
 
 @app.after_request
 def compress(response):
-    accept_encoding = request.headers.get('accept-encoding', '').lower()
-
     if (
         response.status_code < 200 or response.status_code >= 300 or response.direct_passthrough or
-        'gzip' not in accept_encoding or 'Content-Encoding' in response.headers
+        not accepts_gzip(request) or 'Content-Encoding' in response.headers
     ):
         return response
 
-    content = gzip.compress(response.get_data(), compresslevel=settings.GZIP_COMPRESSION_LEVEL)
-    response.set_data(content)
-    response.headers['content-length'] = len(content)
-    response.headers['content-encoding'] = 'gzip'
-    return response
+    return gzip_response(response)
 
 
 # NOTE it is better to have this method registered last (after add_cors_header) otherwise
@@ -94,7 +95,11 @@ def log_response(response):
         "duration": time.time() - g.get('request_started', time.time())
     }
     if route_logger.isEnabledFor(logging.DEBUG):
-        log_extra['response']['json'] = response.json if response.is_json else response.data
+        # the cached SearchServer responses might already be compressed
+        if response.is_json and 'Content-Encoding' not in response.headers:
+            log_extra['response']['json'] = response.json
+        else:
+            log_extra['response']['json'] = response.data
     route_logger.info("%s %s - %s", request.method, request.path, response.status, extra=log_extra)
     return response
 
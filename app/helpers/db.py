@@ -10,7 +10,7 @@ from app.app import cache
 logger = logging.getLogger(__name__)
 
 
-@cache.cached(key_prefix='get_topics_from_db')
+@cache.cached(key_prefix='topics:get_topics_from_db')
 def get_topics():
     '''Get a list with all topics from bod
 
@@ -39,7 +39,11 @@ def get_topics():
     return _topics
 
 
-@cache.memoize()
+def translation_make_cache_key(msg_id, lang):
+    return f'translations:{lang}:{msg_id}'
+
+
+@cache.cached(make_cache_key=translation_make_cache_key)
 def get_translation(msg_id, lang):
     '''Get translation from bod table translations
 
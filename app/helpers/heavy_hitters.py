@@ -0,0 +1,54 @@
+class SpaceSaving:
+    '''Space-Saving frequency sketch of the most frequent keys
+
+    At most `capacity` keys are counted, a new key replaces the least counted one and inherits
+    its count as overestimation error. Every key more frequent than total / capacity is
+    guaranteed to be counted. The counts are halved every `window` keys so the sketch follows
+    the changes of the traffic.
+    '''
+
+    def __init__(self, capacity, window=None):
+        self.capacity = capacity
+        self.window = window or capacity * 1000
+        self.total = 0
+        self._counters = {}  # key -> [count, error]
+
+    def __len__(self):
+        return len(self._counters)
+
+    def add(self, key):
+        counter = self._counters.get(key)
+        if counter is not None:
+            counter[0] += 1
+        elif len(self._counters) < self.capacity:
+            self._counters[key] = [1, 0]
+        else:
+            least = min(self._counters, key=lambda k: self._counters[k][0])
+            count = self._counters.pop(least)[0]
+            self._counters[key] = [count + 1, count]
+        self.total += 1
+        if self.total >= self.window:
+            self._decay()
+
+    def _decay(self):
+        self.total //= 2
+        for key in list(self._counters):
+            counter = self._counters[key]
+            counter[0] //= 2
+            counter[1] //= 2
+            if counter[0] == 0:
+                del self._counters[key]
+
+    def is_heavy(self, key):
+        '''Return True if the key is guaranteed to be more frequent than total / capacity'''
+        counter = self._counters.get(key)
+        if counter is None or self.total < self.capacity:
+            return False
+        return (counter[0] - counter[1]) * self.capacity >= self.total
+
+    def top(self, n):
+        '''Return the n most counted keys with their count and overestimation error'''
+        counters = sorted(self._counters.items(), key=lambda item: item[1][0], reverse=True)
+        return [{
+            'key': key, 'count': count, 'error': error, 'heavy': self.is_heavy(key)
+        } for key, (count, error) in counters[:n]]
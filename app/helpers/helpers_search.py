@@ -116,7 +116,7 @@ def transform_geom_make_cache_key(geom, srid_from, srid_to, rounding=True):
     hasher.update(cache_key.encode("utf-8"))
     cache_key = base64.b64encode(hasher.digest())
     cache_key = cache_key.decode("utf-8")
-    return f"trg_{cache_key}"
+    return f"geometries:{cache_key}"
 
 
 @cache.cached(timeout=60, make_cache_key=transform_geom_make_cache_key)
@@ -0,0 +1,71 @@
+import logging
+import os
+import time
+
+from app.settings import SERVICE_SPHINX_FILE
+from app.settings import SERVICE_SPHINX_VERSION_CHECK_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class IndexVersion:  # pylint: disable=too-few-public-methods
+    '''Build version of the searchd indexes, as written by service-search-sphinx in `path`
+
+    The file is only read again when its modification time changed, which is checked at most
+    once every `interval` seconds. The version is 'unknown' while the file does not exist.
+    The listeners are called without argument when the version changed, e.g. to clear the
+    caches of the results of the previous indexes.
+    '''
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self._version = 'unknown'
+        self._mtime = None
+        self._checked = None
+        self._listeners = []
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def get(self):
+        now = time.monotonic()
+        if self._checked is None or now - self._checked >= self.interval:
+            self._checked = now
+            self._check()
+        return self._version
+
+    def _check(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime != self._mtime:
+                with open(self.path, 'r', encoding='utf-8') as version_file:
+                    version = version_file.read().strip()
+                self._mtime = mtime
+                self._set(version)
+        except FileNotFoundError:
+            self._mtime = None
+            self._set('unknown')
+
+    def _set(self, version):
+        if version == self._version:
+            return
+        logger.info('Sphinx index version changed from %s to %s', self._version, version)
+        self._version = version
+        for listener in self._listeners:
+            listener()
+
+
+_index_version = IndexVersion(  # pylint: disable=invalid-name
+    SERVICE_SPHINX_FILE, SERVICE_SPHINX_VERSION_CHECK_INTERVAL
+)
+
+
+def get_index_version():
+    '''Return the current searchd index version'''
+    return _index_version.get()
+
+
+def on_index_version_change(listener):
+    '''Call the listener (without argument) each time the searchd index version changes'''
+    _index_version.subscribe(listener)
@@ -0,0 +1,149 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections import namedtuple
+
+from flask_caching.backends.base import BaseCache
+
+Entry = namedtuple('Entry', ['expires', 'value', 'size', 'namespace'])
+
+
+def namespace_of(key):
+    '''Return the namespace of a cache key, its prefix up to the first colon'''
+    namespace, sep, _ = key.partition(':')
+    return namespace if sep else 'default'
+
+
+def approximate_size(value):
+    '''Return the approximate memory size of a cached value in bytes'''
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(approximate_size(k) + approximate_size(v) for k, v in value.items())
+    elif hasattr(value, 'wkb'):
+        # the coordinates of a shapely geometry are not part of the python object
+        size += len(value.wkb)
+    return size
+
+
+class MemoryCache(BaseCache):
+    '''Flask-Caching backend keeping the values as they are in the worker memory
+
+    Unlike SimpleCache the values are neither pickled on set nor unpickled on get, the cached
+    object itself is returned: it must never be modified by the caller. The entries expire
+    after their timeout and the least recently used ones are evicted when the cache holds more
+    than `max_entries` entries or more than `max_bytes` (approximate size of the values).
+
+    The stats are counted per namespace, the key prefix up to the first colon
+    (e.g. `topics:...`).
+    '''
+
+    def __init__(
+        self, max_entries=10000, max_bytes=64 * 1024 * 1024, default_timeout=300, **kwargs
+    ):
+        super().__init__(default_timeout=default_timeout, **kwargs)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()  # key -> Entry, least recently used first
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(
+            max_entries=config['CACHE_MEMORY_MAX_ENTRIES'],
+            max_bytes=config['CACHE_MEMORY_MAX_BYTES'],
+        )
+        return cls(*args, **kwargs)
+
+    def _stats(self, namespace):
+        stats = self.stats.get(namespace)
+        if stats is None:
+            stats = self.stats[namespace] = {
+                'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'entries': 0, 'bytes': 0
+            }
+        return stats
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        stats = self._stats(entry.namespace)
+        stats['entries'] -= 1
+        stats['bytes'] -= entry.size
+        self.bytes -= entry.size
+        return entry
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires and entry.expires <= time.monotonic():
+            self._remove(key)
+            self._stats(entry.namespace)['expired'] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._get(key)
+            stats = self._stats(namespace_of(key))
+            if entry is None:
+                stats['misses'] += 1
+                return None
+            stats['hits'] += 1
+            return entry.value
+
+    def set(self, key, value, timeout=None):
+        return self._set(key, value, timeout, overwrite=True)
+
+    def add(self, key, value, timeout=None):
+        return self._set(key, value, timeout, overwrite=False)
+
+    def _set(self, key, value, timeout, overwrite):
+        timeout = self._normalize_timeout(timeout)
+        entry = Entry(
+            time.monotonic() + timeout if timeout > 0 else 0,
+            value,
+            approximate_size(value),
+            namespace_of(key)
+        )
+        if entry.size > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                if not overwrite and self._get(key) is not None:
+                    return False
+                if key in self._entries:
+                    self._remove(key)
+            self._entries[key] = entry
+            stats = self._stats(entry.namespace)
+            stats['entries'] += 1
+            stats['bytes'] += entry.size
+            self.bytes += entry.size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                evicted = self._remove(next(iter(self._entries)))
+                self._stats(evicted.namespace)['evicted'] += 1
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            return True
+
+    def has(self, key):
+        with self._lock:
+            return self._get(key) is not None
+
+    def clear(self):
+        with self._lock:
+            while self._entries:
+                self._remove(next(iter(self._entries)))
+        return True
+
+    def __len__(self):
+        return len(self._entries)
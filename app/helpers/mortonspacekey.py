@@ -96,11 +96,42 @@ class BBox:
         return [quad0, quad1, quad2, quad3]
 
 
+# base 4 digits of the bytes of an interleaved morton code, most significant first
+_BYTE_DIGITS = [''.join(str((byte >> shift) & 3) for shift in (6, 4, 2, 0)) for byte in range(256)]
+
+
+def _spread_bits(value):
+    '''returns the 32 bits integer value with a zero bit inserted before each bit'''
+    value &= 0xffffffff
+    value = (value | (value << 16)) & 0x0000ffff0000ffff
+    value = (value | (value << 8)) & 0x00ff00ff00ff00ff
+    value = (value | (value << 4)) & 0x0f0f0f0f0f0f0f0f
+    value = (value | (value << 2)) & 0x3333333333333333
+    value = (value | (value << 1)) & 0x5555555555555555
+    return value
+
+
 class QuadTree:
+    '''
+    Morton space keys of a square bbox, the quads being numbered
+    0 (top left), 1 (top right), 2 (bottom left) and 3 (bottom right).
+
+    The keys are computed with integers: the coordinates are quantized
+    to the cells of the deepest level (column from the left, row from
+    the top) and the key is the interleaving of their bits. A point on
+    the border of two quads belongs to the first one, as in a descent
+    of the quads in their order (see BBox.create_quads()). The cell
+    borders are exact as long as the bbox and its resolution are
+    representable floats, as for the swiss bbox of get_quadtree().
+    '''
 
     def __init__(self, bbox, levels):
         self.bbox = bbox
         self.levels = int(levels)
+        self.cells = 1 << self.levels
+        # origin and step of the borders of the cells of each axis
+        self._axes = ((bbox.minx, bbox.width() / self.cells),
+                      (bbox.maxy, -bbox.height() / self.cells))
 
     def __repr__(self):
         return f'QuadTree({self.bbox},{self.levels})'
@@ -113,23 +144,70 @@ class QuadTree:
         # assuming quadtree contains box which is a square
         return self.bbox.width() / math.pow(2, self.levels)
 
+    def _border(self, axis, index):
+        '''
+        returns the coordinate of the border index of the cells
+        of an axis (0: x from the left, 1: y from the top)
+        '''
+        origin, step = self._axes[axis]
+        return origin + index * step
+
+    def _quantize(self, axis, value):
+        '''
+        returns the (floor, ceil) indexes of the cells of a coordinate
+        inside the bbox: the first cell after the coordinate and the
+        last one before it, equal unless the coordinate is a border
+        '''
+        origin, step = self._axes[axis]
+        sign = 1 if step > 0 else -1
+        index = min(max(int((value - origin) / step), 0), self.cells - 1)
+        # the division might be rounded across a border, the sign of
+        # the difference of two floats is exact
+        while index >= 1 and (value - (origin + index * step)) * sign < 0:
+            index -= 1
+        while index < self.cells - 1 and (value - (origin + (index + 1) * step)) * sign >= 0:
+            index += 1
+        if index > 0 and value == origin + index * step:
+            return index, index - 1
+        return index, index
+
+    def _digits(self, column, row, length):
+        '''returns the first length digits of the morton key of a cell'''
+        code = (_spread_bits(row) << 1) | _spread_bits(column)
+        size = (2 * self.levels + 7) // 8
+        digits = ''.join(_BYTE_DIGITS[(code >> (8 * i)) & 0xff] for i in range(size - 1, -1, -1))
+        return digits[4 * size - self.levels:][:length]
+
     def xy_to_morton(self, x, y):
         '''
         creates the morton key space for a point
         returns empty string if point is not inside outer limits
         Note: returned key always has level length
         '''
-        res = '0'
         if not self.bbox.contains(x, y):
             return ''
-        curQuads = self.bbox.create_quads()
-        for _ in range(self.levels):
-            for j in range(4):
-                if curQuads[j].contains(x, y):
-                    res += str(j)
-                    curQuads = curQuads[j].create_quads()
-                    break
-        return res
+        # the last cell before the point is the first quad containing it
+        return '0' + self._digits(self._quantize(0, x)[1], self._quantize(1, y)[1], self.levels)
+
+    def morton_to_bbox(self, key):
+        '''
+        returns the bbox of the quad of a morton space key
+        '''
+        column = row = 0
+        for quad in key[1:]:
+            quad = int(quad)
+            column = (column << 1) | (quad & 1)
+            row = (row << 1) | (quad >> 1)
+        shift = self.levels - (len(key) - 1)
+        column <<= shift
+        row <<= shift
+        size = 1 << shift
+        return BBox(
+            self._border(0, column),
+            self._border(1, row + size),
+            self._border(0, column + size),
+            self._border(1, row)
+        )
 
     def points_to_morton(self, points):
         '''
@@ -137,28 +215,52 @@ class QuadTree:
         which contains _all_ points
         Note: returned key can have any length up to level
         '''
-
-        def contains_all_points(bbox, points):
-            return reduce(lambda res, p: (res and bbox.contains(p.x, p.y)), points, True)
-
-        res = '0'
-        if not contains_all_points(self.bbox, points):
+        if not all(self.bbox.contains(p.x, p.y) for p in points):
             return ''
-
-        curQuads = self.bbox.create_quads()
-        for _ in range(self.levels):
-            has_quad = False
-            for j in range(4):
-                if contains_all_points(curQuads[j], points):
-                    has_quad = True
-                    res += str(j)
-                    curQuads = curQuads[j].create_quads()
-                if len(res) > self.levels:
-                    return res
-            if not has_quad:
-                return res
+        # a quad contains all the points if it contains the cells from the
+        # smallest floor index to the largest ceil index on both axes
+        xs = [self._quantize(0, p.x) for p in points]
+        ys = [self._quantize(1, p.y) for p in points]
+        first = (min(floor for floor, _ in xs), min(floor for floor, _ in ys))
+        last = (max(ceil for _, ceil in xs), max(ceil for _, ceil in ys))
+        if first[0] <= last[0] and first[1] <= last[1]:
+            # the common quads are the common leading bits of both cells
+            length = self.levels - max((first[0] ^ last[0]).bit_length(),
+                                       (first[1] ^ last[1]).bit_length())
+            return '0' + self._digits(first[0], first[1], length)
+        return self._points_on_border_to_morton(first, last)
+
+    def _points_on_border_to_morton(self, first, last):
+        '''
+        returns the key of points all on the same border of the cells
+        on an axis, contained by two quads at some levels. As in the
+        descent of the quads, the quad chosen at a level is the next
+        quad containing the points after the quad chosen at the
+        previous level, else the first one.
+        '''
+        res = '0'
+        column = row = 0
+        previous = -1
+        for level in range(1, self.levels + 1):
+            shift = self.levels - level
+            quads = [
+                quad for quad in range(4)
+                if self._contains_cells(2 * row + (quad >> 1), shift, first[1], last[1]) and
+                self._contains_cells(2 * column + (quad & 1), shift, first[0], last[0])
+            ]
+            if not quads:
+                break
+            quad = next((quad for quad in quads if quad > previous), quads[0])
+            res += str(quad)
+            column = 2 * column + (quad & 1)
+            row = 2 * row + (quad >> 1)
+            previous = quad
         return res
 
+    @staticmethod
+    def _contains_cells(index, shift, first, last):
+        return (index << shift) <= first and last < ((index + 1) << shift)
+
     def bbox_to_morton(self, bbox):
         '''
         We either take the intersection of bbox with
@@ -168,6 +270,37 @@ class QuadTree:
         intbox = self.bbox.getIntersection(bbox)
         return self._multi_points_dia1(intbox)
 
+    def bbox_to_morton_cover(self, bbox, max_keys):
+        '''
+        returns the sorted keys of the quads of the deepest level
+        covering the bbox with at most max_keys quads, or the key of
+        bbox_to_morton() (a single quad). A small bbox across the
+        border of two large quads is covered by small quads instead
+        of their common parent.
+        '''
+        intbox = self.bbox.getIntersection(bbox)
+        key = self._multi_points_dia1(intbox)
+        if key == '':
+            return []
+        xs = [self._quantize(0, intbox.minx), self._quantize(0, intbox.maxx)]
+        ys = [self._quantize(1, intbox.maxy), self._quantize(1, intbox.miny)]
+        # the floor index is after the ceil one for a bbox on a border
+        columns = sorted((xs[0][0], xs[1][1]))
+        rows = sorted((ys[0][0], ys[1][1]))
+        keys = [key]
+        for level in range(len(key), self.levels + 1):
+            shift = self.levels - level
+            count = ((columns[1] >> shift) - (columns[0] >> shift) + 1) * \
+                ((rows[1] >> shift) - (rows[0] >> shift) + 1)
+            if count > max_keys:
+                break
+            keys = sorted(
+                '0' + self._digits(column << shift, row << shift, level)
+                for column in range(columns[0] >> shift, (columns[1] >> shift) + 1)
+                for row in range(rows[0] >> shift, (rows[1] >> shift) + 1)
+            )
+        return keys
+
     # next 6 functions should deliver the same result
     #   -> the morton space key of the the quad that fully contains the bbox
     # functions written to
@@ -216,3 +349,11 @@ class QuadTree:
 
     def _multi_points_dia2(self, bbox):
         return self.points_to_morton([bbox.pointAt(1), bbox.pointAt(3)])
+
+
+_quadtree = QuadTree(BBox(420000, 30000, 900000, 510000), 20)
+
+
+def get_quadtree():
+    '''Return the quadtree of the geom_quadindex attribute of the swiss search indexes'''
+    return _quadtree
@@ -0,0 +1,54 @@
+import time
+from collections import OrderedDict
+
+from app.helpers.index_version import get_index_version
+
+
+class QueryCache:
+    '''Cache of the searchd responses of the queries (see SphinxClient.SetResultCache())
+
+    At most `size` responses are kept (LRU) for `ttl` seconds. The responses are bound to the
+    index version they were received with, they are dropped on their first access after the
+    indexes have been rebuilt, or all at once by invalidate() (see on_index_version_change()).
+    '''
+
+    def __init__(self, size, ttl, version=get_index_version):
+        self.size = size
+        self.ttl = ttl
+        self.version = version
+        self._entries = OrderedDict()  # key -> (expires, version, response)
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'invalidated': 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        # first, the version check might invalidate the whole cache
+        current = self.version()
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+        expires, version, response = entry
+        if expires <= time.monotonic() or version != current:
+            del self._entries[key]
+            self.stats['expired' if version == current else 'invalidated'] += 1
+            self.stats['misses'] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats['hits'] += 1
+        return response
+
+    def set(self, key, response):
+        self._entries[key] = (time.monotonic() + self.ttl, self.version(), response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def invalidate(self):
+        '''Drop all the responses of the previous index version'''
+        self.stats['invalidated'] += len(self._entries)
+        self.clear()
@@ -0,0 +1,199 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+from app.settings import SEARCH_QUERY_CACHE_SIZE
+
+# Minimal length of a single keyword that is trimmed step by step by the fuzzy query
+FUZZY_PREFIX_MIN_LENGTH = 5
+# Quorum operator used for the fuzzy query, might need some tweaking together with the
+# @weight filter of Search._fuzzy_search()
+FUZZY_QUORUM = '/0.7'
+PROXIMITY = '~5'
+
+LEADING_DIGITS = re.compile(r'^\d+')
+
+# Intermediate representation of a query, rendered by render_query():
+#   Phrase: "^term term$"operator, start and end are the ^ and $ anchors
+#   Keywords: term term
+#   Alternatives: ((term term) | (term term))
+Phrase = namedtuple('Phrase', ['terms', 'start', 'end', 'operator'])
+Keywords = namedtuple('Keywords', ['terms'])
+Alternatives = namedtuple('Alternatives', ['branches'])
+
+# Branches to send (see query_planner.plan_query()): infix is a tuple with a flag per token,
+# the tokens without infix expansion are only prefixed; proximity enables the ~5 phrases
+QueryPlan = namedtuple('QueryPlan', ['infix', 'proximity'])
+
+
+def is_digit(term):
+    # 10a, 10b needs to be interpreted as digit
+    return '0' <= term[:1] <= '9'
+
+
+def prefix_non_digit(term):
+    return term if is_digit(term) else f'{term}*'
+
+
+def infix_non_digit(term):
+    return term if is_digit(term) else f'*{term}*'
+
+
+def prefix_digit(term):
+    return f'{term}*' if is_digit(term) else term
+
+
+def prefix_all(term):
+    return f'{term}*'
+
+
+def infix_non_digit_prefix_digit(term):
+    return f'{term}*' if is_digit(term) else f'*{term}*'
+
+
+def digit_or_term(term):
+    '''Return the alternative (digit|digit+rest) of a keyword starting with a digit
+
+    examples:
+        4a          -> (4|4a)
+        342         -> 342
+        sometext    -> sometext
+    '''
+    if is_digit(term):
+        digit = LEADING_DIGITS.match(term)
+        if digit is not None and digit.group() != term:
+            return f'({digit.group()}|{term})'
+    return term
+
+
+def exact_phrases(terms):
+    return [
+        Phrase(terms, False, False, ''),
+        Phrase(terms, True, False, ''),
+        Phrase(terms, False, True, ''),
+        Phrase(terms, True, True, ''),
+    ]
+
+
+def trimmed_prefixes(tokens, min_length=FUZZY_PREFIX_MIN_LENGTH):
+    '''Trim the text keywords by one character until the longest one has min_length
+
+    The digit keywords are never trimmed, each trimming step is an alternative.
+    '''
+    tokens = list(tokens)
+    lengths = [len(token) for token in tokens if not is_digit(token)]
+    if not lengths:
+        return Keywords(tuple(map(digit_or_term, tokens)))
+    branches = []
+    while max(lengths) > min_length:
+        tokens = [
+            token[:-1] if not is_digit(token) and len(token) >= min_length else token
+            for token in tokens
+        ]
+        lengths = [len(token) for token in tokens if not is_digit(token)]
+        branches.append(Keywords(tuple(map(digit_or_term, tokens))))
+    return Alternatives(tuple(branches))
+
+
+def compile_query(tokens, fuzzy=False, plan=None):
+    '''Compile the normalized search tokens into the query intermediate representation
+
+    The branches are ordered by priority: exact, prefix and infix phrases, for the keywords
+    starting with a digit (10a, 10b, ...) digit aware prefix phrases are added. The fuzzy
+    query is a quorum of the keywords, a single long keyword is additionally trimmed step by
+    step.
+
+    With a QueryPlan the infix and proximity branches are pruned, see prune_branches().
+    '''
+    if fuzzy:
+        # digit/text combinations are replaced with (digit|digit/text) p.e. 4a -> (4|4a)
+        branches = [Phrase(tuple(map(digit_or_term, tokens)), False, False, FUZZY_QUORUM)]
+        if len(tokens) == 1 and len(tokens[0]) > FUZZY_PREFIX_MIN_LENGTH:
+            branches.append(trimmed_prefixes(tokens))
+        return tuple(branches)
+
+    branches = []
+    has_digit = any(map(is_digit, tokens))
+    if not all(map(is_digit, tokens)):
+        prefix = tuple(map(prefix_non_digit, tokens))
+        infix = tuple(map(infix_non_digit, tokens))
+        branches = exact_phrases(tokens) + [
+            Phrase(tokens, False, False, PROXIMITY),
+            Phrase(prefix, False, False, ''),
+            Phrase(prefix, True, False, ''),
+            Phrase(prefix, False, False, PROXIMITY),
+            Phrase(infix, False, False, ''),
+            Phrase(infix, True, False, ''),
+            Phrase(infix, False, False, PROXIMITY),
+        ]
+    if has_digit:
+        prefix = tuple(map(prefix_digit, tokens))
+        prefix_all_ = tuple(map(prefix_all, tokens))
+        # exact matches first (highest priority for ranking), then prefix matches
+        branches = exact_phrases(tokens) + branches + [
+            Phrase(prefix, False, False, ''),
+            Phrase(prefix, True, False, ''),
+            Phrase(prefix_all_, False, False, ''),
+            Phrase(prefix_all_, False, False, PROXIMITY),
+            Phrase(tuple(map(infix_non_digit_prefix_digit, tokens)), False, False, ''),
+        ]
+    if plan is not None:
+        branches = prune_branches(tokens, branches, plan)
+    return tuple(branches)
+
+
+def prune_branches(tokens, branches, plan):
+    '''Remove the infix expansion of the tokens and the proximity phrases not in the plan
+
+    An infix term *token* is replaced by the prefix term token*, the infix phrases left
+    without any infix term (now repeating a prefix phrase) are removed.
+    '''
+    infix = {f'*{token}*': f'{token}*' for token, keep in zip(tokens, plan.infix) if not keep}
+    pruned = []
+    for branch in branches:
+        if not plan.proximity and branch.operator == PROXIMITY:
+            continue
+        if any(term.startswith('*') for term in branch.terms):
+            terms = tuple(infix.get(term, term) for term in branch.terms)
+            if not any(term.startswith('*') for term in terms):
+                continue
+            branch = branch._replace(terms=terms)
+        pruned.append(branch)
+    return pruned
+
+
+def render_branch(branch):
+    if isinstance(branch, Phrase):
+        start = '^' if branch.start else ''
+        end = '$' if branch.end else ''
+        return f'"{start}{" ".join(branch.terms)}{end}"{branch.operator}'
+    if isinstance(branch, Alternatives):
+        return f"({' | '.join(f'({render_branch(b)})' for b in branch.branches)})"
+    return ' '.join(branch.terms)
+
+
+def render_query(fields, branches):
+    '''Render the compiled query branches as OR'ed sphinx extended syntax on the fields'''
+    return ' | '.join(f'{fields} {render_branch(branch)}' for branch in branches)
+
+
+@lru_cache(maxsize=SEARCH_QUERY_CACHE_SIZE)
+def query_fields(fields, tokens, fuzzy=False, plan=None):
+    '''Return the sphinx query of the search tokens (a tuple) on the fields
+
+    The queries are memoized per worker, typeahead requests repeat the same short prefixes.
+    '''
+    return render_query(fields, compile_query(tokens, fuzzy, plan))
+
+
+@lru_cache(maxsize=SEARCH_QUERY_CACHE_SIZE)
+def quadindex_filter(quadindexes):
+    '''Return the sphinx filter of the geom_quadindex morton keys (a tuple) and of all their
+    parent quads
+
+    The filters are memoized per worker, the panned map bboxes repeat the same keys.
+    '''
+    parents = sorted({key[:i] for key in quadindexes for i in range(1, len(key))},
+                     key=lambda parent: (-len(parent), parent))
+    return ' | '.join([f'@geom_quadindex {key}*' for key in quadindexes] +
+                      [f'@geom_quadindex {parent}' for parent in parents])
@@ -0,0 +1,94 @@
+import re
+from collections import OrderedDict
+
+from app.helpers.query_compiler import QueryPlan
+from app.helpers.query_compiler import is_digit
+from app.settings import SEARCH_QUERY_INFIX_MIN_LENGTH
+from app.settings import SEARCH_QUERY_PRUNE_DOCS
+from app.settings import SEARCH_QUERY_STATS_SIZE
+
+# a word of at least 4 letters without any vowel is most likely a typo
+NO_VOWEL = re.compile(r'[^\W\daeiouy]{4,}', re.IGNORECASE)
+
+
+class KeywordStats:
+    '''Per index documents count of the query keywords, as returned by searchd
+
+    Every search result reports the docs and hits of its keywords (result['words']), including
+    the wildcard ones like `wald*`. The most recent counts are kept in a LRU of at most `size`
+    keywords.
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self._docs = OrderedDict()  # (index, word) -> docs
+
+    def __len__(self):
+        return len(self._docs)
+
+    def update(self, index, words):
+        for word in words:
+            key = (index, word['word'])
+            self._docs[key] = word['docs']
+            self._docs.move_to_end(key)
+        while len(self._docs) > self.size:
+            self._docs.popitem(last=False)
+
+    def docs(self, index, word):
+        return self._docs.get((index, word))
+
+
+def plan_query(tokens, index, stats):
+    '''Decide which expensive branches of the query of the tokens are worth sending
+
+    The infix expansion (*token*) of a token is skipped when the token is shorter than
+    SEARCH_QUERY_INFIX_MIN_LENGTH, or when its prefix (token*) already matched more than
+    SEARCH_QUERY_PRUNE_DOCS documents of the index. The proximity phrases are only sent with
+    more than one token (a single keyword proximity is the phrase itself).
+
+    Returns None when all the branches are sent.
+    '''
+    infix = tuple(
+        is_digit(token) or (
+            len(token) >= SEARCH_QUERY_INFIX_MIN_LENGTH and
+            (stats.docs(index, f'{token.lower()}*') or 0) <= SEARCH_QUERY_PRUNE_DOCS
+        ) for token in tokens
+    )
+    proximity = len(tokens) > 1
+    if all(infix) and proximity:
+        return None
+    return QueryPlan(infix, proximity)
+
+
+def likely_misspelled(tokens, index, stats):
+    '''Guess if the standard query of the tokens will find nothing
+
+    A text token is likely misspelled when searchd already reported that the token, or one of
+    its prefixes (typed before), matched no document of the index as prefix (token*) or infix
+    (*token*) keyword, or when its shape is unlikely (no vowel). Prefixes shorter than
+    SEARCH_QUERY_INFIX_MIN_LENGTH are ignored, searchd might not expand them.
+    '''
+    for token in tokens:
+        if is_digit(token):
+            continue
+        if NO_VOWEL.fullmatch(token):
+            return True
+        # searchd reports the normalized (lower case) keywords
+        token = token.lower()
+        for end in range(len(token), SEARCH_QUERY_INFIX_MIN_LENGTH - 1, -1):
+            prefix = token[:end]
+            if stats.docs(index, f'*{prefix}*') == 0 or stats.docs(index, f'{prefix}*') == 0:
+                return True
+    return False
+
+
+_stats = KeywordStats(SEARCH_QUERY_STATS_SIZE)  # pylint: disable=invalid-name
+
+
+def get_keyword_stats():
+    '''Return the keyword statistics of the worker process
+
+    The statistics are only learned from the search results of the worker, they are not
+    shared between the workers.
+    '''
+    return _stats
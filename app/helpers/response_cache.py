@@ -0,0 +1,216 @@
+import time
+from collections import OrderedDict
+from collections import namedtuple
+from hashlib import blake2b
+
+from flask import current_app
+
+from app.helpers.heavy_hitters import SpaceSaving
+from app.helpers.index_version import get_index_version
+from app.helpers.index_version import on_index_version_change
+from app.helpers.utils import accepts_gzip
+from app.settings import SEARCH_RESPONSE_CACHE_BYTES
+from app.settings import SEARCH_RESPONSE_CACHE_HOT_KEYS
+from app.settings import SEARCH_RESPONSE_CACHE_STALE
+from app.settings import SEARCH_RESPONSE_CACHE_TTL
+from app.settings import SUPPORTED_LANGUAGES
+from app.version import APP_VERSION
+
+# retry: time of the next refresh attempt while a request is refreshing the response, else 0
+CachedResponse = namedtuple(
+    'CachedResponse', ['expires', 'version', 'status', 'headers', 'body', 'size', 'retry']
+)
+
+# part of the ttl before the expiry during which the hot responses are refreshed
+REFRESH_AHEAD = 0.1
+# seconds before another request refreshes a response whose refresh is pending or failed
+REFRESH_RETRY = 5
+# header of the expired responses served while refreshing or after a failed refresh
+STALE_HEADER = ('X-Cache-Status', 'STALE')
+
+
+def response_cache_key(request):
+    '''Return the key of the response of the request
+
+    The query string is canonicalized (sorted parameters), the negotiated language (without lang
+    parameter), JSONP content type (with callback parameter) and encoding are part of the key.
+    '''
+    args = tuple(sorted(request.args.items(multi=True)))
+    lang = None
+    if 'lang' not in request.args:
+        lang = request.accept_languages.best_match(SUPPORTED_LANGUAGES)
+    mimetype = None
+    if 'callback' in request.args:
+        mimetype = request.accept_mimetypes.best_match([
+            "text/javascript", "application/javascript"
+        ])
+    return (request.path, args, lang, mimetype, accepts_gzip(request))
+
+
+def response_etag(key, version):
+    '''Return the strong ETag of the response of the key (see response_cache_key())
+
+    The responses of a request only change with the index version and the application version,
+    the ETag can therefore be compared before any search.
+    '''
+    return blake2b(repr((APP_VERSION, version, key)).encode(), digest_size=16).hexdigest()
+
+
+class ResponseCache:  # pylint: disable=too-many-instance-attributes
+    '''Cache of the final response bodies of a route, already serialized and compressed
+
+    The bodies and their headers are kept for `ttl` seconds, the least recently used ones are
+    evicted when their total size exceeds `max_bytes`. Like the query cache (see QueryCache),
+    the responses are dropped once the index version changed, see invalidate().
+
+    With `hot_keys` the requested keys are counted by a SpaceSaving sketch of this capacity.
+    The responses of its heavy hitters are pinned: they are only evicted when all the cached
+    responses are pinned, and the first request of such a response during the last
+    REFRESH_AHEAD part of its ttl gets a miss to refresh it, while the other requests are still
+    served the cached response.
+
+    With `stale` the expired responses are kept during this amount of seconds more
+    (stale-while-revalidate and stale-if-error): the first request of an expired response gets
+    a miss to refresh it while the other requests are served the stale response (see
+    STALE_HEADER), and the stale response is returned by get_stale() when the refresh failed.
+    The refresh is then retried by a request only every REFRESH_RETRY seconds.
+    '''
+
+    def __init__(self, max_bytes, ttl, version=get_index_version, hot_keys=0, stale=0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version = version
+        self.stale = stale
+        self.bytes = 0
+        self._entries = OrderedDict()  # key -> CachedResponse
+        self.hot = SpaceSaving(hot_keys) if hot_keys > 0 else None
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'invalidated': 0,
+            'evicted': 0,
+            'refreshed': 0,
+            'stale': 0
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        '''Return a new response from the cached response of the key, None if not cached'''
+        if self.hot is not None:
+            self.hot.add(key)
+        # first, the version check might invalidate the whole cache
+        version = self.version()
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+        now = time.monotonic()
+        if entry.expires + self.stale <= now or entry.version != version:
+            self._remove(key)
+            self.stats['expired' if entry.version == version else 'invalidated'] += 1
+            self.stats['misses'] += 1
+            return None
+        self._entries.move_to_end(key)
+        expired = entry.expires <= now
+        if entry.retry <= now:
+            if expired:
+                self._entries[key] = entry._replace(retry=now + REFRESH_RETRY)
+                self.stats['misses'] += 1
+                return None
+            if entry.expires - now <= self.ttl * REFRESH_AHEAD and self.is_pinned(key):
+                self._entries[key] = entry._replace(retry=now + REFRESH_RETRY)
+                self.stats['refreshed'] += 1
+                return None
+        # fresh, or refreshed by another request
+        self.stats['stale' if expired else 'hits'] += 1
+        return self._response(entry, expired)
+
+    def get_stale(self, key):
+        '''Return a new response from the cached response of the key, even expired within the
+        stale period, None if not cached. Used when the refresh of the response failed.
+        '''
+        entry = self._entries.get(key)
+        if entry is None or entry.version != self.version():
+            return None
+        now = time.monotonic()
+        if entry.expires + self.stale <= now:
+            return None
+        self._entries[key] = entry._replace(retry=now + REFRESH_RETRY)
+        self.stats['stale'] += 1
+        return self._response(entry, entry.expires <= now)
+
+    @staticmethod
+    def _response(entry, stale):
+        response = current_app.response_class(
+            entry.body, status=entry.status, headers=entry.headers
+        )
+        if stale:
+            response.headers[STALE_HEADER[0]] = STALE_HEADER[1]
+        return response
+
+    def set(self, key, response):
+        body = response.get_data()
+        headers = list(response.headers.items())
+        size = len(body) + sum(len(name) + len(value) for name, value in headers)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = CachedResponse(
+            time.monotonic() + self.ttl,
+            self.version(),
+            response.status_code,
+            headers,
+            body,
+            size,
+            0
+        )
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            self._remove(self._eviction_candidate())
+            self.stats['evicted'] += 1
+
+    def is_pinned(self, key):
+        return self.hot is not None and self.hot.is_heavy(key)
+
+    def _eviction_candidate(self):
+        '''Return the least recently used key not pinned, or the least recently used one'''
+        for key in self._entries:
+            if not self.is_pinned(key):
+                return key
+        return next(iter(self._entries))
+
+    def top(self, n=10):
+        '''Return the n most requested keys, see SpaceSaving.top()'''
+        return self.hot.top(n) if self.hot is not None else []
+
+    def _remove(self, key):
+        self.bytes -= self._entries.pop(key).size
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def invalidate(self):
+        '''Drop all the responses of the previous index version'''
+        self.stats['invalidated'] += len(self._entries)
+        self.clear()
+
+
+_response_cache = None  # pylint: disable=invalid-name
+if SEARCH_RESPONSE_CACHE_BYTES > 0:
+    _response_cache = ResponseCache(  # pylint: disable=invalid-name
+        SEARCH_RESPONSE_CACHE_BYTES,
+        SEARCH_RESPONSE_CACHE_TTL,
+        hot_keys=SEARCH_RESPONSE_CACHE_HOT_KEYS,
+        stale=SEARCH_RESPONSE_CACHE_STALE
+    )
+    on_index_version_change(_response_cache.invalidate)
+
+
+def get_response_cache():
+    '''Return the response cache of the worker process, None when disabled'''
+    return _response_cache
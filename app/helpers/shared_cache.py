@@ -0,0 +1,250 @@
+import fcntl
+import logging
+import mmap
+import os
+import threading
+import time
+from contextlib import contextmanager
+from hashlib import blake2b
+from struct import Struct
+
+from cachelib.serializers import BaseSerializer
+from flask_caching.backends.base import BaseCache
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SRCHSHM2'
+# magic, number of slots, slot size, access clock
+HEADER = Struct('<8sIIQ')
+# key hash (0: empty or continued slot), expires (0: never), last access clock, value length,
+# key length, span (number of slots of the entry, minus the distance to the first slot of the
+# entry for a continued slot)
+SLOT_HEADER = Struct('<QdQIHi')
+# slots probed for a key, the least recently used entries are evicted when all are taken
+PROBES = 8
+
+
+def key_hash(key):
+    # the builtin hash() is randomized per process
+    return int.from_bytes(blake2b(key, digest_size=8).digest(), 'little') or 1
+
+
+class SharedMemoryCache(BaseCache):  # pylint: disable=too-many-instance-attributes
+    '''Flask-Caching backend shared by all the worker processes of a host
+
+    The entries are pickled into a fixed size hash table in a memory mapped file (e.g. in
+    /dev/shm), shared by the gunicorn workers, so each value is cached once per host instead of
+    once per worker. The table has about `size // slot_size` slots, an entry is stored in as
+    many consecutive slots as needed, starting at one of the PROBES slots following the hash of
+    its key. When they are all taken the least recently used entries in the way are evicted.
+    Values spanning more than a PROBES-th of the slots are not cached.
+
+    The headers of the slots precede the data of the slots, so the data of an entry is
+    contiguous (except when it wraps around the end of the table).
+
+    The table is locked with flock() on a file descriptor opened per process (the descriptors
+    inherited from the gunicorn master share their lock), and with a thread lock within the
+    process. The stats are counted per process.
+    '''
+
+    def __init__(self, path, size, slot_size=1024, default_timeout=300, **kwargs):
+        super().__init__(default_timeout=default_timeout, **kwargs)
+        self.path = path
+        self.slot_size = slot_size
+        self.nslots = max((size - HEADER.size) // (SLOT_HEADER.size + slot_size), PROBES)
+        self.max_span = self.nslots // PROBES
+        self.serializer = BaseSerializer()
+        self.stats = {'hits': 0, 'misses': 0, 'sets': 0, 'evicted': 0, 'too_large': 0}
+        self._thread_lock = threading.Lock()
+        self._fd = None
+        self._fd_pid = None
+        self._open()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(
+            path=config['CACHE_SHARED_PATH'],
+            size=config['CACHE_SHARED_SIZE'],
+            slot_size=config['CACHE_SHARED_SLOT_SIZE'],
+        )
+        return cls(*args, **kwargs)
+
+    def _open(self):
+        length = self._data(self.nslots)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._fd_pid = os.getpid()
+        with self._locked():
+            if os.fstat(self._fd).st_size != length:
+                os.ftruncate(self._fd, length)
+            self._map = mmap.mmap(self._fd, length)
+            magic, nslots, slot_size, _ = HEADER.unpack_from(self._map, 0)
+            if (magic, nslots, slot_size) != (MAGIC, self.nslots, self.slot_size):
+                logger.info('Initialize shared cache %s with %d slots', self.path, self.nslots)
+                self._map[:] = bytes(length)
+                HEADER.pack_into(self._map, 0, MAGIC, self.nslots, self.slot_size, 0)
+
+    @contextmanager
+    def _locked(self):
+        if self._fd_pid != os.getpid():
+            # forked worker: the inherited descriptor shares the lock of the other processes
+            os.close(self._fd)
+            self._fd = os.open(self.path, os.O_RDWR)
+            self._fd_pid = os.getpid()
+        with self._thread_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _tick(self):
+        magic, nslots, slot_size, clock = HEADER.unpack_from(self._map, 0)
+        HEADER.pack_into(self._map, 0, magic, nslots, slot_size, clock + 1)
+        return clock + 1
+
+    def _header(self, slot):
+        return SLOT_HEADER.unpack_from(self._map, HEADER.size + slot * SLOT_HEADER.size)
+
+    def _set_header(self, slot, *fields):
+        SLOT_HEADER.pack_into(self._map, HEADER.size + slot * SLOT_HEADER.size, *fields)
+
+    def _data(self, slot):
+        return HEADER.size + self.nslots * SLOT_HEADER.size + slot * self.slot_size
+
+    def _read(self, slot, length):
+        begin, end = self._data(slot), self._data(self.nslots)
+        if begin + length <= end:
+            return self._map[begin:begin + length]
+        # wrapped around the end of the table
+        return self._map[begin:end] + self._map[self._data(0):self._data(0) + begin + length - end]
+
+    def _write(self, slot, data):
+        begin = self._data(slot)
+        split = min(len(data), self._data(self.nslots) - begin)
+        self._map[begin:begin + split] = data[:split]
+        self._map[self._data(0):self._data(0) + len(data) - split] = data[split:]
+
+    def _head(self, slot):
+        '''Return the first slot of the entry using the slot, None if the slot is empty'''
+        hashed, _, _, _, _, span = self._header(slot)
+        if span < 0:
+            return (slot + span) % self.nslots
+        return slot if hashed else None
+
+    def _remove(self, head):
+        span = self._header(head)[5]
+        for i in range(span):
+            self._set_header((head + i) % self.nslots, 0, 0, 0, 0, 0, 0)
+
+    def _find(self, key, hashed):
+        '''Return the first slot of the entry of the key, None if not found'''
+        start = hashed % self.nslots
+        for i in range(PROBES):
+            slot = (start + i) % self.nslots
+            slot_hash, _, _, _, key_length, _ = self._header(slot)
+            if slot_hash == hashed and self._read(slot, key_length) == key:
+                return slot
+        return None
+
+    def _allocate(self, hashed, span, now):
+        '''Return the first of `span` consecutive slots freed for the key
+
+        Of the runs starting at the PROBES slots following the hash, the first one without
+        entries in use is taken, else the one whose most recently used entry is the least
+        recently used. The entries in the way are removed.
+        '''
+        start = hashed % self.nslots
+        lru_used, lru_slot, lru_heads = None, None, None
+        for i in range(PROBES):
+            slot = (start + i) % self.nslots
+            heads = {self._head((slot + j) % self.nslots) for j in range(span)} - {None}
+            used = 0
+            for head in heads:
+                _, expires, head_used, _, _, _ = self._header(head)
+                if not 0 < expires <= now:
+                    used = max(used, head_used)
+            if lru_used is None or used < lru_used:
+                lru_used, lru_slot, lru_heads = used, slot, heads
+            if used == 0:
+                break
+        if lru_used:
+            self.stats['evicted'] += 1
+        for head in lru_heads:
+            self._remove(head)
+        return lru_slot
+
+    def _get(self, key):
+        hashed = key_hash(key)
+        slot = self._find(key, hashed)
+        if slot is None:
+            return None
+        _, expires, _, value_length, key_length, span = self._header(slot)
+        if 0 < expires <= time.time():
+            self._remove(slot)
+            return None
+        self._set_header(slot, hashed, expires, self._tick(), value_length, key_length, span)
+        return self._read(slot, key_length + value_length)[key_length:]
+
+    def get(self, key):
+        with self._locked():
+            value = self._get(key.encode())
+        if value is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        return self.serializer.loads(value)
+
+    def set(self, key, value, timeout=None):
+        return self._set(key, value, timeout, overwrite=True)
+
+    def add(self, key, value, timeout=None):
+        return self._set(key, value, timeout, overwrite=False)
+
+    def _set(self, key, value, timeout, overwrite):
+        key = key.encode()
+        value = self.serializer.dumps(value)
+        if value is None:
+            return False
+        span = -(-(len(key) + len(value)) // self.slot_size)
+        if span > self.max_span:
+            self.stats['too_large'] += 1
+            return False
+        timeout = self._normalize_timeout(timeout)
+        now = time.time()
+        expires = now + timeout if timeout > 0 else 0
+        hashed = key_hash(key)
+        with self._locked():
+            slot = self._find(key, hashed)
+            if slot is not None:
+                if not overwrite and self._get(key) is not None:
+                    return False
+                self._remove(slot)
+            slot = self._allocate(hashed, span, now)
+            self._set_header(slot, hashed, expires, self._tick(), len(value), len(key), span)
+            for i in range(1, span):
+                self._set_header((slot + i) % self.nslots, 0, 0, 0, 0, 0, -i)
+            self._write(slot, key + value)
+        self.stats['sets'] += 1
+        return True
+
+    def delete(self, key):
+        key = key.encode()
+        with self._locked():
+            slot = self._find(key, key_hash(key))
+            if slot is None:
+                return False
+            self._remove(slot)
+        return True
+
+    def has(self, key):
+        with self._locked():
+            return self._get(key.encode()) is not None
+
+    def clear(self):
+        with self._locked():
+            self._map[HEADER.size:] = bytes(len(self._map) - HEADER.size)
+        return True
+
+    def __len__(self):
+        with self._locked():
+            return sum(1 for slot in range(self.nslots) if self._header(slot)[0])
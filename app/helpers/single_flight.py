@@ -0,0 +1,67 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Flight:  # pylint: disable=too-few-public-methods
+    '''An in-flight call whose result is shared with the identical calls'''
+
+    def __init__(self):
+        self.result = None
+        self.exception = None
+        self.done = threading.Event()
+
+
+class SingleFlight:
+    '''Coalescing of the identical in-flight calls of a worker
+
+    The first call of a key runs the function, the identical calls arriving while it is in
+    flight wait for it and get the same result (or exception) instead of running the function
+    again. Nothing is kept once the call has finished, this is not a cache.
+
+    The stats count the calls that ran the function (`calls`), the calls that waited for an
+    in-flight one (`waits`) and the waiting calls that got its result (`hits`).
+    '''
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'waits': 0, 'hits': 0}
+
+    def __len__(self):
+        return len(self._flights)
+
+    def do(self, key, function):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+                self.stats['calls'] += 1
+            else:
+                self.stats['waits'] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.exception is not None:
+                raise flight.exception
+            self.stats['hits'] += 1
+            return flight.result
+        try:
+            flight.result = function()
+            return flight.result
+        except Exception as exception:
+            flight.exception = exception
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+_single_flight = SingleFlight()  # pylint: disable=invalid-name
+
+
+def get_single_flight():
+    '''Return the single flight of the worker process'''
+    return _single_flight
@@ -0,0 +1,130 @@
+import logging
+import threading
+import time
+
+from werkzeug.exceptions import GatewayTimeout
+
+logger = logging.getLogger(__name__)
+
+
+class BatchEntry:  # pylint: disable=too-few-public-methods, too-many-instance-attributes
+    '''The queries of one RunQueries() call waiting to be dispatched'''
+
+    def __init__(self, reqs, transform, lazy):
+        self.reqs = reqs
+        self.transform = transform
+        self.lazy = lazy
+        self.results = None
+        self.error = ''
+        self.exception = None
+        self.lead = False  # the entry must dispatch the next batch
+        self.done = threading.Event()
+
+
+class SearchBatcher:  # pylint: disable=too-few-public-methods
+    '''Micro-batching of the searchd queries of the concurrent requests of a worker
+
+    The SphinxClient.RunQueries() calls of the concurrent greenlets are collected during
+    `window` seconds and sent as one searchd search command of at most `max_queries` queries
+    (searchd max_batch_queries), the result sets are then fanned back to the callers.
+
+    The first caller of an empty queue leads: it waits for the window, then sends the batch
+    with a client of the pool. The queries of one caller are never split, if they do not fit
+    the batch the first remaining caller is promoted to lead the next batch right away.
+
+    A caller that stops waiting (killed greenlet, timeout) before its queries were dispatched
+    leaves the queue, and if it was to dispatch the batch the next caller is promoted. The
+    callers wait at most `window` + `timeout` seconds for their batch, then GatewayTimeout is
+    raised.
+
+    threading.Event, threading.Lock and time.sleep() are patched by gevent in the gunicorn
+    workers, they also work with plain threads.
+    '''
+
+    def __init__(self, pool, window, max_queries, timeout):
+        self.pool = pool
+        self.window = window
+        self.max_queries = max_queries
+        self.timeout = timeout
+        self._pending = []
+        self._lock = threading.Lock()
+        self.stats = {'batches': 0, 'queries': 0, 'callers': 0}
+
+    def __call__(self, reqs, transform, lazy):
+        '''Run the queries in the next batch, return their (results, error)'''
+        entry = BatchEntry(reqs, transform, lazy)
+        with self._lock:
+            self._pending.append(entry)
+            leader = len(self._pending) == 1
+        try:
+            if leader:
+                time.sleep(self.window)
+                self._dispatch()
+            self._wait(entry)
+            if entry.lead:
+                entry.lead = False
+                entry.done.clear()
+                self._dispatch()
+                self._wait(entry)
+        finally:
+            self._leave(entry)
+        if entry.exception is not None:
+            raise entry.exception
+        return entry.results, entry.error
+
+    def _wait(self, entry):
+        if not entry.done.wait(self.window + self.timeout):
+            logger.error('Batch of the searchd queries not dispatched in time')
+            raise GatewayTimeout()
+
+    def _leave(self, entry):
+        '''Remove the entry from the queue if it was not dispatched, promote the next entry
+        if the batch was to be dispatched by its caller'''
+        with self._lock:
+            if entry not in self._pending:
+                return
+            leading = self._pending[0] is entry
+            self._pending.remove(entry)
+            if leading and self._pending:
+                logger.warning('Batch leader left before the dispatch, promote the next caller')
+                self._pending[0].lead = True
+                self._pending[0].done.set()
+
+    def _next_batch(self):
+        with self._lock:
+            batch = []
+            nqueries = 0
+            while self._pending and (
+                not batch or nqueries + len(self._pending[0].reqs) <= self.max_queries
+            ):
+                entry = self._pending.pop(0)
+                batch.append(entry)
+                nqueries += len(entry.reqs)
+            if self._pending:
+                self._pending[0].lead = True
+                self._pending[0].done.set()
+        return batch, nqueries
+
+    def _dispatch(self):
+        batch, nqueries = self._next_batch()
+        self.stats['batches'] += 1
+        self.stats['queries'] += nqueries
+        self.stats['callers'] += len(batch)
+        logger.debug('Dispatch %d queries of %d callers', nqueries, len(batch))
+        results = None
+        error = ''
+        try:
+            with self.pool.client(dispatch=False) as client:
+                results = client.RunBatches([
+                    (entry.reqs, entry.transform, entry.lazy) for entry in batch
+                ])
+                error = client.GetLastError()
+        except Exception as exception:  # pylint: disable=broad-except
+            for entry in batch:
+                entry.exception = exception
+        finally:
+            for i, entry in enumerate(batch):
+                if results is not None:
+                    entry.results = results[i]
+                entry.error = error
+                entry.done.set()
@@ -0,0 +1,184 @@
+import logging
+import os
+import select
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from app.helpers.index_version import on_index_version_change
+from app.helpers.query_cache import QueryCache
+from app.helpers.sphinx_batch import SearchBatcher
+from app.lib import sphinxapi
+from app.settings import SEARCH_SPHINX_BATCH_MAX_QUERIES
+from app.settings import SEARCH_SPHINX_BATCH_WINDOW
+from app.settings import SEARCH_SPHINX_CACHE_SIZE
+from app.settings import SEARCH_SPHINX_CACHE_TTL
+from app.settings import SEARCH_SPHINX_HOST
+from app.settings import SEARCH_SPHINX_POOL_IDLE_TIMEOUT
+from app.settings import SEARCH_SPHINX_POOL_SIZE
+from app.settings import SEARCH_SPHINX_PORT
+from app.settings import SEARCH_SPHINX_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# pylint: disable=protected-access
+
+
+def is_alive(sock):
+    '''Check that an idle searchd connection is still usable
+
+    An idle persistent connection must not be readable (searchd closed it or sent garbage)
+    and must be writable, see also SphinxClient._Connect().
+    '''
+    try:
+        readable, writable, _ = select.select([sock], [sock], [], 0)
+    except (OSError, ValueError):
+        return False
+    return len(readable) == 0 and len(writable) == 1
+
+
+class SphinxConnectionPool:  # pylint: disable=too-many-instance-attributes
+    '''Pool of persistent searchd connections
+
+    Each borrow gets a fresh SphinxClient (so no query settings leak between requests) that
+    reuses an idle persistent connection when one is available. New connections are opened
+    lazily in persistent mode on the first query. At most `size` idle connections are kept,
+    connections idle for more than `idle_timeout` seconds are evicted.
+
+    The pool is meant to be used per worker process (see get_sphinx_pool()). Under gevent all
+    the pool operations happen between two context switches, therefore no lock is needed.
+
+    With a batch_window (seconds) the queries of the borrowed clients are micro-batched with
+    the queries of the other concurrent requests (see SearchBatcher). With a cache the searchd
+    responses of the queries are cached (see QueryCache).
+    '''
+
+    def __init__(
+        self,
+        host,
+        port,
+        size,
+        idle_timeout,
+        timeout,
+        batch_window=0,
+        batch_max_queries=32,
+        cache=None
+    ):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = deque()  # (socket, released_at), most recently released on the right
+        self.stats = {'reused': 0, 'opened': 0, 'evicted': 0, 'discarded': 0}
+        self.batcher = None
+        if batch_window > 0:
+            self.batcher = SearchBatcher(self, batch_window, batch_max_queries, timeout)
+        self.cache = cache
+
+    def __len__(self):
+        return len(self._idle)
+
+    def _new_client(self):
+        client = sphinxapi.SphinxClient()
+        client.SetServer(self.host, self.port)
+        client.SetConnectTimeout(self.timeout)
+        client.SetMatchMode(sphinxapi.SPH_MATCH_EXTENDED)
+        client.SetPersistent(self.size > 0)
+        return client
+
+    def _evict(self, now):
+        # oldest connections are on the left
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            sock, _ = self._idle.popleft()
+            sock.close()
+            self.stats['evicted'] += 1
+
+    def _pop_idle(self):
+        self._evict(time.monotonic())
+        while self._idle:
+            sock, _ = self._idle.pop()
+            if is_alive(sock):
+                self.stats['reused'] += 1
+                return sock
+            sock.close()
+            self.stats['evicted'] += 1
+        return None
+
+    def _release(self, client):
+        sock = client._socket
+        client._socket = None
+        if sock is None:
+            return
+        if client.GetLastError() or len(self._idle) >= self.size:
+            # the connection might be in an undefined state after an error
+            sock.close()
+            self.stats['discarded'] += 1
+            return
+        self._idle.append((sock, time.monotonic()))
+
+    @contextmanager
+    def client(self, dispatch=True, cached=True):
+        '''Borrow a SphinxClient for the duration of the with block
+
+        With dispatch=False the queries are never micro-batched (used by the batcher itself),
+        with cached=False the queries always reach searchd (e.g. health checks).
+        '''
+        client = self._new_client()
+        if dispatch and self.batcher is not None:
+            client.SetDispatcher(self.batcher)
+        if cached and self.cache is not None:
+            client.SetResultCache(self.cache)
+        client._socket = self._pop_idle()
+        reused = client._socket is not None
+        try:
+            yield client
+        except BaseException:
+            if client._socket is not None:
+                client.Close()
+                self.stats['discarded'] += 1
+            raise
+        if not reused and client._socket is not None:
+            self.stats['opened'] += 1
+        self._release(client)
+
+    def clear(self):
+        while self._idle:
+            sock, _ = self._idle.pop()
+            sock.close()
+
+
+_pool = None  # pylint: disable=invalid-name
+_pool_pid = None  # pylint: disable=invalid-name
+
+
+def get_sphinx_pool():
+    '''Return the searchd connection pool of the current worker
+
+    The pool is created lazily in each (forked) gunicorn worker, sockets must never be shared
+    between processes.
+    '''
+    global _pool, _pool_pid  # pylint: disable=global-statement
+    if _pool is None or _pool_pid != os.getpid():
+        logger.debug('Create searchd connection pool for pid %s', os.getpid())
+        _pool = SphinxConnectionPool(
+            SEARCH_SPHINX_HOST,
+            SEARCH_SPHINX_PORT,
+            SEARCH_SPHINX_POOL_SIZE,
+            SEARCH_SPHINX_POOL_IDLE_TIMEOUT,
+            SEARCH_SPHINX_TIMEOUT,
+            SEARCH_SPHINX_BATCH_WINDOW / 1000,
+            SEARCH_SPHINX_BATCH_MAX_QUERIES,
+            QueryCache(SEARCH_SPHINX_CACHE_SIZE, SEARCH_SPHINX_CACHE_TTL)
+            if SEARCH_SPHINX_CACHE_TTL > 0 else None
+        )
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def _invalidate_query_cache():
+    if _pool is not None and _pool.cache is not None:
+        _pool.cache.invalidate()
+
+
+on_index_version_change(_invalidate_query_cache)
@@ -1,13 +1,17 @@
+import gzip
 import logging
 import logging.config
+from collections.abc import Mapping
 from os import path
 
 import yaml
 
 from flask import jsonify
 from flask import make_response
+from flask.json.provider import DefaultJSONProvider
 
 from app.settings import ALLOWED_DOMAINS
+from app.settings import GZIP_COMPRESSION_LEVEL
 from app.settings import LOGGING_CFG
 from app.settings import LOGS_DIR
 
@@ -16,10 +20,36 @@ logger = logging.getLogger(__name__)
 ALLOWED_DOMAINS_PATTERN = f"({'|'.join(ALLOWED_DOMAINS)})"
 
 
+class JSONProvider(DefaultJSONProvider):
+    '''JSON provider serializing any mapping like a dict
+
+    The lazily decoded sphinx matches (see sphinxapi.Match) are mappings, they are
+    serialized exactly like the decoded match dicts.
+    '''
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Mapping):
+            return dict(o)
+        return DefaultJSONProvider.default(o)
+
+
 def make_error_msg(code, msg):
     return make_response(jsonify({'success': False, 'error': {'code': code, 'message': msg}}), code)
 
 
+def accepts_gzip(request):
+    return 'gzip' in request.headers.get('accept-encoding', '').lower()
+
+
+def gzip_response(response):
+    content = gzip.compress(response.get_data(), compresslevel=GZIP_COMPRESSION_LEVEL)
+    response.set_data(content)
+    response.headers['content-length'] = len(content)
+    response.headers['content-encoding'] = 'gzip'
+    return response
+
+
 def get_logging_cfg():
     print(f"LOGS_DIR is {LOGS_DIR}")
     print(f"LOGGING_CFG is {LOGGING_CFG}")
@@ -28,14 +28,29 @@
 #
 
 # pylint: disable=invalid-name,too-many-public-methods,too-many-locals,too-many-branches
+# pylint: disable=too-many-return-statements
 # pylint: disable=too-many-statements,too-many-lines,too-many-instance-attributes
 
+import json
 import logging
 import re
 import select
 import socket
+import sys
+import time
+from collections import namedtuple
+from collections.abc import Mapping
+from collections.abc import MutableMapping
+from functools import lru_cache
+from functools import partial
+from hashlib import blake2b
+from json.encoder import encode_basestring_ascii
+from struct import Struct
+from struct import calcsize
+from struct import error as StructError
 from struct import pack
 from struct import unpack
+from struct import unpack_from
 
 from opentelemetry import trace
 
@@ -134,6 +149,23 @@ SPH_GROUPBY_YEAR = 3
 SPH_GROUPBY_ATTR = 4
 SPH_GROUPBY_ATTRPAIR = 5
 
+# max. number of distinct result set schemas with a cached match decoder
+MATCH_DECODER_CACHE_SIZE = 256
+# max. number of distinct query settings with a cached request template
+REQUEST_TEMPLATE_CACHE_SIZE = 256
+# initial size of the buffer search responses are streamed into, it only grows when a single
+# item (e.g. a match with long string attributes) does not fit
+RESPONSE_CHUNK_SIZE = 65536
+
+# precompiled network byte order structs used to parse the responses
+_HEADER = Struct('>2HL')  # status, version, length
+_UINT = Struct('>L')
+_UINT2 = Struct('>2L')
+_UINT4 = Struct('>4L')
+_BIGINT = Struct('>q')
+_FLOAT = Struct('>f')
+_DOCINFO64 = Struct('>QL')  # doc id, weight
+
 
 class SphinxClient:
 
@@ -146,6 +178,11 @@ class SphinxClient:
         self._port = 9312  # searchd port (default is 9312)
         self._path = None  # searchd unix-domain socket path
         self._socket = None
+        self._persistent = False  # open connections in persistent mode (see Open())
+        self._transform = None  # transcode the matches to JSON (see SetTranscoder())
+        self._lazy = False  # decode the match attributes on access (see SetLazyMatches())
+        self._dispatcher = None  # runs the queries instead of this client (see SetDispatcher())
+        self._cache = None  # searchd responses of the requests (see SetResultCache())
         self._offset = 0  # how much records to seek from result-set start (default is 0)
         self._limit = 20  # how much records to return from result-set starting at offset (default is 20)
         self._mode = SPH_MATCH_ALL  # query matching mode (default is SPH_MATCH_ALL)
@@ -226,6 +263,51 @@ class SphinxClient:
         # so timeout got clipped to reasonable minimum
         self._timeout = max(0.001, timeout)
 
+    def SetPersistent(self, persistent):
+        """
+        Open new connections in persistent mode, like Open() does, but lazily on first use.
+        The connection is kept in the client until Close() is called.
+        """
+        assert isinstance(persistent, bool)
+        self._persistent = persistent
+
+    def SetDispatcher(self, dispatcher):
+        """
+        Run the queries of RunQueries() through the dispatcher, e.g. to batch them with the
+        queries of other clients, instead of the own connection. The dispatcher is called with
+        the requests, the transform and the lazy settings and returns the (results, error) of the
+        queries, results is None on failure.
+        """
+        assert dispatcher is None or callable(dispatcher)
+        self._dispatcher = dispatcher
+
+    def SetResultCache(self, cache):
+        """
+        Cache the searchd responses of the queries. The cache get(key) and set(key, response)
+        methods are called with the RequestsDigest() of the requests of a RunQueries() call and
+        the bytes of its result sets, which are parsed again on each hit. The result sets with an
+        error are not cached.
+        """
+        assert cache is None or (hasattr(cache, 'get') and hasattr(cache, 'set'))
+        self._cache = cache
+
+    def SetLazyMatches(self, lazy):
+        """
+        Return the matches of the next queries as compact Match records whose attributes
+        are only decoded on access (LazyAttrs) instead of dicts.
+        """
+        assert isinstance(lazy, bool)
+        self._lazy = lazy
+
+    def SetTranscoder(self, transform):
+        """
+        Transcode the matches of the next queries directly into JSON with the given
+        AttrsTransform, the matches are then EncodedMatch objects instead of dicts.
+        None restores the default decoding.
+        """
+        assert transform is None or isinstance(transform, AttrsTransform)
+        self._transform = transform
+
     def _Connect(self):
         """
         INTERNAL METHOD, DO NOT CALL. Connects to searchd server.
@@ -268,28 +350,65 @@ class SphinxClient:
 
         # all ok, send my version
         sock.send(pack('>L', 1))
+        if self._persistent:
+            self._Persist(sock)
+            self._socket = sock
         return sock
 
-    def _GetResponse(self, sock, client_ver):
+    def _Persist(self, sock):
         """
-        INTERNAL METHOD, DO NOT CALL. Gets and checks response packet from searchd server.
+        INTERNAL METHOD, DO NOT CALL. Switch the connection to persistent mode.
         """
-        (status, ver, length) = unpack('>2HL', sock.recv(8))
-        response = b''
-        left = length
-        while left > 0:
-            chunk = sock.recv(left)
-            if chunk:
-                response += chunk
-                left -= len(chunk)
-            else:
+        # command, command version = 0, body length = 4, body = 1
+        request = pack('>hhII', SEARCHD_COMMAND_PERSIST, 0, 4, 1)
+        self._Send(sock, request)
+
+    @staticmethod
+    def _RecvInto(sock, view):
+        """
+        INTERNAL METHOD, DO NOT CALL. Fill the given memoryview from the socket without
+        intermediate copies. Returns the number of bytes read.
+        """
+        read = 0
+        length = len(view)
+        while read < length:
+            n = sock.recv_into(view[read:], length - read)
+            if not n:
                 break
+            read += n
+        return read
+
+    def _GetResponse(self, sock, client_ver, stream=False):
+        """
+        INTERNAL METHOD, DO NOT CALL. Gets and checks response packet from searchd server.
+        The response is returned as a memoryview over a single preallocated buffer.
+        With stream=True a successful response body is not read, a ResponseReader positioned
+        after the optional warning is returned instead and the caller parses the body while it
+        arrives (and closes a non persistent socket once done).
+        """
+        header = bytearray(_HEADER.size)
+        if self._RecvInto(sock, memoryview(header)) != _HEADER.size:
+            if not self._socket:
+                sock.close()
+            self._error = 'failed to read searchd response header'
+            return None
+        (status, ver, length) = _HEADER.unpack(header)
+
+        if stream and length and status in (SEARCHD_OK, SEARCHD_WARNING):
+            response = ResponseReader(sock, length)
+            # the searchd warning has priority over the version warning
+            self._CheckVersion(ver, client_ver)
+            if status == SEARCHD_WARNING:
+                self._warning = response.read(DecodeString)
+            return response
+
+        response = memoryview(bytearray(length))
+        read = self._RecvInto(sock, response)
 
         if not self._socket:
             sock.close()
 
         # check response
-        read = len(response)
         if not response or read != length:
             if length:
                 self._error = f'failed to read searchd response (status={status}, ver={ver},' \
@@ -300,27 +419,32 @@ class SphinxClient:
 
         # check status
         if status == SEARCHD_WARNING:
-            wend = 4 + unpack('>L', response[0:4])[0]
-            self._warning = response[4:wend].decode()
+            wend = 4 + _UINT.unpack_from(response, 0)[0]
+            self._warning = str(response[4:wend], 'utf-8')
             return response[wend:]
 
         if status == SEARCHD_ERROR:
-            self._error = 'searchd error: ' + response[4:].decode()
+            self._error = 'searchd error: ' + str(response[4:], 'utf-8')
             return None
 
         if status == SEARCHD_RETRY:
-            self._error = 'temporary searchd error: ' + response[4:].decode()
+            self._error = 'temporary searchd error: ' + str(response[4:], 'utf-8')
             return None
 
         if status != SEARCHD_OK:
             self._error = f'unknown status code {status}'
             return None
 
-        # check version
+        self._CheckVersion(ver, client_ver)
+        return response
+
+    def _CheckVersion(self, ver, client_ver):
+        """
+        INTERNAL METHOD, DO NOT CALL. Warn when searchd implements an older command version.
+        """
         if ver < client_ver:
             self._warning = f'searchd command v.{ver >> 8}.{ver & 0xff} older than client\'' \
                     f's v.{client_ver >> 8}.{client_ver & 0xff}, some options might not work'
-        return response
 
     @staticmethod
     def _Send(sock, req):
@@ -328,8 +452,9 @@ class SphinxClient:
         INTERNAL METHOD, DO NOT CALL. send request to searchd server.
         """
         total = 0
+        view = memoryview(req)
         while True:
-            sent = sock.send(req[total:])
+            sent = sock.send(view[total:])
             if sent <= 0:
                 break
 
@@ -673,124 +798,80 @@ class SphinxClient:
             self._fieldweights
         )
 
-        # build request
-        req = []
-        req.append(
-            pack('>5L', self._query_flags, self._offset, self._limit, self._mode, self._ranker)
-        )
-        if self._ranker == SPH_RANK_EXPR:
-            req.append(pack('>L', len(self._rankexpr)))
-            req.append(self._rankexpr)
-        req.append(pack('>L', self._sort))
-        req.append(pack('>L', len(self._sortby)))
-        req.append(self._sortby)
-
         assert isinstance(query, str)
-        query_encoded = query.encode()
-        req.append(pack('>L', len(query_encoded)))
-        req.append(query_encoded)
-
-        req.append(pack('>L', len(self._weights)))
-        for w in self._weights:
-            req.append(pack('>L', w))
         assert isinstance(index, str)
+        query_encoded = query.encode()
         index_encoded = index.encode()
-        req.append(pack('>L', len(index_encoded)))
-        req.append(index_encoded)
-        req.append(pack('>L', 1))  # id64 range marker
-        req.append(pack('>Q', self._min_id))
-        req.append(pack('>Q', self._max_id))
-
-        # filters
-        req.append(pack('>L', len(self._filters)))
-        for f in self._filters:
-            req.append(pack('>L', len(f['attr'])) + f['attr'])
-            filtertype = f['type']
-            req.append(pack('>L', filtertype))
-            if filtertype == SPH_FILTER_VALUES:
-                req.append(pack('>L', len(f['values'])))
-                for val in f['values']:
-                    req.append(pack('>q', val))
-            elif filtertype == SPH_FILTER_RANGE:
-                req.append(pack('>2q', f['min'], f['max']))
-            elif filtertype == SPH_FILTER_FLOATRANGE:
-                req.append(pack('>2f', f['min'], f['max']))
-            elif filtertype == SPH_FILTER_STRING:
-                req.append(pack('>L', len(f['value'])))
-                req.append(f['value'])
-            req.append(pack('>L', f['exclude']))
-
-        # group-by, max-matches, group-sort
-        req.append(pack('>2L', self._groupfunc, len(self._groupby)))
-        req.append(self._groupby)
-        req.append(pack('>2L', self._maxmatches, len(self._groupsort)))
-        req.append(self._groupsort)
-        req.append(pack('>LLL', self._cutoff, self._retrycount, self._retrydelay))
-        req.append(pack('>L', len(self._groupdistinct)))
-        req.append(self._groupdistinct)
-
-        # anchor point
-        if len(self._anchor) == 0:
-            req.append(pack('>L', 0))
-        else:
-            attrlat, attrlong = self._anchor['attrlat'], self._anchor['attrlong']
-            latitude, longitude = self._anchor['lat'], self._anchor['long']
-            req.append(pack('>L', 1))
-            req.append(pack('>L', len(attrlat)) + attrlat)
-            req.append(pack('>L', len(attrlong)) + attrlong)
-            req.append(pack('>f', latitude) + pack('>f', longitude))
-
-        # per-index weights
-        req.append(pack('>L', len(self._indexweights)))
-        for indx, weight in self._indexweights.items():
-            req.append(pack('>L', len(indx)) + indx + pack('>L', weight))
-
-        # max query time
-        req.append(pack('>L', self._maxquerytime))
-
-        # per-field weights
-        req.append(pack('>L', len(self._fieldweights)))
-        for field, weight in self._fieldweights.items():
-            req.append(pack('>L', len(field)) + field + pack('>L', weight))
-
-        # comment
         comment_encoded = str(comment).encode()
-        req.append(pack('>L', len(comment_encoded)) + comment_encoded)
-
-        # attribute overrides
-        req.append(pack('>L', len(self._overrides)))
-        for v in self._overrides.values():
-            req.extend((pack('>L', len(v['name'])), v['name']))
-            req.append(pack('>LL', v['type'], len(v['values'])))
-            for idU64, value in v['values'].items():
-                req.append(pack('>Q', idU64))
-                if v['type'] == SPH_ATTR_FLOAT:
-                    req.append(pack('>f', value))
-                elif v['type'] == SPH_ATTR_BIGINT:
-                    req.append(pack('>q', value))
-                elif v['type'] == SPH_ATTR_STRING:
-                    req.append(value)
-                else:
-                    req.append(pack('>l', value))
-
-        # select-list
-        req.append(pack('>L', len(self._select)))
-        req.append(self._select)
-        if self._predictedtime > 0:
-            req.append(pack('>L', self._predictedtime))
-
-        # outer
-        req.append(pack('>L', len(self._outerorderby)) + self._outerorderby)
-        req.append(pack('>2L', self._outeroffset, self._outerlimit))
-        if self._hasouter:
-            req.append(pack('>L', 1))
-        else:
-            req.append(pack('>L', 0))
 
-        # send query, get response
-        req = b''.join(req)
+        # only the query, index and comment are spliced into the serialized settings
+        before_query, before_index, before_comment, after_comment = GetRequestTemplate(
+            self._RequestSettings()
+        )
+        self._reqs.append(
+            b''.join((
+                before_query,
+                _UINT.pack(len(query_encoded)),
+                query_encoded,
+                before_index,
+                _UINT.pack(len(index_encoded)),
+                index_encoded,
+                before_comment,
+                _UINT.pack(len(comment_encoded)),
+                comment_encoded,
+                after_comment,
+            ))
+        )
 
-        self._reqs.append(req)
+    def _RequestSettings(self):
+        """
+        INTERNAL METHOD, DO NOT CALL.
+        Return the query settings as hashable RequestSettings.
+        """
+        if self._anchor:
+            anchor = (
+                self._anchor['attrlat'],
+                self._anchor['attrlong'],
+                self._anchor['lat'],
+                self._anchor['long'],
+            )
+        else:
+            anchor = ()
+        return RequestSettings(
+            self._query_flags,
+            self._offset,
+            self._limit,
+            self._mode,
+            self._ranker,
+            self._rankexpr,
+            self._sort,
+            self._sortby,
+            tuple(self._weights),
+            self._min_id,
+            self._max_id,
+            tuple(map(_FilterSettings, self._filters)),
+            self._groupfunc,
+            self._groupby,
+            self._maxmatches,
+            self._groupsort,
+            self._cutoff,
+            self._retrycount,
+            self._retrydelay,
+            self._groupdistinct,
+            anchor,
+            tuple(self._indexweights.items()),
+            self._maxquerytime,
+            tuple(self._fieldweights.items()),
+            tuple(
+                (v['name'], v['type'], tuple(v['values'].items())) for v in self._overrides.values()
+            ),
+            self._select,
+            self._predictedtime,
+            self._outerorderby,
+            self._outeroffset,
+            self._outerlimit,
+            self._hasouter,
+        )
 
     def RunQueries(self):
         """
@@ -804,167 +885,151 @@ class SphinxClient:
                 logger.error('Run queries: %s', self._error)
                 return None
 
-            sock = self._Connect()
-            if not sock:
-                logger.error('Run queries, connect failed: %s', self._error)
+            # no error nor warning of the previous queries of a reused client
+            self._error = ''
+            self._warning = ''
+            if self._cache is not None:
+                response = self._cache.get(RequestsDigest(self._reqs))
+                if response is not None:
+                    results = self._ParseSearchResponse(
+                        response, len(self._reqs), transform=self._transform, lazy=self._lazy
+                    )
+                    self._reqs = []
+                    return results
+
+            if self._dispatcher is not None:
+                results, self._error = self._dispatcher(self._reqs, self._transform, self._lazy)
+            else:
+                results = self.RunBatches([(self._reqs, self._transform, self._lazy)])
+                results = results[0] if results is not None else None
+            if results is None:
                 return None
 
-            logger.debug('Run %d queries', len(self._reqs))
+            self._reqs = []
+            return results
+
+    def RunBatches(self, batches):
+        """
+        Run the queries of several batches as one searchd search command.
+        batches is a list of (reqs, transform, lazy), with the requests built by AddQuery() and
+        the matches decoding of the batch (see SetTranscoder() and SetLazyMatches()).
+        Returns None on network IO failure; or a list with the result sets of each batch.
+        """
+        reqs = [req for batch_reqs, _, _ in batches for req in batch_reqs]
+        sock = self._Connect()
+        if not sock:
+            logger.error('Run queries, connect failed: %s', self._error)
+            return None
 
-            req = b''.join(self._reqs)
-            length = len(req) + 8
-            req = pack(
-                '>HHLLL', SEARCHD_COMMAND_SEARCH, VER_COMMAND_SEARCH, length, 0, len(self._reqs)
-            ) + req
-            self._Send(sock, req)
+        logger.debug('Run %d queries', len(reqs))
 
-            response = self._GetResponse(sock, VER_COMMAND_SEARCH)
+        req = b''.join(reqs)
+        length = len(req) + 8
+        req = pack('>HHLLL', SEARCHD_COMMAND_SEARCH, VER_COMMAND_SEARCH, length, 0, len(reqs)) + req
+        self._Send(sock, req)
+
+        try:
+            response = self._GetResponse(sock, VER_COMMAND_SEARCH, stream=True)
             if not response:
                 logger.error('Run queries, no response: %s', self._error)
                 return None
+            results = [self._ParseBatch(response, *batch) for batch in batches]
+        except (IOError, StructError, UnicodeDecodeError) as error:
+            # truncated or garbled response, the connection is in an undefined state, never
+            # reuse it
+            self._error = f'failed to read searchd response: {error}'
+            logger.error('Run queries, %s', self._error)
+            sock.close()
+            self._socket = None
+            return None
+        if not self._socket:
+            sock.close()
 
-            nreqs = len(self._reqs)
-
-            # parse response
-            max_ = len(response)
-            p = 0
-
-            results = []
-            for _ in range(0, nreqs, 1):
-                result = {}
-                results.append(result)
-
-                result['error'] = ''
-                result['warning'] = ''
-                status = unpack('>L', response[p:p + 4])[0]
-                p += 4
-                result['status'] = status
-                if status != SEARCHD_OK:
-                    length = unpack('>L', response[p:p + 4])[0]
-                    p += 4
-                    message = response[p:p + length].decode()
-                    p += length
-
-                    if status == SEARCHD_WARNING:
-                        result['warning'] = message
-                    else:
-                        result['error'] = message
-                        continue
-
-                # read schema
-                fields = []
-                attrs = []
-
-                nfields = unpack('>L', response[p:p + 4])[0]
-                p += 4
-                while nfields > 0 and p < max_:
-                    nfields -= 1
-                    length = unpack('>L', response[p:p + 4])[0]
-                    p += 4
-                    fields.append(response[p:p + length].decode())
-                    p += length
-
-                result['fields'] = fields
-
-                nattrs = unpack('>L', response[p:p + 4])[0]
-                p += 4
-                while nattrs > 0 and p < max_:
-                    nattrs -= 1
-                    length = unpack('>L', response[p:p + 4])[0]
-                    p += 4
-                    attr = response[p:p + length].decode()
-                    p += length
-                    type_ = unpack('>L', response[p:p + 4])[0]
-                    p += 4
-                    attrs.append([attr, type_])
-
-                result['attrs'] = attrs
-
-                # read match count
-                count = unpack('>L', response[p:p + 4])[0]
-                p += 4
-                id64 = unpack('>L', response[p:p + 4])[0]
-                p += 4
-
-                # read matches
-                result['matches'] = []
-                while count > 0 and p < max_:
-                    count -= 1
-                    if id64:
-                        doc, weight = unpack('>QL', response[p:p + 12])
-                        p += 12
-                    else:
-                        doc, weight = unpack('>2L', response[p:p + 8])
-                        p += 8
-
-                    match = {'id': doc, 'weight': weight, 'attrs': {}}
-                    for attr in attrs:
-                        if attr[1] == SPH_ATTR_FLOAT:
-                            match['attrs'][attr[0]] = unpack('>f', response[p:p + 4])[0]
-                        elif attr[1] == SPH_ATTR_BIGINT:
-                            match['attrs'][attr[0]] = unpack('>q', response[p:p + 8])[0]
-                            p += 4
-                        elif attr[1] == SPH_ATTR_STRING:
-                            slen = unpack('>L', response[p:p + 4])[0]
-                            p += 4
-                            match['attrs'][attr[0]] = ''
-                            if slen > 0:
-                                match['attrs'][attr[0]] = response[p:p + slen].decode()
-                            p += slen - 4
-                        elif attr[1] == SPH_ATTR_FACTORS:
-                            slen = unpack('>L', response[p:p + 4])[0]
-                            p += 4
-                            match['attrs'][attr[0]] = ''
-                            if slen > 0:
-                                match['attrs'][attr[0]] = response[p:p + slen - 4].decode()
-                                p += slen - 4
-                            p -= 4
-                        elif attr[1] == SPH_ATTR_MULTI:
-                            match['attrs'][attr[0]] = []
-                            nvals = unpack('>L', response[p:p + 4])[0]
-                            p += 4
-                            for _ in range(0, nvals, 1):
-                                match['attrs'][attr[0]].append(unpack('>L', response[p:p + 4])[0])
-                                p += 4
-                            p -= 4
-                        elif attr[1] == SPH_ATTR_MULTI64:
-                            match['attrs'][attr[0]] = []
-                            nvals = unpack('>L', response[p:p + 4])[0]
-                            nvals = nvals / 2
-                            p += 4
-                            for _ in range(0, nvals, 1):
-                                match['attrs'][attr[0]].append(unpack('>q', response[p:p + 8])[0])
-                                p += 8
-                            p -= 4
-                        else:
-                            match['attrs'][attr[0]] = unpack('>L', response[p:p + 4])[0]
-                        p += 4
-
-                    result['matches'].append(match)
-
-                result['total'], result['total_found'], result['time'], words = unpack(
-                    '>4L', response[p:p+16]
-                )
+        logger.debug('Run %d queries result', len(reqs), extra={'query_results': results})
+        return results
 
-                result['time'] = f'{result["time"] / 1000.0:.3f}'
-                p += 16
+    def _ParseBatch(self, response, reqs, transform, lazy):
+        """
+        INTERNAL METHOD, DO NOT CALL. Parse the result sets of a batch of RunBatches(), with a
+        result cache the bytes of the result sets are recorded and cached.
+        """
+        if self._cache is None:
+            return self._ParseSearchResponse(response, len(reqs), transform=transform, lazy=lazy)
+        response.start_recording()
+        results = self._ParseSearchResponse(response, len(reqs), transform=transform, lazy=lazy)
+        recorded = response.stop_recording()
+        if all(result['status'] in (SEARCHD_OK, SEARCHD_WARNING) for result in results):
+            self._cache.set(RequestsDigest(reqs), recorded)
+        return results
 
-                result['words'] = []
-                while words > 0:
-                    words -= 1
-                    length = unpack('>L', response[p:p + 4])[0]
-                    p += 4
-                    word = response[p:p + length].decode()
-                    p += length
-                    docs, hits = unpack('>2L', response[p:p + 8])
-                    p += 8
+    @staticmethod
+    def _ParseSearchResponse(response, nreqs, compiled=True, transform=None, lazy=False):
+        """
+        INTERNAL METHOD, DO NOT CALL. Parse a search response into a list of result set dicts.
+        The response is either a ResponseReader streaming the body from searchd or a complete
+        buffer. Each item (status, schema, match, word...) is decoded as soon as its bytes have
+        arrived, the consumed bytes are dropped from the reader buffer.
+        The matches are decoded with a MatchDecoder compiled once per result set schema, with
+        compiled=False the generic per attribute decoder is used (reference implementation).
+        With a transform the matches are transcoded to JSON by a MatchEncoder instead, with
+        lazy=True they are Match records decoded on access (see MatchLayout).
+        """
+        if not isinstance(response, ResponseReader):
+            response = ResponseReader(buffer=response)
+        read = response.read
+
+        results = []
+        for _ in range(0, nreqs, 1):
+            if response.sock is not None and results:
+                # let the other greenlets run between two result sets of a large batch
+                time.sleep(0)
+
+            result = {}
+            results.append(result)
+
+            result['error'] = ''
+            result['warning'] = ''
+            status, message = read(DecodeStatus)
+            result['status'] = status
+            if status != SEARCHD_OK:
+                if status == SEARCHD_WARNING:
+                    result['warning'] = message
+                else:
+                    result['error'] = message
+                    continue
+
+            # read schema
+            schema = read(DecodeSchema)
+
+            # read match count
+            count, id64 = read(_UINT2.unpack_from, 8)
+
+            if transform is not None:
+                encoder = GetMatchEncoder(schema, id64, transform)
+                fields, attrs, decode = encoder.fields, encoder.attrs, encoder.encode
+            elif lazy:
+                layout = GetMatchLayout(schema, id64)
+                fields, attrs, decode = layout.fields, layout.attrs, layout.decode
+            elif compiled:
+                decoder = GetMatchDecoder(schema, id64)
+                fields, attrs, decode = decoder.fields, decoder.attrs, decoder.decode
+            else:
+                fields, attrs = ParseSchema(schema)
+                decode = partial(DecodeMatch, attrs=attrs, id64=id64)
+            result['fields'] = list(fields)
+            result['attrs'] = [list(attr) for attr in attrs]
 
-                    result['words'].append({'word': word, 'docs': docs, 'hits': hits})
+            # read matches
+            result['matches'] = [read(decode) for _ in range(count)]
 
-            logger.debug('Run %d queries result', nreqs, extra={'query_results': results})
+            result['total'], result['total_found'], result['time'], words = read(
+                _UINT4.unpack_from, 16
+            )
+            result['time'] = f'{result["time"] / 1000.0:.3f}'
 
-            self._reqs = []
-            return results
+            result['words'] = [read(DecodeWord) for _ in range(words)]
+
+        return results
 
     def BuildExcerpts(self, docs, index, words, opts=None):
         """
@@ -1094,7 +1159,7 @@ class SphinxClient:
                 self._error = 'incomplete reply'
                 return []
 
-            res.append(response[pos:pos + length].decode())
+            res.append(str(response[pos:pos + length], 'utf-8'))
             pos += length
 
         return res
@@ -1228,12 +1293,12 @@ class SphinxClient:
 
             length = unpack('>L', response[p:p + 4])[0]
             p += 4
-            tokenized = response[p:p + length].decode()
+            tokenized = str(response[p:p + length], 'utf-8')
             p += length
 
             length = unpack('>L', response[p:p + 4])[0]
             p += 4
-            normalized = response[p:p + length].decode()
+            normalized = str(response[p:p + length], 'utf-8')
             p += length
 
             entry = {'tokenized': tokenized, 'normalized': normalized}
@@ -1278,10 +1343,10 @@ class SphinxClient:
 
         while p < max_:
             length = unpack('>L', response[p:p + 4])[0]
-            key = response[p + 4:p + length + 4].decode()
+            key = str(response[p + 4:p + length + 4], 'utf-8')
             p += 4 + length
             length = unpack('>L', response[p:p + 4])[0]
-            value = response[p + 4:p + length + 4].decode()
+            value = str(response[p + 4:p + length + 4], 'utf-8')
             p += 4 + length
             res += [[key, value]]
 
@@ -1298,10 +1363,8 @@ class SphinxClient:
         if not server:
             return None
 
-        # command, command version = 0, body length = 4, body = 1
-        request = pack('>hhII', SEARCHD_COMMAND_PERSIST, 0, 4, 1)
-        self._Send(server, request)
-
+        if not self._persistent:
+            self._Persist(server)
         self._socket = server
         return True
 
@@ -1335,6 +1398,629 @@ class SphinxClient:
         return tag
 
 
+def SkipSchema(response, p):
+    """
+    Return the position following the result set schema (fields and attributes) at p.
+    Raises struct.error if the schema goes past the end of the response.
+    """
+    nfields = _UINT.unpack_from(response, p)[0]
+    p += 4
+    while nfields > 0:
+        nfields -= 1
+        p += 4 + _UINT.unpack_from(response, p)[0]
+    nattrs = _UINT.unpack_from(response, p)[0]
+    p += 4
+    while nattrs > 0:
+        nattrs -= 1
+        p += 8 + _UINT.unpack_from(response, p)[0]
+    return p
+
+
+def DecodeString(response, p):
+    """
+    Decode a length prefixed string at p, returns the string and the next position.
+    """
+    length = _UINT.unpack_from(response, p)[0]
+    p += 4
+    return str(response[p:p + length], 'utf-8'), p + length
+
+
+def DecodeStatus(response, p):
+    """
+    Decode the status of a result set and its warning or error message if any.
+    """
+    status = _UINT.unpack_from(response, p)[0]
+    p += 4
+    if status == SEARCHD_OK:
+        return (status, ''), p
+    message, p = DecodeString(response, p)
+    return (status, message), p
+
+
+def DecodeSchema(response, p):
+    """
+    Return a copy of the raw result set schema at p, see ParseSchema() and GetMatchDecoder().
+    """
+    end = SkipSchema(response, p)
+    return bytes(response[p:end]), end
+
+
+def DecodeWord(response, p):
+    """
+    Decode the statistics of one query keyword.
+    """
+    word, p = DecodeString(response, p)
+    docs, hits = _UINT2.unpack_from(response, p)
+    return {'word': word, 'docs': docs, 'hits': hits}, p + 8
+
+
+def ParseSchema(schema):
+    """
+    Parse a result set schema, returns the field names and the (name, type) attributes.
+    """
+    max_ = len(schema)
+    fields = []
+    attrs = []
+
+    nfields = _UINT.unpack_from(schema, 0)[0]
+    p = 4
+    while nfields > 0 and p < max_:
+        nfields -= 1
+        length = _UINT.unpack_from(schema, p)[0]
+        p += 4
+        fields.append(str(schema[p:p + length], 'utf-8'))
+        p += length
+
+    nattrs = _UINT.unpack_from(schema, p)[0]
+    p += 4
+    while nattrs > 0 and p < max_:
+        nattrs -= 1
+        length = _UINT.unpack_from(schema, p)[0]
+        p += 4
+        attr = str(schema[p:p + length], 'utf-8')
+        p += length
+        type_ = _UINT.unpack_from(schema, p)[0]
+        p += 4
+        attrs.append((attr, type_))
+    return fields, attrs
+
+
+def DecodeAttr(type_, response, p):
+    """
+    Decode one attribute value of the given type at p, returns the value and the next position.
+    """
+    if type_ == SPH_ATTR_FLOAT:
+        return _FLOAT.unpack_from(response, p)[0], p + 4
+    if type_ == SPH_ATTR_BIGINT:
+        return _BIGINT.unpack_from(response, p)[0], p + 8
+    if type_ == SPH_ATTR_STRING:
+        slen = _UINT.unpack_from(response, p)[0]
+        p += 4
+        return (str(response[p:p + slen], 'utf-8') if slen > 0 else ''), p + slen
+    if type_ == SPH_ATTR_FACTORS:
+        slen = _UINT.unpack_from(response, p)[0]
+        p += 4
+        if slen > 0:
+            return str(response[p:p + slen - 4], 'utf-8'), p + max(slen - 4, 0)
+        return '', p
+    if type_ == SPH_ATTR_MULTI:
+        nvals = _UINT.unpack_from(response, p)[0]
+        p += 4
+        return list(unpack_from(f'>{nvals}L', response, p) if nvals else ()), p + nvals * 4
+    if type_ == SPH_ATTR_MULTI64:
+        nvals = _UINT.unpack_from(response, p)[0] // 2
+        p += 4
+        return list(unpack_from(f'>{nvals}q', response, p) if nvals else ()), p + nvals * 8
+    return _UINT.unpack_from(response, p)[0], p + 4
+
+
+def DecodeMatch(response, p, attrs, id64):
+    """
+    Generic match decoder, walks the attributes of the schema one by one.
+    Returns the match dict and the next position.
+    """
+    if id64:
+        doc, weight = _DOCINFO64.unpack_from(response, p)
+        p += 12
+    else:
+        doc, weight = _UINT2.unpack_from(response, p)
+        p += 8
+
+    match = {'id': doc, 'weight': weight, 'attrs': {}}
+    match_attrs = match['attrs']
+    for name, type_ in attrs:
+        if type_ == SPH_ATTR_FLOAT:
+            match_attrs[name] = _FLOAT.unpack_from(response, p)[0]
+            p += 4
+        elif type_ == SPH_ATTR_BIGINT:
+            match_attrs[name] = _BIGINT.unpack_from(response, p)[0]
+            p += 8
+        elif type_ == SPH_ATTR_STRING:
+            slen = _UINT.unpack_from(response, p)[0]
+            p += 4
+            match_attrs[name] = ''
+            if slen > 0:
+                match_attrs[name] = str(response[p:p + slen], 'utf-8')
+            p += slen
+        elif type_ in (SPH_ATTR_FACTORS, SPH_ATTR_MULTI, SPH_ATTR_MULTI64):
+            match_attrs[name], p = DecodeAttr(type_, response, p)
+        else:
+            match_attrs[name] = _UINT.unpack_from(response, p)[0]
+            p += 4
+    return match, p
+
+
+# format of the fixed width attribute types, all other fixed width types are unsigned int
+_FIXED_WIDTH_FORMATS = {SPH_ATTR_FLOAT: 'f', SPH_ATTR_BIGINT: 'q'}
+_VARIABLE_WIDTH_TYPES = (SPH_ATTR_STRING, SPH_ATTR_FACTORS, SPH_ATTR_MULTI, SPH_ATTR_MULTI64)
+
+
+def _GenerateDecodeLines(attrs, id64, namespace, used=None):
+    """
+    Generate the body of a decode(response, p) function reading the document id and weight
+    into `doc` and `weight` and the attribute i into `a{i}`. Runs of consecutive fixed width
+    attributes are read with a single combined struct (the first run includes the document id
+    and weight), strings are decoded inline. Strings whose index is not in `used` are skipped
+    without being decoded. The other variable width attributes fall back to DecodeAttr().
+    """
+    namespace.update({'unpack_uint': _UINT.unpack_from, 'decode_attr': DecodeAttr})
+    lines = []
+    run = {'format': 'QL' if id64 else 'LL', 'values': ['doc', 'weight']}
+
+    def flush_run():
+        if run['values']:
+            run_struct = Struct('>' + run['format'])
+            unpack_run = f'unpack_run{len(lines)}'
+            namespace[unpack_run] = run_struct.unpack_from
+            lines.append(f'    {", ".join(run["values"])}, = {unpack_run}(response, p)')
+            lines.append(f'    p += {run_struct.size}')
+        run['format'], run['values'] = '', []
+
+    for i, (_, type_) in enumerate(attrs):
+        if type_ == SPH_ATTR_STRING:
+            flush_run()
+            lines.append('    slen = unpack_uint(response, p)[0]')
+            if used is None or i in used:
+                lines.append(
+                    f"    a{i} = str(response[p + 4:p + 4 + slen], 'utf-8') if slen else ''"
+                )
+            lines.append('    p += 4 + slen')
+        elif type_ in _VARIABLE_WIDTH_TYPES:
+            flush_run()
+            lines.append(f'    a{i}, p = decode_attr({type_}, response, p)')
+        else:
+            run['format'] += _FIXED_WIDTH_FORMATS.get(type_, 'L')
+            run['values'].append(f'a{i}')
+    flush_run()
+    return lines
+
+
+class MatchDecoder:  # pylint: disable=too-few-public-methods
+    """
+    Match decoder specialized for one result set schema.
+
+    The decode(response, p) function is generated once from the schema (see
+    _GenerateDecodeLines()) and builds the match dict in one go.
+    """
+
+    def __init__(self, schema, id64):
+        self.fields, self.attrs = ParseSchema(schema)
+        self.id64 = id64
+
+        namespace = {}
+        lines = ['def decode(response, p):']
+        lines += _GenerateDecodeLines(self.attrs, id64, namespace)
+        # attribute names are inserted as python literals (repr)
+        items = ', '.join(f'{name!r}: a{i}' for i, (name, _) in enumerate(self.attrs))
+        lines.append(f"    return {{'id': doc, 'weight': weight, 'attrs': {{{items}}}}}, p")
+
+        exec('\n'.join(lines), namespace)  # pylint: disable=exec-used
+        self.decode = namespace['decode']
+
+
+@lru_cache(maxsize=MATCH_DECODER_CACHE_SIZE)
+def GetMatchDecoder(schema, id64):
+    """
+    Return the MatchDecoder for the given schema bytes, decoders are cached in a LRU as the
+    schema of an index rarely changes between two requests.
+    """
+    return MatchDecoder(schema, id64)
+
+
+class AttrsTransform(namedtuple('AttrsTransform', ['rename', 'copy', 'drop', 'keep'])):
+    """
+    Declarative transform of the match attributes applied by the MatchEncoder.
+
+    rename and copy are tuples of (source, target) attribute names, an existing target is
+    overwritten, drop is a tuple of attribute names to remove. They are applied in this
+    order and ignored for the attributes missing in the result set schema. keep is a tuple of
+    (transformed) attribute names whose values are also returned as python objects.
+    """
+    __slots__ = ()
+
+    def __new__(cls, rename=(), copy=(), drop=(), keep=()):
+        return super().__new__(cls, tuple(rename), tuple(copy), tuple(drop), tuple(keep))
+
+
+class EncodedMatch:  # pylint: disable=too-few-public-methods
+    """
+    A match whose attributes have been transcoded to a JSON object, see MatchEncoder.
+    """
+    __slots__ = ('id', 'weight', 'attrs', 'values')
+
+    def __init__(self, doc, weight, attrs, values):
+        self.id = doc
+        self.weight = weight
+        self.attrs = attrs  # JSON text of the attributes object
+        self.values = values  # values of the AttrsTransform.keep attributes
+
+    def dumps(self):
+        """
+        Return the JSON text of the match, as json.dumps(match, sort_keys=True,
+        separators=(',', ':')) of the decoded match dict.
+        """
+        return f'{{"attrs":{self.attrs},"id":{self.id},"weight":{self.weight}}}'
+
+
+def _FloatJSON(value):
+    if value != value or value in (float('inf'), float('-inf')):  # pylint: disable=comparison-with-itself
+        return json.dumps(value)
+    return float.__repr__(value)
+
+
+def _ListJSON(values):
+    return f'[{",".join(map(str, values))}]'
+
+
+class MatchEncoder:  # pylint: disable=too-few-public-methods
+    """
+    Match transcoder specialized for one result set schema and AttrsTransform.
+
+    The generated encode(response, p) function writes the attributes of a match directly as
+    a compact JSON object with sorted keys and ASCII only strings (as jsonify() does), without
+    building the match dict. The strings of the dropped attributes are not even decoded.
+    Returns an EncodedMatch and the next position.
+    """
+
+    def __init__(self, schema, id64, transform):
+        self.fields, self.attrs = ParseSchema(schema)
+        self.id64 = id64
+        self.transform = transform
+
+        # output attribute name -> index of the schema attribute
+        output = {name: i for i, (name, _) in enumerate(self.attrs)}
+        for source, target in transform.rename:
+            if source in output:
+                output[target] = output.pop(source)
+        for source, target in transform.copy:
+            if source in output:
+                output[target] = output[source]
+        for name in transform.drop:
+            output.pop(name, None)
+
+        namespace = {
+            'EncodedMatch': EncodedMatch,
+            'encode_string': encode_basestring_ascii,
+            'encode_float': _FloatJSON,
+            'encode_list': _ListJSON,
+        }
+        lines = ['def encode(response, p):']
+        lines += _GenerateDecodeLines(self.attrs, id64, namespace, used=set(output.values()))
+
+        # the JSON object is built with a f-string, non finite floats (NaN, Infinity) are
+        # replaced by their JSON text beforehand
+        floats = [i for i, (_, type_) in enumerate(self.attrs) if type_ == SPH_ATTR_FLOAT]
+        floats = [i for i in floats if i in output.values()]
+        if floats:
+            lines.append(f'    if {" or ".join(f"a{i} - a{i}" for i in floats)}:')
+            lines.append(
+                f'        {", ".join(f"a{i}" for i in floats)}, = '
+                f'({", ".join(f"encode_float(a{i})" for i in floats)},)'
+            )
+        items = []
+        for name in sorted(output):
+            i = output[name]
+            type_ = self.attrs[i][1]
+            if type_ in (SPH_ATTR_STRING, SPH_ATTR_FACTORS):
+                value = f'encode_string(a{i})'
+            elif type_ in (SPH_ATTR_MULTI, SPH_ATTR_MULTI64):
+                value = f'encode_list(a{i})'
+            else:
+                value = f'a{i}'
+            key = encode_basestring_ascii(name).replace('{', '{{').replace('}', '}}')
+            items.append(f'{key}:{{{value}}}')
+        # the template is inserted as a python literal (repr)
+        attrs_json = 'f' + repr(f'{{{{{",".join(items)}}}}}')
+        values = ''.join(
+            f'a{output[name]}, ' if name in output else 'None, ' for name in transform.keep
+        )
+        lines.append(f'    return EncodedMatch(doc, weight, {attrs_json}, ({values})), p')
+
+        exec('\n'.join(lines), namespace)  # pylint: disable=exec-used
+        self.encode = namespace['encode']
+
+
+@lru_cache(maxsize=MATCH_DECODER_CACHE_SIZE)
+def GetMatchEncoder(schema, id64, transform):
+    """
+    Return the MatchEncoder for the given schema bytes and AttrsTransform.
+    """
+    return MatchEncoder(schema, id64, transform)
+
+
+class Match(Mapping):
+    """
+    Compact match record, a mapping with the fixed 'id', 'weight' and 'attrs' keys of the
+    decoded match dict. The values can be changed but no key can be added or removed.
+    """
+    __slots__ = ('id', 'weight', 'attrs')
+    _KEYS = ('id', 'weight', 'attrs')
+
+    def __init__(self, doc, weight, attrs):
+        self.id = doc
+        self.weight = weight
+        self.attrs = attrs
+
+    def __getitem__(self, key):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self):
+        return len(self._KEYS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+_DELETED = object()
+
+
+class LazyAttrs(MutableMapping):
+    """
+    Match attributes decoded on access from the raw bytes of the match.
+
+    The raw bytes are a copy of the match slice of the response, the attribute offsets are
+    computed on the first access. Decoded and assigned values are kept in a small overlay
+    dict, deleted attributes are never decoded.
+    """
+    __slots__ = ('_layout', '_raw', '_offsets', '_values')
+
+    def __init__(self, layout, raw):
+        self._layout = layout
+        self._raw = raw
+        self._offsets = None
+        self._values = {}
+
+    def __getitem__(self, name):
+        value = self._values.get(name, _DELETED)
+        if value is not _DELETED:
+            return value
+        if name in self._values or name not in self._layout.index:
+            raise KeyError(name)
+        if self._offsets is None:
+            self._offsets = self._layout.offsets(self._raw)
+        i = self._layout.index[name]
+        value = self._values[name] = DecodeAttr(self._layout.types[i], self._raw,
+                                                self._offsets[i])[0]
+        return value
+
+    def __setitem__(self, name, value):
+        self._values[name] = value
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self._values[name] = _DELETED
+
+    def __contains__(self, name):
+        value = self._values.get(name)
+        if value is not None:
+            return value is not _DELETED
+        return name in self._values or name in self._layout.index
+
+    def __iter__(self):
+        values = self._values
+        for name in self._layout.index:
+            if values.get(name) is not _DELETED:
+                yield name
+        for name, value in values.items():
+            if value is not _DELETED and name not in self._layout.index:
+                yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def _GenerateSkipLines(types, offsets=False):
+    """
+    Generate the lines advancing p over the attributes of the given types, only the lengths
+    of the variable width attributes are read. With offsets=True the start position of the
+    attribute i is also stored in `o{i}`.
+    """
+    lines = []
+    fixed = 0  # size of the fixed width attributes since the last variable width one
+    for i, type_ in enumerate(types):
+        if offsets:
+            lines.append(f'    o{i} = p + {fixed}')
+        if type_ not in _VARIABLE_WIDTH_TYPES:
+            fixed += calcsize('>' + _FIXED_WIDTH_FORMATS.get(type_, 'L'))
+            continue
+        if fixed:
+            lines.append(f'    p += {fixed}')
+            fixed = 0
+        if type_ == SPH_ATTR_STRING:
+            lines.append('    p += 4 + unpack_uint(response, p)[0]')
+        elif type_ == SPH_ATTR_FACTORS:
+            lines.append('    p += 4 + max(unpack_uint(response, p)[0] - 4, 0)')
+        else:
+            # number of 32 bits values of MULTI (and twice the number of values of MULTI64)
+            lines.append('    p += 4 + unpack_uint(response, p)[0] * 4')
+    if fixed:
+        lines.append(f'    p += {fixed}')
+    return lines
+
+
+class MatchLayout:  # pylint: disable=too-few-public-methods
+    """
+    Lazy match decoder specialized for one result set schema.
+
+    The generated decode(response, p) function only reads the document id, the weight and
+    the lengths of the variable width attributes to find the end of the match, it returns
+    a Match with LazyAttrs. The generated offsets(raw) function returns the positions of the
+    attributes in the raw match. The attribute names are interned.
+    """
+
+    def __init__(self, schema, id64):
+        self.fields, self.attrs = ParseSchema(schema)
+        self.id64 = id64
+        self.index = {sys.intern(name): i for i, (name, _) in enumerate(self.attrs)}
+        self.types = tuple(type_ for _, type_ in self.attrs)
+
+        namespace = {
+            'unpack_uint': _UINT.unpack_from,
+            'unpack_docinfo': (_DOCINFO64 if id64 else _UINT2).unpack_from,
+            'Match': Match,
+            'LazyAttrs': LazyAttrs,
+            'layout': self,
+        }
+        lines = ['def decode(response, p):']
+        lines.append('    doc, weight = unpack_docinfo(response, p)')
+        lines.append(f'    p += {12 if id64 else 8}')
+        lines.append('    start = p')
+        lines += _GenerateSkipLines(self.types)
+        lines.append(
+            '    return Match(doc, weight, LazyAttrs(layout, bytes(response[start:p]))), p'
+        )
+        lines.append('def offsets(response):')
+        lines.append('    p = 0')
+        lines += _GenerateSkipLines(self.types, offsets=True)
+        lines.append(f'    return ({"".join(f"o{i}, " for i in range(len(self.types)))})')
+
+        exec('\n'.join(lines), namespace)  # pylint: disable=exec-used
+        self.decode = namespace['decode']
+        self.offsets = namespace['offsets']
+
+
+@lru_cache(maxsize=MATCH_DECODER_CACHE_SIZE)
+def GetMatchLayout(schema, id64):
+    """
+    Return the MatchLayout for the given schema bytes.
+    """
+    return MatchLayout(schema, id64)
+
+
+class ResponseReader:  # pylint: disable=too-few-public-methods
+    """
+    Incremental reader of a searchd response body.
+
+    The body is received from the socket in chunks into a bounded buffer while the caller
+    decodes it item by item with read(). Decoding is optimistic: an item is decoded from the
+    bytes received so far and accepted only when it ended within them, otherwise more bytes
+    are received and the item is decoded again. Before receiving, the already consumed bytes
+    are dropped, so the buffer only holds the item being decoded instead of the whole response.
+
+    A reader can also wrap a complete response buffer (buffer=...), see
+    SphinxClient._ParseSearchResponse().
+    """
+
+    def __init__(self, sock=None, length=0, buffer=None):
+        self.sock = sock
+        if buffer is not None:
+            self.buffer = buffer
+            self.end = len(buffer)
+            self.left = 0
+        else:
+            self.buffer = bytearray(min(length, RESPONSE_CHUNK_SIZE))
+            self.end = 0
+            self.left = length  # bytes not received yet
+        self.view = memoryview(self.buffer)
+        self.data = self.view[:self.end]  # the received bytes
+        self.pos = 0
+        self.recorded = None  # the consumed bytes dropped while recording
+        self.mark = 0  # start of the recorded bytes still in the buffer
+
+    def start_recording(self):
+        """
+        Record the bytes consumed from now on, see stop_recording().
+        """
+        self.recorded = []
+        self.mark = self.pos
+
+    def stop_recording(self):
+        """
+        Return the bytes consumed since start_recording().
+        """
+        self.recorded.append(bytes(self.data[self.mark:self.pos]))
+        recorded = b''.join(self.recorded)
+        self.recorded = None
+        return recorded
+
+    def read(self, decode, size=0):
+        """
+        Decode the next item with decode(response, p) which returns the item and its end
+        position, or with size > 0 from a fixed width decode(response, p) (e.g. a Struct).
+        """
+        while True:
+            try:
+                if size:
+                    if self.pos + size <= self.end:
+                        value = decode(self.data, self.pos)
+                        self.pos += size
+                        return value
+                else:
+                    value, end = decode(self.data, self.pos)
+                    if end <= self.end:
+                        self.pos = end
+                        return value
+            except (StructError, UnicodeDecodeError):
+                # the item is not complete, e.g. a multibyte character has been cut
+                if not self.left:
+                    raise
+            self._more()
+
+    def _more(self):
+        if not self.left:
+            raise IOError(f'incomplete searchd response, {self.end - self.pos} bytes left')
+        pending = self.end - self.pos
+        if self.pos:
+            if self.recorded is not None:
+                self.recorded.append(bytes(self.buffer[self.mark:self.pos]))
+                self.mark = 0
+            # drop the consumed bytes
+            self.buffer[:pending] = self.buffer[self.pos:self.end]
+            self.pos, self.end = 0, pending
+        if pending == len(self.buffer):
+            # a single item does not fit in the buffer
+            self.buffer = self.buffer + bytearray(min(len(self.buffer), self.left))
+            self.view = memoryview(self.buffer)
+        nbytes = min(len(self.buffer) - pending, self.left)
+        n = self.sock.recv_into(self.view[pending:], nbytes)
+        if not n:
+            raise IOError(f'connection closed, {self.left} bytes of searchd response missing')
+        self.end += n
+        self.left -= n
+        self.data = self.view[:self.end]
+
+
+def RequestsDigest(reqs):
+    """
+    Return the digest of the requests built by AddQuery(), the key of the result cache.
+    """
+    return blake2b(b''.join(reqs), digest_size=16).digest()
+
+
 def AssertInt32(value):
     assert isinstance(value, int)
     assert -2**31 <= value <= 2**31 - 1
@@ -1359,6 +2045,168 @@ def AssertUInt64(value):
     return True
 
 
+RequestSettings = namedtuple(
+    'RequestSettings',
+    (
+        'query_flags',
+        'offset',
+        'limit',
+        'mode',
+        'ranker',
+        'rankexpr',
+        'sort',
+        'sortby',
+        'weights',
+        'min_id',
+        'max_id',
+        'filters',
+        'groupfunc',
+        'groupby',
+        'maxmatches',
+        'groupsort',
+        'cutoff',
+        'retrycount',
+        'retrydelay',
+        'groupdistinct',
+        'anchor',
+        'indexweights',
+        'maxquerytime',
+        'fieldweights',
+        'overrides',
+        'select',
+        'predictedtime',
+        'outerorderby',
+        'outeroffset',
+        'outerlimit',
+        'hasouter',
+    )
+)
+
+
+def _FilterSettings(f):
+    """
+    Return a filter dict as hashable (attr, type, exclude, values) tuple.
+    """
+    filtertype = f['type']
+    if filtertype == SPH_FILTER_VALUES:
+        values = tuple(f['values'])
+    elif filtertype in (SPH_FILTER_RANGE, SPH_FILTER_FLOATRANGE):
+        values = (f['min'], f['max'])
+    else:
+        values = f['value']
+    return (f['attr'], filtertype, f['exclude'], values)
+
+
+@lru_cache(maxsize=REQUEST_TEMPLATE_CACHE_SIZE)
+def GetRequestTemplate(settings):
+    """
+    Serialize the search request settings once.
+
+    Return the (before_query, before_index, before_comment, after_comment) bytes of the
+    request, AddQuery() splices the length prefixed query, index and comment in between.
+    """
+    s = settings
+    before_query = [pack('>5L', s.query_flags, s.offset, s.limit, s.mode, s.ranker)]
+    if s.ranker == SPH_RANK_EXPR:
+        before_query.append(pack('>L', len(s.rankexpr)))
+        before_query.append(s.rankexpr)
+    before_query.append(pack('>L', s.sort))
+    before_query.append(pack('>L', len(s.sortby)))
+    before_query.append(s.sortby)
+
+    before_index = [pack('>L', len(s.weights))]
+    for w in s.weights:
+        before_index.append(pack('>L', w))
+
+    req = []
+    req.append(pack('>L', 1))  # id64 range marker
+    req.append(pack('>Q', s.min_id))
+    req.append(pack('>Q', s.max_id))
+
+    # filters
+    req.append(pack('>L', len(s.filters)))
+    for attr, filtertype, exclude, values in s.filters:
+        req.append(pack('>L', len(attr)) + attr)
+        req.append(pack('>L', filtertype))
+        if filtertype == SPH_FILTER_VALUES:
+            req.append(pack('>L', len(values)))
+            for val in values:
+                req.append(pack('>q', val))
+        elif filtertype == SPH_FILTER_RANGE:
+            req.append(pack('>2q', *values))
+        elif filtertype == SPH_FILTER_FLOATRANGE:
+            req.append(pack('>2f', *values))
+        elif filtertype == SPH_FILTER_STRING:
+            req.append(pack('>L', len(values)))
+            req.append(values)
+        req.append(pack('>L', exclude))
+
+    # group-by, max-matches, group-sort
+    req.append(pack('>2L', s.groupfunc, len(s.groupby)))
+    req.append(s.groupby)
+    req.append(pack('>2L', s.maxmatches, len(s.groupsort)))
+    req.append(s.groupsort)
+    req.append(pack('>LLL', s.cutoff, s.retrycount, s.retrydelay))
+    req.append(pack('>L', len(s.groupdistinct)))
+    req.append(s.groupdistinct)
+
+    # anchor point
+    if len(s.anchor) == 0:
+        req.append(pack('>L', 0))
+    else:
+        attrlat, attrlong, latitude, longitude = s.anchor
+        req.append(pack('>L', 1))
+        req.append(pack('>L', len(attrlat)) + attrlat)
+        req.append(pack('>L', len(attrlong)) + attrlong)
+        req.append(pack('>f', latitude) + pack('>f', longitude))
+
+    # per-index weights
+    req.append(pack('>L', len(s.indexweights)))
+    for indx, weight in s.indexweights:
+        req.append(pack('>L', len(indx)) + indx + pack('>L', weight))
+
+    # max query time
+    req.append(pack('>L', s.maxquerytime))
+
+    # per-field weights
+    req.append(pack('>L', len(s.fieldweights)))
+    for field, weight in s.fieldweights:
+        req.append(pack('>L', len(field)) + field + pack('>L', weight))
+    before_comment = req
+
+    # attribute overrides
+    req = [pack('>L', len(s.overrides))]
+    for name, type_, values in s.overrides:
+        req.extend((pack('>L', len(name)), name))
+        req.append(pack('>LL', type_, len(values)))
+        for idU64, value in values:
+            req.append(pack('>Q', idU64))
+            if type_ == SPH_ATTR_FLOAT:
+                req.append(pack('>f', value))
+            elif type_ == SPH_ATTR_BIGINT:
+                req.append(pack('>q', value))
+            elif type_ == SPH_ATTR_STRING:
+                req.append(value)
+            else:
+                req.append(pack('>l', value))
+
+    # select-list
+    req.append(pack('>L', len(s.select)))
+    req.append(s.select)
+    if s.predictedtime > 0:
+        req.append(pack('>L', s.predictedtime))
+
+    # outer
+    req.append(pack('>L', len(s.outerorderby)) + s.outerorderby)
+    req.append(pack('>2L', s.outeroffset, s.outerlimit))
+    if s.hasouter:
+        req.append(pack('>L', 1))
+    else:
+        req.append(pack('>L', 0))
+
+    return (b''.join(before_query), b''.join(before_index), b''.join(before_comment), b''.join(req))
+
+
 def SetBit(flag, bit, on):
     if on:
         flag += (1 << bit)
@@ -1,16 +1,24 @@
 import logging
 import os
 
+from werkzeug.exceptions import GatewayTimeout
+from werkzeug.exceptions import ServiceUnavailable
+
 from flask import jsonify
 from flask import make_response
 from flask import request
 
 from app.app import app
-from app.lib import sphinxapi
+from app.app import cache
+from app.helpers.index_version import get_index_version
+from app.helpers.response_cache import get_response_cache
+from app.helpers.response_cache import response_cache_key
+from app.helpers.response_cache import response_etag
+from app.helpers.single_flight import get_single_flight
+from app.helpers.sphinx_pool import get_sphinx_pool
+from app.helpers.utils import accepts_gzip
+from app.helpers.utils import gzip_response
 from app.search import Search
-from app.settings import SEARCH_SPHINX_HOST
-from app.settings import SEARCH_SPHINX_PORT
-from app.settings import SEARCH_SPHINX_TIMEOUT
 from app.version import APP_VERSION
 
 logger = logging.getLogger(__name__)
@@ -23,19 +31,14 @@ def checker():
 
 @app.route('/checker/ready', methods=['GET'])
 def readiness():
-    # set up sphinx client
-    sphinx = sphinxapi.SphinxClient()
-    sphinx.SetServer(SEARCH_SPHINX_HOST, SEARCH_SPHINX_PORT)
-    sphinx.SetConnectTimeout(SEARCH_SPHINX_TIMEOUT)
-    sphinx.SetMatchMode(sphinxapi.SPH_MATCH_EXTENDED)
-
-    # run query
-    result = sphinx.Query('nofx', 'swisssearch')
-    sphinx_status = {
-        'data': result if result is not None else 'ERROR or WARNING',
-        'error_msg': sphinx.GetLastError(),
-        'warning_msg': sphinx.GetLastWarning()
-    }
+    # borrow a sphinx client from the connection pool and run query
+    with get_sphinx_pool().client(cached=False) as sphinx:
+        result = sphinx.Query('nofx', 'swisssearch')
+        sphinx_status = {
+            'data': result if result is not None else 'ERROR or WARNING',
+            'error_msg': sphinx.GetLastError(),
+            'warning_msg': sphinx.GetLastWarning()
+        }
 
     if result:
         return make_response(jsonify({'success': True, 'message': 'OK'}))
@@ -44,8 +47,63 @@ def readiness():
     return make_response(jsonify({'success': False, 'status': sphinx_status}), 503)
 
 
+@app.route('/checker/stats', methods=['GET'])
+def stats():
+    # internal counters of the worker process that answers the request
+    pool = get_sphinx_pool()
+    response_cache = get_response_cache()
+    return make_response(
+        jsonify({
+            'pid': os.getpid(),
+            'sphinx_pool': pool.stats,
+            'sphinx_batch': pool.batcher.stats if pool.batcher is not None else None,
+            'sphinx_cache': pool.cache.stats if pool.cache is not None else None,
+            'single_flight': get_single_flight().stats,
+            'response_cache': response_cache.stats if response_cache is not None else None,
+            'response_cache_top': response_cache.top() if response_cache is not None else None,
+            'app_cache': getattr(cache.cache, 'stats', None),
+        })
+    )
+
+
 @app.route('/rest/services/<topic>/SearchServer', methods=['GET'])
 def search_server(topic='all'):
+    cache_key = response_cache_key(request)
+    etag = response_etag(cache_key, get_index_version())
+    if request.if_none_match.contains_weak(etag):
+        # revalidation of a response of the same indexes, nothing to search
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    response_cache = get_response_cache()
+    if response_cache is not None:
+        response = response_cache.get(cache_key)
+        if response is not None:
+            return response
+
+    try:
+        response = search_response(topic)
+    except (GatewayTimeout, ServiceUnavailable):
+        # stale-if-error: serve the last response of the request while searchd is failing
+        stale = response_cache.get_stale(cache_key) if response_cache is not None else None
+        if stale is None:
+            raise
+        logger.warning('Search failed, serving the stale cached response')
+        return stale
+
+    response.set_etag(etag)
+
+    if response_cache is not None:
+        # the body is cached compressed, see the app compress hook
+        if accepts_gzip(request):
+            gzip_response(response)
+        response_cache.set(cache_key, response)
+
+    return response
+
+
+def search_response(topic):
     search = Search(request, topic)
     content_type_override = None
 
@@ -57,7 +115,7 @@ def search_server(topic='all'):
     else:
         results = search.search()
 
-    response = make_response(jsonify(results))
+    response = make_response(search.json_response(results))
 
     callback = request.args.get('callback', None)
     if callback is not None:
@@ -77,15 +135,9 @@ def search_server(topic='all'):
 def service_info(topic='all'):  # pylint: disable=unused-argument
     # The topic parameter is not used in this endpoint
     sphinx_service = os.getenv('SERVICE_SPHINX_NAME', 'service-search-sphinx')
-    sphinx_file = os.getenv('SERVICE_SPHINX_FILE', '/usr/local/share/app/version.txt')
-    try:
-        with open(sphinx_file, 'r', encoding='utf-8') as version_file:
-            sphinx_version = version_file.read().strip()
-    except FileNotFoundError:
-        sphinx_version = 'unknown'
 
     services = [{
-        'name': sphinx_service, 'version': sphinx_version
+        'name': sphinx_service, 'version': get_index_version()
     }, {
         'name': 'service-search-wsgi', 'version': APP_VERSION
     }]
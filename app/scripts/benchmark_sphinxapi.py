@@ -0,0 +1,172 @@
+'''Micro-benchmarks of the sphinxapi client encoding and decoding
+
+Uses the searchd responses recorded for the unit tests, run from the project root with
+
+    python -m app.scripts.benchmark_sphinxapi
+'''
+import json
+import timeit
+import tracemalloc
+from functools import partial
+
+from app.lib import sphinxapi
+from tests.unit_tests.sphinxapi_patch import patch_sphinx_server
+
+# pylint: disable=invalid-name,protected-access
+
+RECORDED_RESPONSES = {
+    'search_query': patch_sphinx_server.MOCK_SEARCH_QUERY_SOCK.data,
+    'query_3': patch_sphinx_server.MOCK_QUERY_SOCK_3.data,
+}
+# feature search like batch: many indexes in one RunQueries
+BATCH_SIZE = 20
+
+
+def bench(label, stmt, number):
+    best = min(timeit.repeat(stmt, number=number, repeat=5))
+    print(f'{label:<45} {best / number * 1e6:10.1f} us')
+    return best
+
+
+def benchmark_decoder(number=500):
+    print('Match decoder (per response)')
+    parse = sphinxapi.SphinxClient._ParseSearchResponse
+    for name, data in RECORDED_RESPONSES.items():
+        for nreqs in (1, BATCH_SIZE):
+            response = memoryview(data * nreqs)
+            generic = bench(
+                f'{name} x{nreqs} generic', partial(parse, response, nreqs, compiled=False), number
+            )
+            compiled = bench(f'{name} x{nreqs} compiled', partial(parse, response, nreqs), number)
+            print(f'{"speedup":<45} {generic / compiled:10.2f} x')
+            lazy = bench(
+                f'{name} x{nreqs} lazy (undecoded)',
+                partial(parse, response, nreqs, lazy=True),
+                number
+            )
+            print(f'{"speedup":<45} {generic / lazy:10.2f} x')
+
+
+def decode_and_dumps(response, nreqs):
+    results = sphinxapi.SphinxClient._ParseSearchResponse(response, nreqs)
+    matches = [match for result in results for match in result['matches']]
+    return json.dumps({'results': matches}, sort_keys=True, separators=(',', ':'))
+
+
+def transcode(response, nreqs, transform):
+    results = sphinxapi.SphinxClient._ParseSearchResponse(response, nreqs, transform=transform)
+    matches = ','.join(match.dumps() for result in results for match in result['matches'])
+    return f'{{"results":[{matches}]}}'
+
+
+def benchmark_transcoder(number=500):
+    print('JSON transcoder (per response)')
+    transform = sphinxapi.AttrsTransform()
+    for name, data in RECORDED_RESPONSES.items():
+        response = memoryview(data * BATCH_SIZE)
+        decoded = bench(
+            f'{name} x{BATCH_SIZE} decode + json.dumps',
+            partial(decode_and_dumps, response, BATCH_SIZE),
+            number
+        )
+        transcoded = bench(
+            f'{name} x{BATCH_SIZE} transcode',
+            partial(transcode, response, BATCH_SIZE, transform),
+            number
+        )
+        print(f'{"speedup":<45} {decoded / transcoded:10.2f} x')
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def parse_buffered(data):
+    sphinxapi.SphinxClient._ParseSearchResponse(memoryview(bytearray(data)), BATCH_SIZE)
+
+
+def parse_streamed(data, chunk_size):
+    header = sphinxapi._HEADER.pack(sphinxapi.SEARCHD_OK, sphinxapi.VER_COMMAND_SEARCH, len(data))
+    sock = patch_sphinx_server.MockSocket(header, data, chunk_size)
+    response = sphinxapi.SphinxClient()._GetResponse(sock, sphinxapi.VER_COMMAND_SEARCH, True)
+    sphinxapi.SphinxClient._ParseSearchResponse(response, BATCH_SIZE)
+
+
+def configure_swiss_search(client):
+    client.SetMatchMode(sphinxapi.SPH_MATCH_EXTENDED)
+    client.SetRankingMode(sphinxapi.SPH_RANK_WORDCOUNT)
+    client.SetSortMode(sphinxapi.SPH_SORT_EXTENDED, 'rank ASC, @weight DESC, num ASC')
+    client.SetLimits(0, 50)
+    client.SetFilter('rank', [1, 2, 3, 4, 5, 6, 7, 8, 10])
+
+
+def configure_layer_search(client):
+    client.SetMatchMode(sphinxapi.SPH_MATCH_EXTENDED)
+    client.SetLimits(0, 30)
+    client.SetRankingMode(sphinxapi.SPH_RANK_WORDCOUNT)
+    client.SetSortMode(sphinxapi.SPH_SORT_EXTENDED, '@weight DESC')
+    client.SetFieldWeights({'@title': 4, '@detail': 2, '@layer': 1})
+
+
+def configure_feature_search(client):
+    client.SetMatchMode(sphinxapi.SPH_MATCH_EXTENDED)
+    client.SetLimits(0, 10)
+    client.SetRankingMode(sphinxapi.SPH_RANK_WORDCOUNT)
+    client.SetGeoAnchor('lat', 'lon', 0.8196, 0.1298)
+    client.SetSortMode(sphinxapi.SPH_SORT_EXTENDED, '@weight DESC, @geodist ASC')
+    client.SetFilter('year', [2010, 2015, 2020])
+    client.SetFilter('lang', [1, 2])
+
+
+REQUEST_SETTINGS = {
+    'swiss_search': configure_swiss_search,
+    'layer_search': configure_layer_search,
+    'feature_search': configure_feature_search,
+}
+QUERY = '@detail wald* & @geom_quadindex 0302*'
+
+
+def add_query(client):
+    client.AddQuery(QUERY, index='swisssearch')
+    client._reqs.clear()
+
+
+def add_query_without_template(client):
+    # serialize all the settings for each query like before the request templates
+    get_request_template = sphinxapi.GetRequestTemplate
+    sphinxapi.GetRequestTemplate = get_request_template.__wrapped__
+    try:
+        add_query(client)
+    finally:
+        sphinxapi.GetRequestTemplate = get_request_template
+
+
+def benchmark_request_templates(number=5000):
+    print('Request encoding (per AddQuery)')
+    for name, configure in REQUEST_SETTINGS.items():
+        client = sphinxapi.SphinxClient()
+        configure(client)
+        before = bench(f'{name} serialized', partial(add_query_without_template, client), number)
+        after = bench(f'{name} template', partial(add_query, client), number)
+        print(f'{"speedup":<45} {before / after:10.2f} x')
+
+
+def benchmark_streaming(chunk_size=1460):
+    print('Streamed response (peak memory per response)')
+    for name, data in RECORDED_RESPONSES.items():
+        data = data * BATCH_SIZE
+        buffered = peak_memory(partial(parse_buffered, data))
+        streamed = peak_memory(partial(parse_streamed, data, chunk_size))
+        print(f'{f"{name} x{BATCH_SIZE} buffered":<45} {buffered:10d} B')
+        print(f'{f"{name} x{BATCH_SIZE} streamed":<45} {streamed:10d} B')
+
+
+if __name__ == '__main__':
+    benchmark_decoder()
+    benchmark_streaming()
+    benchmark_transcoder()
+    benchmark_request_templates()
@@ -1,5 +1,8 @@
+# pylint: disable=too-many-lines
 import logging
+import math
 import re
+from hashlib import blake2b
 
 import pyproj.exceptions
 from opentelemetry import trace
@@ -12,6 +15,10 @@ from werkzeug.exceptions import InternalServerError
 from werkzeug.exceptions import NotFound
 from werkzeug.exceptions import ServiceUnavailable
 
+from flask import current_app
+from flask import jsonify
+
+from app.app import cache
 from app.helpers import mortonspacekey as msk
 from app.helpers.db import get_translation
 from app.helpers.helpers_search import center_from_box2d
@@ -20,15 +27,31 @@ from app.helpers.helpers_search import format_search_text
 from app.helpers.helpers_search import get_transformer
 from app.helpers.helpers_search import ilen
 from app.helpers.helpers_search import parse_box2d
+from app.helpers.helpers_search import remove_accents
 from app.helpers.helpers_search import shift_to
 from app.helpers.helpers_search import \
     transform_round_geometry as transform_shape
+from app.helpers.index_version import get_index_version
+from app.helpers.query_compiler import is_digit
+from app.helpers.query_compiler import quadindex_filter
+from app.helpers.query_compiler import query_fields
+from app.helpers.query_planner import get_keyword_stats
+from app.helpers.query_planner import likely_misspelled
+from app.helpers.query_planner import plan_query
+from app.helpers.single_flight import get_single_flight
+from app.helpers.sphinx_pool import get_sphinx_pool
 from app.helpers.validation_search import SearchValidation
 from app.lib import sphinxapi
 from app.settings import GEODATA_STAGING
-from app.settings import SEARCH_SPHINX_HOST
-from app.settings import SEARCH_SPHINX_PORT
-from app.settings import SEARCH_SPHINX_TIMEOUT
+from app.settings import SEARCH_FUZZY_SPECULATIVE
+from app.settings import SEARCH_JSON_TRANSCODER
+from app.settings import SEARCH_LOCATIONS_BBOX_COVER
+from app.settings import SEARCH_LOCATIONS_BBOX_SNAP
+from app.settings import SEARCH_LOCATIONS_CACHE_TTL
+from app.settings import SEARCH_LOCATIONS_TYPEAHEAD
+from app.settings import SEARCH_QUERY_INFIX_MIN_LENGTH
+from app.settings import SEARCH_QUERY_PLANNER
+from app.settings import SEARCH_SINGLE_FLIGHT
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +65,27 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
     FEATURE_LIMIT = 20
     DEFAULT_SRID = 21781
     BBOX_SEARCH_LIMIT = 150
+    # max. ratio between the morton cell and the bbox size to snap a search to the cell
+    BBOX_SNAP_MAX_RATIO = 4
+    # cached instead of the results of a morton cell holding more matches than the limit
+    TRUNCATED_CELL = 'truncated'
+    # max. number of cached prefixes of the search text looked up by the typeahead cache
+    TYPEAHEAD_PREFIXES = 8
+    PARCEL_KEYWORDS = ('parzelle', 'parcelle', 'parcella', 'parcel')
+    ADDRESS_KEYWORDS = ('addresse', 'adresse', 'indirizzo', 'address')
+    # Declarative attrs changes per result origin used by the JSON transcoder, they must
+    # match the changes done on the decoded matches (see _parse_feature_results())
+    ATTRS_TRANSFORMS = {
+        'layer': {},
+        'feature': {
+            'choose_srid': True,  # Backward compatible
+            'copy': [('feature_id', 'featureId')],
+            # lang and agnostic in combination with searchLang
+            'drop': ('lang', 'agnostic'),
+            # needed for the exact match boosting and the bbox intersection
+            'keep': ['detail', 'geom_st_box2d'],
+        },
+    }
 
     def __init__(self, request, topic):
         super().__init__(request)
@@ -65,6 +109,12 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
         self.sortbbox = request.args.get('sortbbox', 'true').lower() == 'true'
         self.returnGeometry = request.args.get('returnGeometry', 'true').lower() == 'true'
         self.quadindex = None
+        # morton keys of the quads covering the bbox (see _get_quad_index())
+        self.quadindexes = None
+        # bounds of the morton cell the bbox search is snapped to (see _get_snap_bbox())
+        self.snapbox = None
+        # True if a query of the last swiss search returned as many matches as its limit
+        self.truncated = False
         self.origins = request.args.get('origins')
         self.featureIndexes = request.args.get('features')
         self.timeInstant = request.args.get('timeInstant')
@@ -75,12 +125,15 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
 
         self.results = {'results': []}
         self.request = request
+        # layers and features are transcoded from the searchd response directly to JSON
+        self.transcode = (
+            SEARCH_JSON_TRANSCODER and self.typeInfo in ('layers', 'featuresearch') and
+            request.args.get('geometryFormat') not in ('geojson', 'esrijson')
+        )
 
-        morton_box = [420000, 30000, 900000, 510000]
-        self.quadtree = msk.QuadTree(msk.BBox(*morton_box), 20)
-        self.sphinx = sphinxapi.SphinxClient()
-        self.sphinx.SetServer(SEARCH_SPHINX_HOST, SEARCH_SPHINX_PORT)
-        self.sphinx.SetMatchMode(sphinxapi.SPH_MATCH_EXTENDED)
+        self.quadtree = msk.get_quadtree()
+        # borrowed from the worker connection pool for the duration of search()
+        self.sphinx = None
 
     # is being called from routes.py directly
     def view_find_geojson(self):
@@ -88,6 +141,20 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
         bounds = bbox.bounds if bbox is not None else None
         return {"type": "FeatureCollection", "bbox": bounds, "features": features}
 
+    # is being called from routes.py directly
+    def json_response(self, results):
+        '''Return the JSON response of the results
+
+        The transcoded matches (see sphinxapi.MatchEncoder) are already JSON, they are joined
+        into the same body as jsonify() would serialize the decoded matches.
+        '''
+        if not self.transcode:
+            return jsonify(results)
+        matches = ','.join(match.dumps() for match in results['results'])
+        return current_app.response_class(
+            f'{{"results":[{matches}]}}\n', mimetype=current_app.json.mimetype
+        )
+
     # is being called from routes.py directly
     @staticmethod
     def view_find_esrijson():
@@ -98,7 +165,8 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
         features_bbox = None
         for item in self.search()['results']:
             if 'attrs' in item and 'id' in item and 'weight' in item:
-                attributes = item['attrs']
+                # the results might be shared (see search())
+                attributes = dict(item['attrs'])
                 attributes['id'] = item['id']
                 attributes['weight'] = item['weight']
                 if attributes['origin'] != 'layer':
@@ -143,7 +211,46 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
 
     # is being called from routes.py directly
     def search(self):
-        self.sphinx.SetConnectTimeout(SEARCH_SPHINX_TIMEOUT)
+        '''Return the search results
+
+        With SEARCH_SINGLE_FLIGHT the identical concurrent searches of the worker share the
+        results of the first one, the results must therefore not be modified.
+        '''
+        if SEARCH_SINGLE_FLIGHT:
+            return get_single_flight().do(self.search_key(), self._pooled_search)
+        return self._pooled_search()
+
+    def search_key(self):
+        '''Return the normalized parameters that define the search results'''
+
+        def as_tuple(value):
+            return tuple(value) if value is not None else None
+
+        return (
+            self.topic_name,
+            self.typeInfo,
+            tuple(self.request.args.get('searchText', '').split()),
+            self.lang,
+            self.searchLang,
+            self.srid,
+            as_tuple(self.bbox),
+            self.sortbbox,
+            self.returnGeometry,
+            as_tuple(self.origins),
+            as_tuple(self.featureIndexes),
+            self.timeInstant,
+            as_tuple(self.timeEnabled),
+            as_tuple(self.timeStamps),
+            self.limit,
+            self.request.args.get('geometryFormat'),
+        )
+
+    def _pooled_search(self):
+        with get_sphinx_pool().client() as sphinx:
+            self.sphinx = sphinx
+            return self._search()
+
+    def _search(self):
         # create a quadindex if the bbox is defined
         if self.bbox is not None and self.typeInfo not in ('layers', 'featuresearch'):
             self._get_quad_index()
@@ -171,13 +278,7 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
 
     def _fuzzy_search(self, searchTextFinal):
         logger.debug("Search fuzzy; searchText=%s", searchTextFinal)
-        # We use different ranking for fuzzy search
-        # For ranking modes, see http://sphinxsearch.com/docs/current.html#weighting
-        self.sphinx.SetRankingMode(sphinxapi.SPH_RANK_BM25)
-        # Only include results with a certain weight. This might need tweaking
-        # with the quorum operator lesser weights should be added to the results for the better
-        # support of fuzziness
-        self.sphinx.SetFilterRange('@weight', 1000, 2**32 - 1)
+        self._set_fuzzy_ranking()
         try:
             results = None
             if self.typeInfo in ('locations'):
@@ -186,10 +287,40 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
             logger.exception('Failed to run query: %s', error)
             raise GatewayTimeout() from error
 
-        if results is None:
+        return self._fuzzy_results(results)
+
+    def _set_fuzzy_ranking(self):
+        # We use different ranking for fuzzy search
+        # For ranking modes, see http://sphinxsearch.com/docs/current.html#weighting
+        self.sphinx.SetRankingMode(sphinxapi.SPH_RANK_BM25)
+        # Only include results with a certain weight. This might need tweaking
+        # with the quorum operator lesser weights should be added to the results for the better
+        # support of fuzziness
+        self.sphinx.SetFilterRange('@weight', 1000, 2**32 - 1)
+
+    def _add_speculative_fuzzy_query(self):
+        '''Add the fuzzy query to the swiss search batch if the text is likely misspelled
+
+        The fuzzy query is the last one of the batch, its settings must be set after the
+        other queries were added. Returns True if the query was added.
+        '''
+        if not SEARCH_FUZZY_SPECULATIVE or not likely_misspelled(
+            tuple(self.searchText), 'swisssearch', get_keyword_stats()
+        ):
+            return False
+        self._set_fuzzy_ranking()
+        self.sphinx.AddQuery(self._query_fields('@detail', True), index='swisssearch_fuzzy')
+        return True
+
+    def _fuzzy_results(self, results):
+        if results is None or results['status'] not in (
+            sphinxapi.SEARCHD_OK, sphinxapi.SEARCHD_WARNING
+        ):
             error = "Failed to run sphinx query"
             if self.sphinx.GetLastError():
                 error += f": {self.sphinx.GetLastError()}"
+            elif results is not None:
+                error += f": {results['error']}"
             logger.error(error)
             raise ServiceUnavailable(description=error)
 
@@ -197,18 +328,276 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
         self.results['fuzzy'] = 'true'
         return results
 
-    def _swiss_search(self):  # pylint: disable=too-many-branches, too-many-statements, too-many-locals
+    def _swiss_search(self):
+        '''Search the locations
+
+        The raw swiss search results only depend on the parameters of the searchd queries, with
+        SEARCH_LOCATIONS_CACHE_TTL they are cached in the app cache and shared by all the
+        languages, SRIDs and geometry formats. The lang, sr, returnGeometry and geometryFormat
+        dependent parsing (see _parse_location_results()) is done on a copy of the matches.
+
+        With SEARCH_LOCATIONS_BBOX_SNAP the bbox searches sorted by distance are snapped to the
+        morton cell of the bbox (see _get_snap_bbox()), the cached results of the cell are
+        sorted by distance to the bbox center and filtered by the bbox for each request. If the
+        cell holds more matches than the limit, searchd only returns the ones nearest to the cell
+        center and the search falls back to the bbox.
+        '''
         logger.debug("Search locations (swiss search); searchText=%s", self.searchText)
+        limit = self._locations_limit()
+        if SEARCH_LOCATIONS_CACHE_TTL:
+            results = self._cached_swiss_search()
+        else:
+            results, _, _ = self._raw_swiss_search()
+        if len(results) != 0:
+            self._parse_location_results(results, limit)
+
+    def _cached_swiss_search(self):
+        '''Return a copy of the cached raw swiss search matches
+
+        The cached raw results are a tuple (fuzzy, number of exact matches, complete, matches),
+        see _raw_swiss_search().
+        '''
+        self.snapbox = self._get_snap_bbox()
+        search_text = list(self.searchText)
+        cached = self._get_cached_locations()
+        if cached is None:
+            # the matches of the bbox beyond the limit of the cell might be missing
+            logger.debug("Snapped swiss search truncated, search the bbox %s", self.bbox)
+            self.snapbox = None
+            # undo the keyword detection and the fuzzy ranking of the snapped search
+            self.searchText[:] = search_text
+            self.sphinx.ResetFilters()
+            self.sphinx.SetRankingMode(sphinxapi.SPH_RANK_PROXIMITY_BM25)
+            cached = self._get_cached_locations()
+        fuzzy, exact, _, matches = cached
+        if fuzzy:
+            self.results['fuzzy'] = fuzzy
+        # the cached matches must not be modified
+        results = [{
+            'id': doc, 'weight': weight, 'attrs': dict(attrs)
+        } for doc, weight, attrs in matches]
+        if self.snapbox is not None:
+            # the exact matches have priority, as merged by _raw_swiss_search()
+            results = self._sort_by_geodist(results[:exact]
+                                           ) + self._sort_by_geodist(results[exact:])
+        return results
+
+    def _get_cached_locations(self):
+        '''Return the cached raw swiss search results, search and cache them if missing
+
+        Returns None if the snapped search was truncated, the cell is then marked as truncated
+        so that the later searches of the cell go straight to the bbox.
+        '''
+        key = self._locations_cache_key(self.searchText)
+        cached = cache.get(key)
+        if cached == self.TRUNCATED_CELL:
+            return None
+        if cached is None and SEARCH_LOCATIONS_TYPEAHEAD:
+            cached = self._typeahead_swiss_search()
+            if cached is not None:
+                cache.set(key, cached, timeout=SEARCH_LOCATIONS_CACHE_TTL)
+        if cached is None:
+            results, exact, complete = self._raw_swiss_search()
+            if self.snapbox is not None and self.truncated:
+                cache.set(key, self.TRUNCATED_CELL, timeout=SEARCH_LOCATIONS_CACHE_TTL)
+                return None
+            # plain matches, the lazy ones are bound to the searchd response
+            cached = (
+                self.results.get('fuzzy'),
+                exact,
+                complete,
+                tuple((match['id'], match['weight'], dict(match['attrs'])) for match in results)
+            )
+            cache.set(key, cached, timeout=SEARCH_LOCATIONS_CACHE_TTL)
+        return cached
+
+    def _typeahead_swiss_search(self):
+        '''Return the raw results refined from the complete cached results of a prefix
+
+        The cached results of a prefix of the search text (e.g. `bern` for `berne`) are complete
+        when both searchd queries returned fewer matches than their limit, with the infix
+        expansion of all the tokens and without keyword nor fuzzy search (see _all_infix()). The
+        matches of the search text are then the cached matches whose detail contains all its
+        tokens (as prefix of a word for the tokens starting with a digit). The proximity of the
+        tokens is not checked, the exact match boost of the weights is updated and the matches
+        are sorted again as by searchd (see _refine_locations()).
+
+        Only the plain ASCII alphanumeric tokens are refined and the details are folded as the
+        search text (see remove_accents()), the charset table of searchd is not reproduced
+        though and the results can differ from searchd. Returns None if no complete prefix
+        results are cached or if none of them matches, the search text might be misspelled.
+        '''
+        tokens = [token.lower() for token in self.searchText]
+        if self._has_keyword(tokens
+                            ) or not all(token.isascii() and token.isalnum() for token in tokens):
+            # the keywords, separators and escaped characters are not part of the matched words
+            return None
+        text = ' '.join(tokens)
+        previous = tokens
+        prefixes = 0
+        for length in range(len(text) - 1, SEARCH_QUERY_INFIX_MIN_LENGTH - 1, -1):
+            prefix = text[:length].split()
+            if prefix == previous:
+                continue
+            previous = prefix
+            cached = cache.get(self._locations_cache_key(prefix))
+            if cached not in (None, self.TRUNCATED_CELL) and cached[2]:
+                logger.debug("Refine the cached swiss search results of %s", prefix)
+                return self._refine_locations(cached, prefix, tokens)
+            prefixes += 1
+            if prefixes == self.TYPEAHEAD_PREFIXES:
+                break
+        return None
+
+    def _refine_locations(self, cached, prefix, tokens):
+        _, exact, _, matches = cached
+        prefix_text = ' '.join(prefix)
+        text = ' '.join(tokens)
+        exact_matches = []
+        other_matches = []
+        for i, (doc, weight, attrs) in enumerate(matches):
+            # folded as the search text
+            detail = remove_accents(attrs.get('detail', '')).lower()
+            if not self._contains_tokens(detail, tokens):
+                continue
+            if i < exact and self._is_exact_prefix(detail, prefix_text):
+                weight -= 99
+            if self._is_exact_prefix(detail, text):
+                exact_matches.append((doc, weight + 99, attrs))
+            else:
+                other_matches.append((doc, weight, attrs))
+        # e.g. the exact matches of the prefix that are not exact matches anymore
+        if not exact_matches and not other_matches:
+            # searchd might find fuzzy results
+            return None
+        exact_matches = self._sort_cached(exact_matches)
+        other_matches = self._sort_cached(other_matches)
+        return (None, len(exact_matches), True, tuple(exact_matches + other_matches))
+
+    def _sort_cached(self, matches):
+        '''Sort the cached matches as searchd (see _raw_swiss_search())
+
+        The wordcount weights of the cached matches are those of the cached search text.
+        '''
+        if self.bbox is not None and self.sortbbox:
+            distance = self._geodist()
+            return sorted(matches, key=lambda match: distance(match[2]))
+        return sorted(matches, key=lambda match: (match[2]['rank'], -match[1], match[2]['num']))
 
-        limit = self.limit if self.limit and \
-            self.limit <= self.LOCATION_LIMIT else self.LOCATION_LIMIT
+    @staticmethod
+    def _contains_tokens(detail, tokens):
+        words = detail.split()
+        return all(
+            any(word.startswith(token)
+                for word in words) if is_digit(token) else token in detail
+            for token in tokens
+        )
+
+    @staticmethod
+    def _is_exact_prefix(detail, text):
+        # exact matches have priority over prefix matches
+        # searchText=waldhofstrasse+1
+        # waldhofstrasse 1 -> weight 100
+        # waldhofstrasse 1.1 -> weight 1
+        return detail.startswith(f"{text} ") or detail == text
+
+    def _has_keyword(self, tokens):
+        return (
+            self.origins is None and len(tokens) > 0 and
+            tokens[0].lower() in self.PARCEL_KEYWORDS + self.ADDRESS_KEYWORDS
+        )
+
+    def _all_infix(self, plan):
+        '''Return True if searchd expanded all the text tokens of the query sent with the plan
+        as infixes
+
+        The tokens shorter than SEARCH_QUERY_INFIX_MIN_LENGTH (searchd min_infix_len) are not
+        expanded, even if their infix was sent.
+        '''
+        return (plan is None or all(plan.infix)) and all(
+            is_digit(token) or len(token) >= SEARCH_QUERY_INFIX_MIN_LENGTH
+            for token in self.searchText
+        )
+
+    def _locations_limit(self):
+        max_limit = self.LOCATION_LIMIT
+        if self.bbox is not None and self.sortbbox:
+            max_limit = self.BBOX_SEARCH_LIMIT
+        return self.limit if self.limit and self.limit <= max_limit else max_limit
+
+    def _locations_cache_key(self, tokens):
+        '''Return the app cache key of the raw swiss search results of the search tokens'''
+        area, limit = self.bbox, self.limit
+        if self.snapbox is not None:
+            # the limit is applied after the sort by distance to the bbox
+            area, limit = self.quadindex, None
+        elif self.bbox is not None and not self.sortbbox:
+            # the bbox only filters the searchd queries by its morton cells
+            area = self.quadindexes
+        key = repr((
+            tuple(token.lower() for token in tokens),
+            self.bbox is not None,
+            area,
+            self.sortbbox,
+            self.origins,
+            limit,
+        ))
+        digest = blake2b(key.encode(), digest_size=16).hexdigest()
+        return f'locations:{get_index_version()}:{digest}'
+
+    def _get_snap_bbox(self):
+        '''Return the bounds of the morton cell the bbox search is snapped to, None if not snapped
+
+        Only the searches sorted by distance are snapped, and only when the cell is at most
+        BBOX_SNAP_MAX_RATIO times larger than the bbox (e.g. a small bbox across the border of
+        two large cells is not snapped to their common parent cell).
+        '''
+        if not SEARCH_LOCATIONS_BBOX_SNAP or self.bbox is None or not self.sortbbox or \
+                self.quadindex is None:
+            return None
+        cell = self.quadtree.morton_to_bbox(self.quadindex)
+        size = max(abs(self.bbox[2] - self.bbox[0]), abs(self.bbox[3] - self.bbox[1]))
+        if cell.width() > self.BBOX_SNAP_MAX_RATIO * size:
+            return None
+        return cell.bounds
+
+    def _sort_by_geodist(self, results):
+        '''Sort the matches by distance to the bbox center, as the @geodist ASC sort of searchd'''
+        distance = self._geodist()
+        return sorted(results, key=lambda match: distance(match['attrs']))
+
+    def _geodist(self):
+        '''Return the function of the distance of the match attributes to the bbox center
+
+        The equirectangular approximation of the distance is exact enough to order the matches
+        of a morton cell.
+        '''
+        lon, lat = self._get_geoanchor_from_bbox(self.bbox)
+        scale = math.cos(math.radians(lat))
+
+        def distance(attrs):
+            if 'lat' not in attrs or 'lon' not in attrs:
+                return math.inf
+            return (attrs['lat'] - lat)**2 + ((attrs['lon'] - lon) * scale)**2
+
+        return distance
+
+    def _raw_swiss_search(self):  # pylint: disable=too-many-branches, too-many-statements, too-many-locals
+        '''Return the merged swiss search matches, the number of exact matches among them and
+        whether the matches are complete (see _typeahead_swiss_search())
+
+        The exact matches come first, each group sorted as requested from searchd.
+        '''
+        limit = self._locations_limit()
         # Define ranking mode
         if self.bbox is not None and self.sortbbox:
-            coords = self._get_geoanchor_from_bbox()
+            if self.snapbox is not None:
+                limit = self.BBOX_SEARCH_LIMIT
+            coords = self._get_geoanchor_from_bbox(
+                self.snapbox if self.snapbox is not None else self.bbox
+            )
             self.sphinx.SetGeoAnchor('lat', 'lon', coords[1], coords[0])  # pylint: disable=unsubscriptable-object
             self.sphinx.SetSortMode(sphinxapi.SPH_SORT_EXTENDED, '@geodist ASC')
-            limit = self.limit if self.limit and \
-                self.limit <= self.BBOX_SEARCH_LIMIT else self.BBOX_SEARCH_LIMIT
             logger.debug("SetGeoAnchor lat = %s, lon = %s", coords[1], coords[0])  # pylint: disable=unsubscriptable-object
         else:
             self.sphinx.SetRankingMode(sphinxapi.SPH_RANK_WORDCOUNT)
@@ -216,7 +605,10 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
             logger.debug("SetRankingMode to wordcount")
 
         self.sphinx.SetLimits(0, limit)
+        # the matches dropped as duplicates or outside of the bbox are never decoded
+        self.sphinx.SetLazyMatches(True)
 
+        keyword = self._has_keyword(self.searchText)
         # Filter by origins if needed
         if self.origins is None:
             self._detect_keywords()
@@ -226,8 +618,10 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
             self._filter_locations_by_origins()
 
         searchList = []
+        plan = None
         if ilen(self.searchText) >= 1:
-            searchText = self._query_fields('@detail')
+            plan = self._plan_query('swisssearch')
+            searchText = self._query_fields('@detail', plan=plan)
             searchList.append(searchText)
 
         if self.bbox is not None:
@@ -247,7 +641,12 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
 
             # exact prefix search, first 10 results
             searchText = '@detail "^{}"'.format(' '.join(self.searchText))  # pylint: disable=consider-using-f-string
+            if self.snapbox is not None:
+                # within the cell as well, a truncated result set is only due to the cell
+                searchText = f'({searchText}) & ({geomFilter})'
             self.sphinx.AddQuery(searchText, index='swisssearch')
+            # the fuzzy search in the same round trip, only used without other results
+            speculative = self._add_speculative_fuzzy_query()
 
             try:
                 results = self.sphinx.RunQueries()
@@ -263,26 +662,28 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
                     error += f": {self.sphinx.GetLastError()}"
                 logger.error(error)
                 raise ServiceUnavailable(description=error)
+            fuzzy_results = results.pop() if speculative else None
+            self._update_keyword_stats('swisssearch', results)
+            self.truncated = any(len(result.get('matches', [])) >= limit for result in results)
+            complete = (
+                len(results) == 2 and
+                all(len(result.get('matches', [])) < limit for result in results) and
+                not keyword and self._all_infix(plan)
+            )
 
             wildcard_results = results[0].get('matches', [])
             merged_results = []
+            exact = 0
             if len(results) == 2:
                 # we have results from both queries (exact + wildcard)
                 # prepend exact search results to wildcard search result
                 exact_results = results[1].get('matches', [])
-                # exact matches have priority over prefix matches
-                # searchText=waldhofstrasse+1
-                # waldhofstrasse 1 -> weight 100
-                # waldhofstrasse 1.1 -> weight 1
+                search_text_joined = ' '.join(self.searchText).lower()
                 for result in exact_results:
-                    detail = result['attrs']['detail']
-                    search_text_joined = ' '.join(self.searchText).lower()
-                    if (
-                        detail.startswith(f"{search_text_joined} ") or
-                        detail == ' '.join(self.searchText).lower()
-                    ):
+                    if self._is_exact_prefix(result['attrs']['detail'], search_text_joined):
                         result['weight'] += 99
                 merged_results = exact_results + wildcard_results
+                exact = len({result['id'] for result in exact_results})
             else:
                 # we have results from one or no query
                 merged_results = wildcard_results
@@ -297,13 +698,18 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
 
             # if standard index did not find anything, use metaphone indices
             # which should be more fuzzy in its results
-            if len(results) <= 0:
+            if len(results) <= 0 and fuzzy_results is not None:
+                results = self._fuzzy_results(fuzzy_results)
+                complete = False
+            elif len(results) <= 0:
                 searchTextFinal = self._query_fields('@detail', True)
                 results = self._fuzzy_search(searchTextFinal)
+                complete = False
         else:
             results = []
-        if results is not None and len(results) != 0:
-            self._parse_location_results(results, limit)
+            exact = 0
+            complete = False
+        return results or [], exact, complete
 
     def _layer_search(self):
         logger.debug("Search layer; searchText=%s", self.searchText)
@@ -336,6 +742,8 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
         self.sphinx.SetSortMode(sphinxapi.SPH_SORT_EXTENDED, '@weight DESC')
         # Weights defaults to 1
         self.sphinx.SetFieldWeights({'@title': 4, '@detail': 2, '@layer': 1})
+        if self.transcode:
+            self.sphinx.SetTranscoder(self._attrs_transform('layer'))
 
         index_name = f'layers_{self.lang}'
         topic_name = self.topic_name if self.topic_name != 'all' else ''
@@ -345,7 +753,7 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
         else:
             topicFilter = f'({topic_name} | ech)'
         searchText = ' '.join([
-            self._query_fields('@(title,detail,layer)'),
+            self._query_fields('@(title,detail,layer)', index=index_name),
             f'& @topics {topicFilter}',  # Filter by topic if string not empty, ech whitelist hack
             f'& {staging_filter(GEODATA_STAGING)}'  # Only layers in correct staging are searched
         ])
@@ -361,6 +769,7 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
                 error += f": {self.sphinx.GetLastError()}"
             logger.error(error)
             raise ServiceUnavailable(description=error)
+        self._update_keyword_stats(index_name, [results])
 
         results = results['matches']
         if results is not None and len(results) != 0:
@@ -370,15 +779,11 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
         ''' Recursive and inclusive search through
             quadindex windows. '''
         if self.quadindex is not None:
-            buildQuadQuery = lambda x: ''.join(('@geom_quadindex ', x, ' | '))
-            if len(self.quadindex) == 1:
-                quadSearch = ''.join(('@geom_quadindex ', self.quadindex, '*'))
-            else:
-                quadSearch = ''.join(('@geom_quadindex ', self.quadindex, '* | '))
-                quadSearch += ''.join(
-                    buildQuadQuery(self.quadindex[:-x]) for x in range(1, len(self.quadindex))
-                )[:-len(' | ')]
-            return quadSearch
+            quadindexes = self.quadindexes
+            if self.snapbox is not None:
+                # a snapped search queries its whole morton cell
+                quadindexes = (self.quadindex,)
+            return quadindex_filter(quadindexes)
         return ''
 
     def _feature_search(self):
@@ -394,7 +799,7 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
         self.sphinx.SetLimits(0, featureLimit)
         self.sphinx.SetRankingMode(sphinxapi.SPH_RANK_WORDCOUNT)
         if self.bbox and self.sortbbox:
-            coords = self._get_geoanchor_from_bbox()
+            coords = self._get_geoanchor_from_bbox(self.bbox)
             self.sphinx.SetGeoAnchor('lat', 'lon', coords[1], coords[0])  # pylint: disable=unsubscriptable-object
             self.sphinx.SetSortMode(sphinxapi.SPH_SORT_EXTENDED, '@weight DESC, @geodist ASC')
             logger.debug("SetGeoAnchor lat = %s, lon = %s", coords[1], coords[0])  # pylint: disable=unsubscriptable-object
@@ -402,6 +807,9 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
             self.sphinx.SetSortMode(sphinxapi.SPH_SORT_EXTENDED, '@weight DESC')
             logger.debug("SetSortMode to sort extended with weight DESC")
 
+        if self.transcode:
+            self.sphinx.SetTranscoder(self._attrs_transform('feature'))
+
         timeFilter = self._get_time_filter()
         if self.searchText:
             searchdText = self._query_fields('@detail')
@@ -457,136 +865,29 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
             )
             raise BadRequest(msg)
 
-    def _get_geoanchor_from_bbox(self):
+    def _get_geoanchor_from_bbox(self, bbox):
         transformer = get_transformer(self.DEFAULT_SRID, 4326)
-        center = center_from_box2d(self.bbox)
+        center = center_from_box2d(bbox)
         return transformer.transform(center[0], center[1])
 
-    def _query_fields(self, fields, fuzzySearch=False):  # pylint: disable=too-many-locals
-        # 10a, 10b needs to be interpreted as digit
-        q = []
-        isdigit = lambda x: bool(re.match('^[0-9]', x))
-        hasDigit = bool(len([x for x in self.searchText if isdigit(x)]) > 0)
-        hasNonDigit = bool(len([x for x in self.searchText if not isdigit(x)]) > 0)
-
-        prefix_non_digit = lambda x: x if isdigit(x) else ''.join((x, '*'))
-        infix_non_digit = lambda x: x if isdigit(x) else ''.join(('*', x, '*'))
-
-        def convert_if_digit(text):
-            """
-            replaces a keyword that begins with a digit the following sphinx query:
-            (digit|digit+rest)
-            examples:
-                4a          -> (4|4a)
-                342         -> (342)
-                sometext    -> sometext
-            Args:
-                text
-
-            Returns:
-                sphinx query for digit and digit+rest if the keywords starts with a digit
-                otherwise the input text will be returned unchanged
-            """
-            if isdigit(text):
-                digit = re.findall(r'^\d+', text)[0]
-                if digit != text:
-                    return f'({str(digit)}|{text})'
-            return text
-
-        def generate_prefixes(input_list, min_length=5):
-
-            def _max_text_length(input_list):
-                """
-                Calculates the maximum length of text elements in a given list.
-
-                Args:
-                    input_list: A list of strings.
-
-                Returns:
-                    The maximum length of text elements, or None if no text elements are found.
-                """
-                list_length = [len(a) for a in input_list if not isdigit(a)]
-                return max(list_length) if list_length else None
-
-            result = []
-
-            if not _max_text_length(input_list):
-                return " ".join([convert_if_digit(x) for x in input_list])
-
-            # the while loop here loops through the list of all the keywords
-            # on every iteration the text keywords are trimmed by one characater
-            # the digit keywords are ignored
-            # this will be done until the max length of all keywords has reached min_length
-            while _max_text_length(input_list) > min_length:
-                for i, text in enumerate(input_list):
-                    if not isdigit(text) and len(text) >= min_length:
-                        input_list[i] = text[:-1]
-
-                logger.debug('DEBUG %s %s', input_list, _max_text_length(input_list))
-                result.append(f"({' '.join([convert_if_digit(w) for w in input_list])})")
-
-            return f"({' | '.join(result)})"
-
-        if hasNonDigit:
-            exactAll = ' '.join(self.searchText)
-            preNonDigit = ' '.join([prefix_non_digit(w) for w in self.searchText])
-            infNonDigit = ' '.join([infix_non_digit(w) for w in self.searchText])
-            q = [
-                f'{fields} "{exactAll}"',
-                f'{fields} "^{exactAll}"',
-                f'{fields} "{exactAll}$"',
-                f'{fields} "^{exactAll}$"',
-                f'{fields} "{exactAll}"~5',
-                f'{fields} "{preNonDigit}"',
-                f'{fields} "^{preNonDigit}"',
-                f'{fields} "{preNonDigit}"~5',
-                f'{fields} "{infNonDigit}"',
-                f'{fields} "^{infNonDigit}"',
-                f'{fields} "{infNonDigit}"~5'
-            ]
-
-        if hasDigit:
-            prefix_digit = lambda x: x if not isdigit(x) else ''.join((x, '*'))
-            prefix_all = lambda x: ''.join((x, '*'))
-            exactAll = ' '.join(self.searchText)
-            preDigit = ' '.join([prefix_digit(w) for w in self.searchText])
-            preNonDigitAndPreDigit = ' '.join([prefix_all(w) for w in self.searchText])
-            infNonDigitAndPreDigit = ' '.join([
-                prefix_digit(infix_non_digit(w)) for w in self.searchText
-            ])
-            q = [
-                # Exact matches first (highest priority for ranking)
-                f'{fields} "{exactAll}"',
-                f'{fields} "^{exactAll}"',
-                f'{fields} "{exactAll}$"',
-                f'{fields} "^{exactAll}$"',
-            ] + q + [
-                # Then prefix matches
-                f'{fields} "{preDigit}"',
-                f'{fields} "^{preDigit}"',
-                f'{fields} "{preNonDigitAndPreDigit}"',
-                f'{fields} "{preNonDigitAndPreDigit}"~5',
-                f'{fields} "{infNonDigitAndPreDigit}"'
-            ]
-
-        # to improve the fuzzyness of the search result the search text has to be changed
-        # digit/text combinations are replaced with (digit|digit/text) p.e. 4a -> (4|4a)
-        # quorum operatar is used for query text fuzzy matching
-        if fuzzySearch:
-            # minimal length of single words that will be trimmed if only one word is in the query
-            # string
-            minLength = 5
-
-            # add quorum matching operator with 70% 0.7 for fuzziness, might need some tweaking
-            # together with search.py#L171
-            quorum = f'"{" ".join(convert_if_digit(w) for w in self.searchText)}"/0.7'
-            q = [f'{fields} {quorum}']
-            # if searchText consists of only one word the keyword will be trimmed step by step
-            if len(self.searchText) == 1 and len(self.searchText[0]) > minLength:
-                q = q + [f'{fields} {generate_prefixes(self.searchText, minLength)}']
-
-        finalQuery = ' | '.join(q)
-        return finalQuery
+    def _plan_query(self, index):
+        if not SEARCH_QUERY_PLANNER:
+            return None
+        return plan_query(tuple(self.searchText), index, get_keyword_stats())
+
+    def _query_fields(self, fields, fuzzySearch=False, index=None, plan=None):
+        # exact, prefix, infix and digit aware phrases OR'ed on the fields, see
+        # query_compiler.compile_query()
+        if plan is None and index is not None and not fuzzySearch:
+            plan = self._plan_query(index)
+        return query_fields(fields, tuple(self.searchText), fuzzySearch, plan)
+
+    @staticmethod
+    def _update_keyword_stats(index, results):
+        if SEARCH_QUERY_PLANNER or SEARCH_FUZZY_SPECULATIVE:
+            stats = get_keyword_stats()
+            for result in results:
+                stats.update(index, result.get('words', []))
 
     @staticmethod
     def _origin_to_layerbodid(origin):
@@ -628,15 +929,13 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
 
     def _detect_keywords(self):
         if ilen(self.searchText) > 0:
-            PARCEL_KEYWORDS = ('parzelle', 'parcelle', 'parcella', 'parcel')
-            ADDRESS_KEYWORDS = ('addresse', 'adresse', 'indirizzo', 'address')
             firstWord = self.searchText[0].lower()
-            if firstWord in PARCEL_KEYWORDS:
+            if firstWord in self.PARCEL_KEYWORDS:
                 # As one cannot apply filters on string attributes, we use the rank information
                 self.sphinx.SetFilter('rank', self._origins_to_ranks(['parcel']))
                 del self.searchText[0]
                 logger.debug("SetFilter rank to parcel")
-            elif firstWord in ADDRESS_KEYWORDS:
+            elif firstWord in self.ADDRESS_KEYWORDS:
                 self.sphinx.SetFilter('rank', self._origins_to_ranks(['address']))
                 del self.searchText[0]
                 logger.debug("SetFilter rank to address")
@@ -793,6 +1092,9 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
                 if result['error'] != '':
                     raise NotFound(result['error'])
             if result is not None and 'matches' in result:
+                if self.transcode:
+                    self._parse_encoded_feature_matches(result['matches'])
+                    continue
                 for match in self._yield_matches(result['matches']):
                     # Backward compatible
                     if 'feature_id' in match['attrs']:
@@ -803,27 +1105,54 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
                     if 'agnostic' in match['attrs']:
                         del match['attrs']['agnostic']
 
-                    # Boost exact matches in detail field
-                    # Similar to swiss search exact match boosting
-                    if self.searchText:
-                        detail = match['attrs'].get('detail', '').lower()
-                        search_text_joined = ' '.join(self.searchText).lower()
-                        # Check if detail contains exact match as a word boundary
-                        # (at start, end, or surrounded by spaces)
-                        if (
-                            detail == search_text_joined or
-                            detail.startswith(f"{search_text_joined} ") or
-                            detail.endswith(f" {search_text_joined}") or
-                            f" {search_text_joined} " in detail
-                        ):
-                            # Boost weight significantly for exact word matches
-                            match['weight'] += 10000
+                    if self._is_exact_detail_match(match['attrs'].get('detail', '')):
+                        # Boost weight significantly for exact word matches
+                        match['weight'] += 10000
 
                     if not self.bbox or self._bbox_intersection(
                         self.bbox, match['attrs']['geom_st_box2d']
                     ):
                         self.results['results'].append(match)
 
+    def _parse_encoded_feature_matches(self, matches):
+        # attrs already transformed by the JSON transcoder, see ATTRS_TRANSFORMS
+        for match in matches:
+            detail, box2d = match.values
+            if self._is_exact_detail_match(detail or ''):
+                match.weight += 10000
+            if not self.bbox or self._bbox_intersection(self.bbox, box2d):
+                self.results['results'].append(match)
+
+    def _is_exact_detail_match(self, detail):
+        # Boost exact matches in detail field
+        # Similar to swiss search exact match boosting
+        if not self.searchText:
+            return False
+        detail = detail.lower()
+        search_text_joined = ' '.join(self.searchText).lower()
+        # Check if detail contains exact match as a word boundary
+        # (at start, end, or surrounded by spaces)
+        return (
+            detail == search_text_joined or detail.startswith(f"{search_text_joined} ") or
+            detail.endswith(f" {search_text_joined}") or f" {search_text_joined} " in detail
+        )
+
+    def _attrs_transform(self, origin):
+        '''Build the sphinxapi.AttrsTransform of the origin for the JSON transcoder'''
+        spec = self.ATTRS_TRANSFORMS[origin]
+        rename = []
+        drop = list(spec.get('drop', []))
+        if spec.get('choose_srid'):
+            # same as _choose_srid()
+            geom_entries = ['geom_st_box2d', 'x', 'y']
+            if self.srid == 2056:
+                rename = [(f'{geom_entry}_lv95', geom_entry) for geom_entry in geom_entries]
+            else:
+                drop += [f'{geom_entry}_lv95' for geom_entry in geom_entries]
+        return sphinxapi.AttrsTransform(
+            rename=rename, copy=spec.get('copy', []), drop=drop, keep=spec.get('keep', [])
+        )
+
     @staticmethod
     def _yield_results(results):
         for idx, result in enumerate(results):
@@ -861,6 +1190,9 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
         return label
 
     def _get_quad_index(self):
+        '''Set the morton key of the quad containing the bbox, and the keys of the quads covering
+        it with at most SEARCH_LOCATIONS_BBOX_COVER quads, see QuadTree.bbox_to_morton_cover()
+        '''
         try:
             quadindex = self.quadtree\
                 .bbox_to_morton(
@@ -869,8 +1201,14 @@ class Search(SearchValidation):  # pylint: disable=too-many-instance-attributes
                              self.bbox[2],
                              self.bbox[3]))
             self.quadindex = quadindex if quadindex != '' else None
+            cover = self.quadtree.bbox_to_morton_cover(
+                msk.BBox(self.bbox[0], self.bbox[1], self.bbox[2], self.bbox[3]),
+                SEARCH_LOCATIONS_BBOX_COVER
+            )
+            self.quadindexes = tuple(cover) if cover else None
         except ValueError:  # pragma: no cover
             self.quadindex = None
+            self.quadindexes = None
 
     def _bbox_intersection(self, ref, result):
 
@@ -82,6 +82,60 @@ SUPPORTED_LANGUAGES = ['en', 'de', 'fr', 'it', 'rm']
 SEARCH_SPHINX_HOST = os.getenv('SEARCH_SPHINX_HOST', 'localhost')
 SEARCH_SPHINX_PORT = int(os.getenv('SEARCH_SPHINX_PORT', '9312'))
 SEARCH_SPHINX_TIMEOUT = int(os.getenv('SEARCH_SPHINX_TIMEOUT', '3'))
+# Max. number of idle persistent searchd connections kept per worker, 0 disables the pool
+SEARCH_SPHINX_POOL_SIZE = int(os.getenv('SEARCH_SPHINX_POOL_SIZE', '10'))
+# Idle connections are closed after this amount of seconds, must be below searchd client_timeout
+SEARCH_SPHINX_POOL_IDLE_TIMEOUT = int(os.getenv('SEARCH_SPHINX_POOL_IDLE_TIMEOUT', '60'))
+# Micro-batch the searchd queries of the concurrent requests of a worker during this amount of
+# milliseconds (e.g. 1 or 2), 0 disables the batching
+SEARCH_SPHINX_BATCH_WINDOW = float(os.getenv('SEARCH_SPHINX_BATCH_WINDOW', '0'))
+# Max. number of queries of a batch, must not exceed the searchd max_batch_queries
+SEARCH_SPHINX_BATCH_MAX_QUERIES = int(os.getenv('SEARCH_SPHINX_BATCH_MAX_QUERIES', '32'))
+# Cache the searchd responses of the queries during this amount of seconds, 0 disables the cache
+SEARCH_SPHINX_CACHE_TTL = int(os.getenv('SEARCH_SPHINX_CACHE_TTL', '0'))
+# Max. number of searchd responses cached per worker (LRU)
+SEARCH_SPHINX_CACHE_SIZE = int(os.getenv('SEARCH_SPHINX_CACHE_SIZE', '4096'))
+
+# Transcode the layers and features search results directly from the searchd response to JSON
+SEARCH_JSON_TRANSCODER = strtobool(os.getenv('SEARCH_JSON_TRANSCODER', 'False'))
+
+# Max. number of compiled sphinx query texts memoized per worker
+SEARCH_QUERY_CACHE_SIZE = int(os.getenv('SEARCH_QUERY_CACHE_SIZE', '4096'))
+# Prune the infix and proximity branches of the swiss and layers search queries that are not
+# worth sending, based on the keyword statistics returned by searchd
+SEARCH_QUERY_PLANNER = strtobool(os.getenv('SEARCH_QUERY_PLANNER', 'False'))
+# Tokens shorter than this are never infix (*token*) expanded by the query planner
+SEARCH_QUERY_INFIX_MIN_LENGTH = int(os.getenv('SEARCH_QUERY_INFIX_MIN_LENGTH', '3'))
+# Tokens whose prefix (token*) matches more documents are not infix expanded
+SEARCH_QUERY_PRUNE_DOCS = int(os.getenv('SEARCH_QUERY_PRUNE_DOCS', '10000'))
+# Send the fuzzy swiss search in the same batch as the standard one when the search text is
+# likely misspelled (see query_planner.likely_misspelled())
+SEARCH_FUZZY_SPECULATIVE = strtobool(os.getenv('SEARCH_FUZZY_SPECULATIVE', 'False'))
+# Max. number of keyword statistics kept per worker by the query planner
+SEARCH_QUERY_STATS_SIZE = int(os.getenv('SEARCH_QUERY_STATS_SIZE', '65536'))
+# Cache the final SearchServer responses of a worker up to this total size in bytes, 0 disables
+# the cache
+SEARCH_RESPONSE_CACHE_BYTES = int(os.getenv('SEARCH_RESPONSE_CACHE_BYTES', '0'))
+# Cached SearchServer responses expire after this amount of seconds
+SEARCH_RESPONSE_CACHE_TTL = int(os.getenv('SEARCH_RESPONSE_CACHE_TTL', '600'))
+# Number of most requested keys counted per worker, the responses of the heavy hitters are
+# pinned in the response cache and refreshed before their expiry, 0 disables the counting
+SEARCH_RESPONSE_CACHE_HOT_KEYS = int(os.getenv('SEARCH_RESPONSE_CACHE_HOT_KEYS', '64'))
+# Expired SearchServer responses are kept during this amount of seconds more, to be served
+# while they are refreshed or when searchd fails, 0 disables the stale responses
+SEARCH_RESPONSE_CACHE_STALE = int(os.getenv('SEARCH_RESPONSE_CACHE_STALE', '0'))
+# Identical concurrent searches of a worker wait for the first one and share its results
+SEARCH_SINGLE_FLIGHT = strtobool(os.getenv('SEARCH_SINGLE_FLIGHT', 'False'))
+# Cache the raw swiss search results (before the lang, sr and geometryFormat dependent parsing)
+# in the app cache during this amount of seconds, 0 disables the cache
+SEARCH_LOCATIONS_CACHE_TTL = int(os.getenv('SEARCH_LOCATIONS_CACHE_TTL', '0'))
+# Snap the cached bbox locations searches sorted by distance to the morton cell of the bbox
+SEARCH_LOCATIONS_BBOX_SNAP = strtobool(os.getenv('SEARCH_LOCATIONS_BBOX_SNAP', 'False'))
+# Max. number of morton cells covering the bbox of the locations searches, 1 queries the single
+# morton cell containing the bbox
+SEARCH_LOCATIONS_BBOX_COVER = int(os.getenv('SEARCH_LOCATIONS_BBOX_COVER', '1'))
+# Refine the complete cached locations results of a prefix of the search text locally
+SEARCH_LOCATIONS_TYPEAHEAD = strtobool(os.getenv('SEARCH_LOCATIONS_TYPEAHEAD', 'False'))
 
 SCRIPT_NAME = os.getenv('SCRIPT_NAME', '')  # This is used by unicorn for route prefix
 
@@ -89,7 +143,14 @@ SCRIPT_NAME = os.getenv('SCRIPT_NAME', '')  # This is used by unicorn for route
 GEODATA_STAGING = os.getenv('GEODATA_STAGING', 'prod')
 
 # Flask-Caching
-CACHE_TYPE = 'SimpleCache'
+CACHE_TYPE = os.getenv('CACHE_TYPE', 'SimpleCache')
+# In process cache of the worker (CACHE_TYPE=app.helpers.memory_cache.MemoryCache)
+CACHE_MEMORY_MAX_ENTRIES = int(os.getenv('CACHE_MEMORY_MAX_ENTRIES', '10000'))
+CACHE_MEMORY_MAX_BYTES = int(os.getenv('CACHE_MEMORY_MAX_BYTES', str(64 * 1024 * 1024)))
+# Cache shared by the workers of the host (CACHE_TYPE=app.helpers.shared_cache.SharedMemoryCache)
+CACHE_SHARED_PATH = os.getenv('CACHE_SHARED_PATH', '/dev/shm/service-search-wsgi.cache')
+CACHE_SHARED_SIZE = int(os.getenv('CACHE_SHARED_SIZE', str(16 * 1024 * 1024)))
+CACHE_SHARED_SLOT_SIZE = int(os.getenv('CACHE_SHARED_SLOT_SIZE', '1024'))
 CACHE_DEFAULT_TIMEOUT = int(os.getenv('CACHE_DEFAULT_TIMEOUT', '86400'))  # 24 h
 
 # SQL Alchemy
@@ -106,6 +167,13 @@ ALLOWED_DOMAINS_PATTERN = f"({format('|'.join(ALLOWED_DOMAINS))})"
 FORWARED_ALLOW_IPS = os.getenv('FORWARED_ALLOW_IPS', '*')
 FORWARDED_PROTO_HEADER_NAME = os.getenv('FORWARDED_PROTO_HEADER_NAME', 'X-Forwarded-Proto')
 
+# Version file of the sphinx indexes, mounted from the service-search-sphinx container
+SERVICE_SPHINX_FILE = os.getenv('SERVICE_SPHINX_FILE', '/usr/local/share/app/version.txt')
+# Check the version file for index changes at most every this amount of seconds
+SERVICE_SPHINX_VERSION_CHECK_INTERVAL = int(
+    os.getenv('SERVICE_SPHINX_VERSION_CHECK_INTERVAL', '10')
+)
+
 # Cache-Control
 CACHE_CONTROL_HEADER = os.getenv('CACHE_CONTROL_HEADER', 'public, max-age=600')
 
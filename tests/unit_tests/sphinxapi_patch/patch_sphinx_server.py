@@ -1,13 +1,19 @@
 # pylint: disable=line-too-long
+from struct import pack
+
+from app.lib import sphinxapi
 
 
 class MockSocket:
     # pylint: disable=unused-argument
 
-    def __init__(self, status, data):
+    def __init__(self, status, data, chunk_size=0):
         self.status = status
         self.data = data
         self.n_call = 0
+        # max. number of bytes returned by one recv_into() call, 0 means unlimited
+        self.chunk_size = chunk_size
+        self.offset = 0
 
     def recv(self, *args, **kwargs):
         self.n_call = self.n_call + 1
@@ -15,8 +21,21 @@ class MockSocket:
             return self.status
         return self.data
 
-    @staticmethod
-    def send(*args, **kwargs):
+    def recv_into(self, buffer, nbytes=0, flags=0):
+        # the response is the header (status) followed by the data
+        nbytes = min(nbytes or len(buffer), len(buffer), self.chunk_size or len(buffer))
+        if self.offset < len(self.status):
+            data = self.status[self.offset:self.offset + nbytes]
+        else:
+            start = self.offset - len(self.status)
+            data = self.data[start:start + nbytes]
+        buffer[:len(data)] = data
+        self.offset += len(data)
+        return len(data)
+
+    def send(self, *args, **kwargs):
+        # a new request, the response is sent again
+        self.offset = 0
         return -1
 
     def close(self):
@@ -63,3 +82,43 @@ MOCK_QUERY_OVERRIDES_SOCK = MockSocket(
     b'\x00\x00\x01\x1f\x00\x00\x01k',
     b'\x00\x00\x00\x00\x00\x00\x00\x02\x00\x00\x00\x06detail\x00\x00\x00\x0egeom_quadindex\x00\x00\x00\x13\x00\x00\x00\nfeature_id\x00\x00\x00\x07\x00\x00\x00\x06detail\x00\x00\x00\x07\x00\x00\x00\x06origin\x00\x00\x00\x07\x00\x00\x00\x0egeom_quadindex\x00\x00\x00\x07\x00\x00\x00\rgeom_st_box2d\x00\x00\x00\x07\x00\x00\x00\x12geom_st_box2d_lv95\x00\x00\x00\x07\x00\x00\x00\x04rank\x00\x00\x00\x01\x00\x00\x00\x01x\x00\x00\x00\x05\x00\x00\x00\x01y\x00\x00\x00\x05\x00\x00\x00\x06y_lv95\x00\x00\x00\x05\x00\x00\x00\x06x_lv95\x00\x00\x00\x05\x00\x00\x00\x03lat\x00\x00\x00\x05\x00\x00\x00\x03lon\x00\x00\x00\x05\x00\x00\x00\x03num\x00\x00\x00\x01\x00\x00\x00\tzoomlevel\x00\x00\x00\x01\x00\x00\x00\x05label\x00\x00\x00\x07\x00\x00\x00\x08@groupby\x00\x00\x00\x06\x00\x00\x00\x06@count\x00\x00\x00\x01\x00\x00\x00\t@distinct\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x04bern\x00\x00\xf7\xaf\x00\x01[E'
 )
+
+
+def build_search_response(results):
+    '''Build a searchd search response (without header) for the given result sets
+
+    Each result set is a tuple (fields, attrs, matches) where attrs is a list of (name, type)
+    and matches a list of (id, weight, values).
+    '''
+    data = []
+    for fields, attrs, matches in results:
+        data.append(pack('>2L', sphinxapi.SEARCHD_OK, len(fields)))
+        for field in fields:
+            data.append(pack('>L', len(field)) + field.encode())
+        data.append(pack('>L', len(attrs)))
+        for name, type_ in attrs:
+            data.append(pack('>L', len(name)) + name.encode() + pack('>L', type_))
+        data.append(pack('>2L', len(matches), 1))
+        for doc, weight, values in matches:
+            data.append(pack('>QL', doc, weight))
+            for (_, type_), value in zip(attrs, values):
+                if type_ == sphinxapi.SPH_ATTR_FLOAT:
+                    data.append(pack('>f', value))
+                elif type_ == sphinxapi.SPH_ATTR_BIGINT:
+                    data.append(pack('>q', value))
+                elif type_ == sphinxapi.SPH_ATTR_STRING:
+                    data.append(pack('>L', len(value.encode())) + value.encode())
+                elif type_ == sphinxapi.SPH_ATTR_MULTI:
+                    data.append(pack(f'>L{len(value)}L', len(value), *value))
+                elif type_ == sphinxapi.SPH_ATTR_MULTI64:
+                    data.append(pack(f'>L{len(value)}q', len(value) * 2, *value))
+                else:
+                    data.append(pack('>L', value))
+        data.append(pack('>4L', len(matches), len(matches), 1, 1))
+        data.append(pack('>L', 4) + b'bern' + pack('>2L', 10, 12))
+    return b''.join(data)
+
+
+def mock_search_socket(results, chunk_size=0):
+    data = build_search_response(results)
+    return MockSocket(b'\x00\x00\x01\x1f' + len(data).to_bytes(4, 'big'), data, chunk_size)
@@ -0,0 +1,46 @@
+import unittest
+
+from app.helpers.heavy_hitters import SpaceSaving
+
+
+class TestSpaceSaving(unittest.TestCase):
+
+    def setUp(self):
+        self.sketch = SpaceSaving(4)
+
+    def test_heavy_hitters(self):
+        for i in range(100):
+            self.sketch.add('bern')
+            self.sketch.add(f'tail{i}')
+            if i % 4:
+                self.sketch.add('zuerich')
+        self.assertEqual(len(self.sketch), 4)
+        self.assertEqual(self.sketch.total, 275)
+        self.assertTrue(self.sketch.is_heavy('bern'))
+        self.assertTrue(self.sketch.is_heavy('zuerich'))
+        self.assertFalse(self.sketch.is_heavy('tail99'))
+        self.assertFalse(self.sketch.is_heavy('tail0'))
+        top = self.sketch.top(2)
+        self.assertEqual([item['key'] for item in top], ['bern', 'zuerich'])
+        self.assertEqual(top[0], {'key': 'bern', 'count': 100, 'error': 0, 'heavy': True})
+
+    def test_overestimation(self):
+        for key in ['a', 'b', 'c', 'd', 'e']:
+            self.sketch.add(key)
+        # e replaced one of the least counted keys and inherited its count
+        self.assertEqual(
+            self.sketch.top(5)[0], {
+                'key': 'e', 'count': 2, 'error': 1, 'heavy': False
+            }
+        )
+        self.assertEqual(len(self.sketch), 4)
+
+    def test_decay(self):
+        sketch = SpaceSaving(4, window=100)
+        for _ in range(60):
+            sketch.add('bern')
+        for i in range(40):
+            sketch.add(f'tail{i}')
+        self.assertEqual(sketch.total, 50)
+        self.assertEqual(sketch.top(1)[0]['count'], 30)
+        self.assertTrue(sketch.is_heavy('bern'))
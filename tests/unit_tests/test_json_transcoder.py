@@ -0,0 +1,165 @@
+from unittest.mock import patch
+
+from nose2.tools import params
+
+from flask import url_for
+
+from app.lib import sphinxapi
+from tests.unit_tests.base_test import BaseSearchTest
+from tests.unit_tests.sphinxapi_patch import patch_sphinx_server
+
+FEATURE_ATTRS = [
+    ('feature_id', sphinxapi.SPH_ATTR_STRING),
+    ('detail', sphinxapi.SPH_ATTR_STRING),
+    ('label', sphinxapi.SPH_ATTR_STRING),
+    ('layer', sphinxapi.SPH_ATTR_STRING),
+    ('origin', sphinxapi.SPH_ATTR_STRING),
+    ('geom_quadindex', sphinxapi.SPH_ATTR_STRING),
+    ('geom_st_box2d', sphinxapi.SPH_ATTR_STRING),
+    ('geom_st_box2d_lv95', sphinxapi.SPH_ATTR_STRING),
+    ('lang', sphinxapi.SPH_ATTR_INTEGER),
+    ('agnostic', sphinxapi.SPH_ATTR_INTEGER),
+    ('x', sphinxapi.SPH_ATTR_FLOAT),
+    ('y', sphinxapi.SPH_ATTR_FLOAT),
+    ('x_lv95', sphinxapi.SPH_ATTR_FLOAT),
+    ('y_lv95', sphinxapi.SPH_ATTR_FLOAT),
+    ('lat', sphinxapi.SPH_ATTR_FLOAT),
+    ('lon', sphinxapi.SPH_ATTR_FLOAT),
+    ('year', sphinxapi.SPH_ATTR_MULTI),
+]
+FEATURE_MATCHES = [
+    (
+        1,
+        2561,
+        [
+            '111001_0',
+            'raeterschenstrasse 10 8418 schlatt zh 111001',
+            '<b>Räterschenstrasse 10</b> "Schlatt"',
+            'ch.bfs.gebaeude_wohnungs_register',
+            'feature',
+            '030012',
+            'BOX(600000 200000,600000 200000)',
+            'BOX(2600000 1200000,2600000 1200000)',
+            1,
+            0,
+            200000.0,
+            600000.0,
+            1200000.0,
+            2600000.0,
+            46.951,
+            7.438,
+            [2010, 2020],
+        ]
+    ),
+    (
+        2,
+        2600,
+        [
+            '11100130_0',
+            'via valle verzasca 7 6632 vogorno',
+            'Via Valle Verzasca 7',
+            'ch.bfs.gebaeude_wohnungs_register',
+            'feature',
+            '030013',
+            'BOX(700000 100000,700000 100000)',
+            'BOX(2700000 1100000,2700000 1100000)',
+            0,
+            1,
+            100000.0,
+            700000.0,
+            1100000.0,
+            2700000.0,
+            46.1,
+            8.8,
+            [],
+        ]
+    ),
+]
+LAYER_ATTRS = [
+    ('label', sphinxapi.SPH_ATTR_STRING),
+    ('origin', sphinxapi.SPH_ATTR_STRING),
+    ('detail', sphinxapi.SPH_ATTR_STRING),
+    ('layer', sphinxapi.SPH_ATTR_STRING),
+    ('lang', sphinxapi.SPH_ATTR_STRING),
+]
+LAYER_MATCHES = [
+    (1275, 91, ['<b>Wanderland</b>', 'layer', 'wanderland schweiz', 'ch.astra.wanderland', 'de']),
+    (851, 60, ['<b>Sperrungen</b>', 'layer', 'sperrungen / umleitungen', 'ch.astra.sp', 'de']),
+]
+
+
+@patch('app.lib.sphinxapi.SphinxClient._Connect')
+class TestJsonTranscoder(BaseSearchTest):
+
+    def get_both(self, **kwargs):
+        # the responses without and with the JSON transcoder
+        return self.get_response(False, **kwargs), self.get_response(True, **kwargs)
+
+    def get_response(self, transcode, **kwargs):
+        with patch('app.search.SEARCH_JSON_TRANSCODER', transcode):
+            response = self.app.get(
+                url_for('search_server', **kwargs), headers=self.origin_headers["allowed"]
+            )
+        self.assertEqual(response.status_code, 200)
+        return response.content_type, response.get_data(as_text=True)
+
+    @params(
+        {'sr': '21781'},
+        {'sr': '2056'},
+        {
+            'sr': '21781', 'bbox': '550000,150000,650000,250000'
+        },
+    )
+    def test_featuresearch_transcoded(self, args, mock_socket):
+        mock_socket.return_value = patch_sphinx_server.mock_search_socket([
+            (['detail'], FEATURE_ATTRS, FEATURE_MATCHES),
+        ])
+        decoded, transcoded = self.get_both(
+            topic='ech',
+            type='featuresearch',
+            searchText='111001',
+            features='ch.bfs.gebaeude_wohnungs_register',
+            **args
+        )
+        self.assertEqual(transcoded, decoded)
+        self.assertIn('"featureId":"111001_0"', transcoded[1])
+
+    def test_featuresearch_transcoded_attrs(self, mock_socket):
+        mock_socket.return_value = patch_sphinx_server.mock_search_socket([
+            (['detail'], FEATURE_ATTRS, FEATURE_MATCHES),
+        ])
+        with patch('app.search.SEARCH_JSON_TRANSCODER', True):
+            response = self.app.get(
+                url_for(
+                    'search_server',
+                    topic='ech',
+                    type='featuresearch',
+                    searchText='111001',
+                    features='ch.bfs.gebaeude_wohnungs_register',
+                    sr='2056'
+                ),
+                headers=self.origin_headers["allowed"]
+            )
+        self.assertEqual(response.status_code, 200)
+        attrs = response.json['results'][0]['attrs']
+        self.assertEqual(attrs['featureId'], '111001_0')
+        self.assertEqual(attrs['feature_id'], '111001_0')
+        self.assertEqual(attrs['x'], 1200000.0)
+        self.assertEqual(attrs['geom_st_box2d'], 'BOX(2600000 1200000,2600000 1200000)')
+        self.assertAttrs('featuresearch', attrs, 2056)
+        self.assertNotIn('lang', attrs)
+        self.assertNotIn('agnostic', attrs)
+        # exact match boost
+        self.assertEqual(response.json['results'][0]['weight'], 12561)
+        self.assertEqual(response.json['results'][1]['weight'], 2600)
+
+    def test_layers_transcoded(self, mock_socket):
+        mock_socket.return_value = patch_sphinx_server.mock_search_socket([
+            (['title', 'detail'], LAYER_ATTRS, LAYER_MATCHES),
+        ])
+        decoded, transcoded = self.get_both(topic='inspire', type='layers', searchText='wand')
+        self.assertEqual(transcoded, decoded)
+        decoded, transcoded = self.get_both(
+            topic='inspire', type='layers', searchText='wand', callback='cb'
+        )
+        self.assertEqual(transcoded, decoded)
@@ -0,0 +1,121 @@
+from unittest.mock import patch
+
+from nose2.tools import params
+
+from flask import url_for
+
+from app.lib import sphinxapi
+from tests.unit_tests.base_test import BaseSearchTest
+from tests.unit_tests.sphinxapi_patch import patch_sphinx_server
+
+LOCATION_ATTRS = [
+    ('origin', sphinxapi.SPH_ATTR_STRING),
+    ('feature_id', sphinxapi.SPH_ATTR_STRING),
+    ('detail', sphinxapi.SPH_ATTR_STRING),
+    ('label', sphinxapi.SPH_ATTR_STRING),
+    ('geom_quadindex', sphinxapi.SPH_ATTR_STRING),
+    ('geom_st_box2d', sphinxapi.SPH_ATTR_STRING),
+    ('geom_st_box2d_lv95', sphinxapi.SPH_ATTR_STRING),
+    ('egaid', sphinxapi.SPH_ATTR_STRING),
+    ('egid_edid', sphinxapi.SPH_ATTR_STRING),
+    ('rank', sphinxapi.SPH_ATTR_INTEGER),
+    ('num', sphinxapi.SPH_ATTR_INTEGER),
+    ('zoomlevel', sphinxapi.SPH_ATTR_INTEGER),
+    ('x', sphinxapi.SPH_ATTR_FLOAT),
+    ('y', sphinxapi.SPH_ATTR_FLOAT),
+    ('x_lv95', sphinxapi.SPH_ATTR_FLOAT),
+    ('y_lv95', sphinxapi.SPH_ATTR_FLOAT),
+    ('lat', sphinxapi.SPH_ATTR_FLOAT),
+    ('lon', sphinxapi.SPH_ATTR_FLOAT),
+]
+ADDRESS_MATCH = (
+    1,
+    100,
+    [
+        'address',
+        '1234_0',
+        'waldhofstrasse 1 3000 bern',
+        'Waldhofstrasse 1 <b>3000 Bern</b>',
+        '030012',
+        'BOX(600000 200000,600000 200000)',
+        'BOX(2600000 1200000,2600000 1200000)',
+        '1234',
+        '1234_0',
+        7,
+        1,
+        10,
+        200000.0,
+        600000.0,
+        1200000.0,
+        2600000.0,
+        46.951,
+        7.438,
+    ]
+)
+GAZETTEER_MATCH = (
+    2,
+    50,
+    [
+        'gazetteer',
+        '',
+        'waldhof bern',
+        '<i>Ort</i> <b>Waldhof</b> (BE)',
+        '030013',
+        'BOX(599000 199000,601000 201000)',
+        'BOX(2599000 1199000,2601000 1201000)',
+        '',
+        '',
+        5,
+        2,
+        8,
+        200000.0,
+        600000.0,
+        1200000.0,
+        2600000.0,
+        46.951,
+        7.438,
+    ]
+)
+
+
+@patch('app.lib.sphinxapi.SphinxClient._Connect')
+class TestLazyMatches(BaseSearchTest):
+
+    def get_response(self, lazy, **kwargs):
+        with patch('app.lib.sphinxapi.GetMatchLayout', wraps=sphinxapi.GetMatchLayout) as layout:
+            if lazy:
+                response = self.app.get(
+                    url_for('search_server', **kwargs), headers=self.origin_headers["allowed"]
+                )
+            else:
+                with patch.object(sphinxapi.SphinxClient, 'SetLazyMatches'):
+                    response = self.app.get(
+                        url_for('search_server', **kwargs), headers=self.origin_headers["allowed"]
+                    )
+        self.assertEqual(layout.called, lazy)
+        self.assertEqual(response.status_code, 200)
+        return response.get_data(as_text=True)
+
+    @params(
+        {'sr': '21781'},
+        {'sr': '2056'},
+        {
+            'sr': '4326', 'returnGeometry': 'false'
+        },
+        {
+            'sr': '21781', 'bbox': '550000,150000,650000,250000'
+        },
+        {
+            'sr': '2056', 'geometryFormat': 'geojson'
+        },
+    )
+    def test_locations_lazy_matches(self, args, mock_socket):
+        mock_socket.return_value = patch_sphinx_server.mock_search_socket([
+            (['detail'], LOCATION_ATTRS, [GAZETTEER_MATCH, ADDRESS_MATCH]),
+            (['detail'], LOCATION_ATTRS, [ADDRESS_MATCH]),
+        ])
+        kwargs = {'topic': 'ech', 'type': 'locations', 'searchText': 'waldhof', **args}
+        decoded = self.get_response(False, **kwargs)
+        lazy = self.get_response(True, **kwargs)
+        self.assertEqual(lazy, decoded)
+        self.assertIn('ch.swisstopo.amtliches-gebaeudeadressverzeichnis', lazy)
@@ -0,0 +1,315 @@
+from unittest.mock import patch
+
+from flask import url_for
+
+from app.helpers.helpers_search import get_transformer
+from app.helpers.memory_cache import MemoryCache
+from app.search import Search
+from tests.unit_tests.base_test import BaseSearchTest
+
+
+def locations_results():
+    match = {
+        'id': 1,
+        'weight': 1,
+        'attrs': {
+            'origin': 'gazetteer',
+            'feature_id': '1',
+            'label': 'Wald',
+            'detail': 'wald',
+            'rank': 5,
+            'num': 1,
+            'geom_st_box2d': 'BOX(600000 200000,600000 200000)',
+            'geom_st_box2d_lv95': 'BOX(2600000 1200000,2600000 1200000)',
+            'x': 200000.0,
+            'y': 600000.0,
+            'x_lv95': 1200000.0,
+            'y_lv95': 2600000.0,
+            'lat': 46.95,
+            'lon': 7.43,
+        }
+    }
+    return [{
+        'status': 0, 'matches': [match], 'words': []
+    }, {
+        'status': 0, 'matches': [], 'words': []
+    }]
+
+
+@patch('app.search.SEARCH_LOCATIONS_CACHE_TTL', 60)
+@patch('app.lib.sphinxapi.SphinxClient.RunQueries', side_effect=locations_results)
+class TestLocationsCache(BaseSearchTest):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = MemoryCache()
+        self.patcher = patch('app.search.cache', self.cache)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def search(self, **kwargs):
+        response = self.app.get(
+            url_for('search_server', topic='ech', type='locations', searchText='wald', **kwargs),
+            headers=self.origin_headers["allowed"]
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json
+
+    def test_shared_by_presentations(self, mock):
+        lv03 = self.search(lang='de')['results'][0]['attrs']
+        self.assertEqual(lv03['label'], 'Wald')
+        self.assertEqual((lv03['x'], lv03['y']), (600000.0, 200000.0))
+        self.assertNotIn('x_lv95', lv03)
+
+        lv95 = self.search(lang='fr', sr='2056')['results'][0]['attrs']
+        self.assertEqual((lv95['x'], lv95['y']), (2600000.0, 1200000.0))
+        self.assertEqual(lv95['geom_st_box2d'], 'BOX(2600000 1200000,2600000 1200000)')
+
+        wgs84 = self.search(lang='it', sr='4326')['results'][0]['attrs']
+        self.assertEqual((wgs84['x'], wgs84['y']), (7.43, 46.95))
+
+        no_geometry = self.search(returnGeometry='false')['results'][0]['attrs']
+        self.assertNotIn('geom_st_box2d', no_geometry)
+
+        geojson = self.search(geometryFormat='geojson')
+        self.assertEqual(geojson['type'], 'FeatureCollection')
+
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(self.cache.stats['locations']['hits'], 4)
+        # the parsing did not modify the cached matches
+        self.assertEqual(lv03, self.search(lang='de')['results'][0]['attrs'])
+
+    def test_query_parameters(self, mock):
+        self.search()
+        self.search(origins='gazetteer')
+        self.search(limit=1)
+        self.search(bbox='599000,199000,601000,201000')
+        self.search(bbox='599000,199000,601000,201000', sortbbox='false')
+        self.assertEqual(mock.call_count, 5)
+        # the bbox is normalized to LV03
+        self.search(bbox='2599000,1199000,2601000,1201000', sortbbox='false', sr='2056')
+        self.assertEqual(mock.call_count, 5)
+
+
+def pan_match(doc, x, y):
+    lon, lat = get_transformer(21781, 4326).transform(x, y)
+    return {
+        'id': doc,
+        'weight': 1,
+        'attrs': {
+            'origin': 'gazetteer',
+            'feature_id': str(doc),
+            'label': 'Wald',
+            'detail': 'wald',
+            'geom_st_box2d': f'BOX({x} {y},{x} {y})',
+            'x': y,
+            'y': x,
+            'lat': lat,
+            'lon': lon,
+        }
+    }
+
+
+def pan_results():
+    return [{
+        'status': 0,
+        'matches': [pan_match(2, 602800, 201000), pan_match(1, 601100, 201000)],
+        'words': []
+    }, {
+        'status': 0, 'matches': [], 'words': []
+    }]
+
+
+@patch('app.search.SEARCH_LOCATIONS_CACHE_TTL', 60)
+@patch('app.search.SEARCH_LOCATIONS_BBOX_SNAP', True)
+@patch('app.lib.sphinxapi.SphinxClient.RunQueries', side_effect=pan_results)
+class TestLocationsBboxSnap(BaseSearchTest):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = MemoryCache()
+        self.patcher = patch('app.search.cache', self.cache)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def search_ids(self, bbox, **kwargs):
+        response = self.app.get(
+            url_for(
+                'search_server',
+                topic='ech',
+                type='locations',
+                searchText='wald',
+                bbox=bbox,
+                **kwargs
+            ),
+            headers=self.origin_headers["allowed"]
+        )
+        self.assertEqual(response.status_code, 200)
+        return [result['id'] for result in response.json['results']]
+
+    def test_pan(self, mock):
+        # sorted by distance to the center of each bbox
+        self.assertEqual(self.search_ids('600500,200000,602900,202000'), [1, 2])
+        self.assertEqual(self.search_ids('601000,200200,603000,202200'), [2, 1])
+        # filtered by each bbox and limited after the sort
+        self.assertEqual(self.search_ids('600500,200000,602000,202000'), [1])
+        self.assertEqual(self.search_ids('601000,200200,603000,202200', limit=1), [2])
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(self.cache.stats['locations']['entries'], 1)
+
+    def test_not_snapped(self, mock):
+        # the morton cell across the bbox is much larger than the bbox
+        self.search_ids('599000,199000,601000,201000')
+        self.search_ids('599100,199000,601000,201000')
+        self.assertEqual(mock.call_count, 2)
+        # without sort by distance only the morton cell of the bbox is queried
+        self.search_ids('600500,200000,602900,202000', sortbbox='false')
+        self.search_ids('601000,200200,603000,202200', sortbbox='false')
+        self.assertEqual(mock.call_count, 3)
+
+    @patch('app.lib.sphinxapi.SphinxClient.AddQuery', autospec=True)
+    @patch('app.lib.sphinxapi.SphinxClient.SetGeoAnchor', autospec=True)
+    def test_truncated(self, mock_anchor, mock_query, mock):
+        # the cell holds more matches than the limit, searchd returns the ones nearest to the
+        # cell center, outside of the bbox
+        truncated = [pan_match(doc, 600100, 200100) for doc in range(Search.BBOX_SEARCH_LIMIT)]
+        cell_results = [{
+            'status': 0, 'matches': truncated, 'words': []
+        }, {
+            'status': 0, 'matches': [], 'words': []
+        }]
+        mock.side_effect = [cell_results, pan_results(), pan_results()]
+        # the bbox results as sorted by searchd
+        self.assertEqual(self.search_ids('600500,200000,602900,202000'), [2, 1])
+        self.assertEqual(mock.call_count, 2)
+        # both queries of the cell are filtered by the cell
+        cell = mock_query.call_args_list[0][0][1].split(' & ')[-1]
+        self.assertIn('@geom_quadindex', cell)
+        self.assertTrue(mock_query.call_args_list[1][0][1].endswith(f' & {cell}'))
+        # the fallback is anchored at the bbox center
+        lon, lat = get_transformer(21781, 4326).transform(601700, 201000)
+        self.assertEqual(mock_anchor.call_count, 2)
+        self.assertNotEqual(mock_anchor.call_args_list[0][0][3:], (lat, lon))
+        self.assertEqual(mock_anchor.call_args_list[1][0][3:], (lat, lon))
+
+        # the cell is marked as truncated, the next pan goes straight to the bbox
+        self.assertEqual(self.search_ids('601000,200200,603000,202200'), [2, 1])
+        self.assertEqual(mock.call_count, 3)
+        lon, lat = get_transformer(21781, 4326).transform(602000, 201200)
+        self.assertEqual(mock_anchor.call_args_list[2][0][3:], (lat, lon))
+        self.assertEqual(self.cache.stats['locations']['entries'], 3)
+
+
+def typeahead_match(doc, detail, rank=5):
+    return {
+        'id': doc,
+        'weight': 1,
+        'attrs': {
+            'origin': 'gazetteer',
+            'feature_id': str(doc),
+            'label': detail,
+            'detail': detail,
+            'rank': rank,
+            'num': doc,
+            'geom_st_box2d': 'BOX(600000 200000,600000 200000)',
+            'x': 200000.0,
+            'y': 600000.0,
+            'lat': 46.95,
+            'lon': 7.43,
+        }
+    }
+
+
+def typeahead_results():
+    details = ['bern', 'bern bahnhof', 'berneck', 'oberneunforn']
+    wildcard = [typeahead_match(i, detail) for i, detail in enumerate(details)]
+    exact = [typeahead_match(i, detail) for i, detail in enumerate(details[:2])]
+    return [{
+        'status': 0, 'matches': wildcard, 'words': []
+    }, {
+        'status': 0, 'matches': exact, 'words': []
+    }]
+
+
+@patch('app.search.SEARCH_LOCATIONS_CACHE_TTL', 60)
+@patch('app.search.SEARCH_LOCATIONS_TYPEAHEAD', True)
+@patch('app.lib.sphinxapi.SphinxClient.RunQueries', side_effect=typeahead_results)
+class TestLocationsTypeahead(BaseSearchTest):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = MemoryCache()
+        self.patcher = patch('app.search.cache', self.cache)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def search(self, search_text, **kwargs):
+        response = self.app.get(
+            url_for(
+                'search_server', topic='ech', type='locations', searchText=search_text, **kwargs
+            ),
+            headers=self.origin_headers["allowed"]
+        )
+        self.assertEqual(response.status_code, 200)
+        return [(result['id'], result['weight']) for result in response.json['results']]
+
+    def test_refined(self, mock):
+        self.assertEqual(self.search('bern'), [(0, 100), (1, 100), (2, 1), (3, 1)])
+        self.assertEqual(self.search('Berne'), [(2, 1), (3, 1)])
+        self.assertEqual(self.search('berneck'), [(2, 100)])
+        self.assertEqual(self.search('bern  bahnhof'), [(1, 100)])
+        self.assertEqual(mock.call_count, 1)
+        # the refined results are cached as well
+        self.assertEqual(self.cache.stats['locations']['entries'], 4)
+
+    def test_reordered(self, mock):
+        # sorted by rank, the exact match of bern is not an exact match of berne
+        detail = 'bern bernerhof'
+        mock.side_effect = [[{
+            'status': 0,
+            'matches': [typeahead_match(2, 'berneck'), typeahead_match(1, detail, 6)],
+            'words': []
+        }, {
+            'status': 0, 'matches': [typeahead_match(1, detail, 6)], 'words': []
+        }]]
+        self.assertEqual(self.search('bern'), [(1, 100), (2, 1)])
+        self.assertEqual(self.search('berne'), [(2, 1), (1, 1)])
+        self.assertEqual(mock.call_count, 1)
+
+    @patch('app.search.SEARCH_FUZZY_SPECULATIVE', True)
+    @patch('app.search.likely_misspelled', side_effect=lambda tokens, *_: tokens == ('bernx',))
+    def test_misspelled(self, _mock_misspelled, mock):
+        # none of the cached matches of bern matches bernx, the search falls back to searchd
+        empty = {'status': 0, 'matches': [], 'words': []}
+        fuzzy = {'status': 0, 'matches': [typeahead_match(5, 'bern')], 'words': []}
+        mock.side_effect = [typeahead_results(), [empty, dict(empty), fuzzy]]
+        self.search('bern')
+        self.assertEqual(self.search('bernx'), [(5, 1)])
+        self.assertEqual(mock.call_count, 2)
+
+    def test_not_refined(self, mock):
+        # searchd might not expand the infix of the short tokens
+        self.search('be')
+        self.search('ber')
+        self.assertEqual(mock.call_count, 2)
+        self.search('bern')
+        self.assertEqual(mock.call_count, 2)
+        # the separators of searchd are not reproduced
+        self.search('bern.b')
+        self.assertEqual(mock.call_count, 3)
+
+    def test_incomplete(self, mock):
+        # as many matches as the limit
+        self.search('bern', limit=4)
+        self.search('berne', limit=4)
+        self.assertEqual(mock.call_count, 2)
+        # keyword search
+        self.search('adress')
+        self.search('adresse bern')
+        self.assertEqual(mock.call_count, 4)
@@ -0,0 +1,108 @@
+import time
+import unittest
+from unittest.mock import patch
+
+from shapely.geometry import box
+
+from app.app import app
+from app.app import cache
+from app.helpers.helpers_search import transform_round_geometry
+from app.helpers.memory_cache import MemoryCache
+from app.helpers.memory_cache import approximate_size
+from app.helpers.memory_cache import namespace_of
+from tests.unit_tests.base_test import BaseSearchTest
+
+
+class TestMemoryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = MemoryCache(max_entries=3, max_bytes=10000)
+
+    def test_live_objects(self):
+        topics = ['all', 'ech', 'inspire']
+        self.assertTrue(self.cache.set('topics:get_topics', topics))
+        self.assertIs(self.cache.get('topics:get_topics'), topics)
+        self.assertFalse(self.cache.add('topics:get_topics', []))
+        self.assertTrue(self.cache.has('topics:get_topics'))
+        self.assertTrue(self.cache.delete('topics:get_topics'))
+        self.assertFalse(self.cache.delete('topics:get_topics'))
+        self.assertIsNone(self.cache.get('topics:get_topics'))
+        self.assertTrue(self.cache.add('topics:get_topics', []))
+        self.assertTrue(self.cache.clear())
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.bytes, 0)
+
+    def test_lru_entries(self):
+        for i in range(3):
+            self.cache.set(f'translations:{i}', str(i))
+        self.cache.get('translations:0')
+        self.cache.set('translations:3', '3')
+        self.assertEqual(len(self.cache), 3)
+        self.assertIsNone(self.cache.get('translations:1'))
+        self.assertEqual(self.cache.get('translations:0'), '0')
+        self.assertEqual(self.cache.stats['translations']['evicted'], 1)
+
+    def test_lru_bytes(self):
+        self.cache.max_bytes = 2 * approximate_size('x' * 1000) + 1
+        self.cache.set('geometries:a', 'a' * 1000)
+        self.cache.set('geometries:b', 'b' * 1000)
+        self.cache.set('geometries:c', 'c' * 1000)
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get('geometries:a'))
+        self.assertLessEqual(self.cache.bytes, self.cache.max_bytes)
+        # a value larger than the cache is not cached
+        self.assertFalse(self.cache.set('geometries:d', 'd' * 5000))
+        self.assertEqual(len(self.cache), 2)
+
+    def test_timeout(self):
+        self.cache.set('topics:get_topics', ['ech'], timeout=1)
+        self.cache.set('translations:de', 'Wald', timeout=0)
+        time.sleep(1.1)
+        self.assertIsNone(self.cache.get('topics:get_topics'))
+        self.assertEqual(self.cache.get('translations:de'), 'Wald')
+        self.assertEqual(self.cache.stats['topics']['expired'], 1)
+
+    def test_namespace_stats(self):
+        self.cache.set('topics:get_topics', ['ech'])
+        self.cache.get('topics:get_topics')
+        self.cache.get('translations:de:wald')
+        self.cache.get('view//checker')
+        self.assertEqual(
+            self.cache.stats['topics'],
+            {
+                'hits': 1,
+                'misses': 0,
+                'expired': 0,
+                'evicted': 0,
+                'entries': 1,
+                'bytes': approximate_size(['ech'])
+            }
+        )
+        self.assertEqual(self.cache.stats['translations']['misses'], 1)
+        self.assertEqual(self.cache.stats['default']['misses'], 1)
+        self.assertEqual(namespace_of('geometries:abc:def'), 'geometries')
+
+    def test_approximate_size(self):
+        geometry = box(600000, 200000, 610000, 210000)
+        self.assertGreater(approximate_size(geometry), len(geometry.wkb))
+        self.assertGreater(approximate_size(['ech', 'inspire']), approximate_size([]))
+        self.assertGreater(approximate_size({'a': 'b' * 100}), 100)
+
+
+class TestAppMemoryCache(BaseSearchTest):
+
+    def setUp(self):
+        super().setUp()
+        # CACHE_TYPE=app.helpers.memory_cache.MemoryCache
+        self.patcher = patch.dict(app.extensions['cache'], {cache: MemoryCache()})
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_app_cache(self):
+        self.assertIsInstance(cache.cache, MemoryCache)
+        geometry = box(600000, 200000, 610000, 210000)
+        transformed = transform_round_geometry(geometry, 21781, 2056)
+        self.assertIs(transform_round_geometry(geometry, 21781, 2056), transformed)
+        self.assertGreaterEqual(cache.cache.stats['geometries']['hits'], 1)
@@ -0,0 +1,134 @@
+import unittest
+from unittest.mock import patch
+
+from nose2.tools import params
+
+from flask import url_for
+
+from app.helpers.mortonspacekey import BBox
+from app.helpers.mortonspacekey import Point
+from app.helpers.mortonspacekey import QuadTree
+from app.helpers.mortonspacekey import get_quadtree
+from tests.unit_tests.base_test import BaseSearchTest
+
+
+class TestMortonSpaceKey(unittest.TestCase):
+
+    def setUp(self):
+        self.quadtree = get_quadtree()
+
+    @params(
+        ((600000, 200000), '021211313131313131313'),
+        ((660000, 270000), '003333333333333333333'),
+        ((420000, 510000), '000000000000000000000'),
+        ((900000, 30000), '033333333333333333333'),
+        ((1000000, 0), ''),
+    )
+    def test_xy_to_morton(self, point, key):
+        self.assertEqual(self.quadtree.xy_to_morton(*point), key)
+
+    @params(
+        ((599000, 199000, 601000, 201000), '021'),
+        ((600500, 200000, 602900, 202000), '02130020'),
+        # across the center of the quadtree
+        ((659000, 269000, 661000, 271000), '0'),
+        ((660000, 200000, 660000, 300000), '0'),
+        # a point on the borders of several quads
+        ((660000, 270000, 660000, 270000), '003333333333333333333'),
+        ((540000, 315000, 540000, 315000), '002313111111111111111'),
+        ((0, 0, 1, 1), ''),
+    )
+    def test_bbox_to_morton(self, bbox, key):
+        self.assertEqual(self.quadtree.bbox_to_morton(BBox(*bbox)), key)
+
+    @params(
+        # across the border of two level 2 quads
+        ((599000, 199000, 601000, 201000), 4, ['021211311', '021211313', '021300200', '021300202']),
+        ((599000, 199000, 601000, 201000), 1, ['021']),
+        # across the center of the quadtree
+        ((659000, 269000, 661000, 271000), 4, ['003333333', '012222222', '021111111', '030000000']),
+        ((600500, 200000, 602900, 202000), 2, ['02130020']),
+        ((660000, 270000, 660000, 270000), 4, ['003333333333333333333']),
+        ((0, 0, 1, 1), 4, []),
+    )
+    def test_bbox_to_morton_cover(self, bbox, max_keys, keys):
+        self.assertEqual(self.quadtree.bbox_to_morton_cover(BBox(*bbox), max_keys), keys)
+
+    def test_bbox_to_morton_cover_contains(self):
+        bbox = BBox(599000, 199000, 601000, 201000)
+        cells = [
+            self.quadtree.morton_to_bbox(key)
+            for key in self.quadtree.bbox_to_morton_cover(BBox(*bbox.bounds), 16)
+        ]
+        self.assertLessEqual(len(cells), 16)
+        self.assertEqual(min(cell.minx for cell in cells), 598125)
+        self.assertTrue(all(cell.width() < 1000 for cell in cells))
+        for x, y in ((599000, 199000), (601000, 201000), (600000, 200000)):
+            self.assertTrue(any(cell.contains(x, y) for cell in cells))
+
+    def test_morton_to_bbox(self):
+        self.assertEqual(self.quadtree.morton_to_bbox('0120'), BBox(660000, 330000, 720000, 390000))
+        self.assertEqual(self.quadtree.morton_to_bbox('0'), self.quadtree.bbox)
+        key = self.quadtree.xy_to_morton(600000, 200000)
+        self.assertTrue(self.quadtree.morton_to_bbox(key).contains(600000, 200000))
+
+    def test_strategies(self):
+        # all the strategies deliver the quad containing the whole bbox
+        bbox = BBox(600500, 200000, 602900, 202000)
+        # pylint: disable=protected-access
+        for strategy in (
+            self.quadtree._single_points_all,
+            self.quadtree._single_points_dia1,
+            self.quadtree._single_points_dia2,
+            self.quadtree._multi_points_all,
+            self.quadtree._multi_points_dia1,
+            self.quadtree._multi_points_dia2,
+        ):
+            self.assertEqual(strategy(bbox), '02130020')
+
+    def test_levels(self):
+        quadtree = QuadTree(BBox(0, 0, 32, 32), 5)
+        self.assertEqual(quadtree.xy_to_morton(1, 31), '000000')
+        # on the border of two cells, the first one
+        self.assertEqual(quadtree.xy_to_morton(31, 1), '033330')
+        self.assertEqual(quadtree.xy_to_morton(31.5, 0.5), '033333')
+        self.assertEqual(quadtree.points_to_morton([Point(17, 1), Point(31, 15)]), '03')
+        self.assertEqual(quadtree.resolution(), 1)
+
+
+def empty_results():
+    result = {'status': 0, 'error': '', 'warning': '', 'matches': [], 'words': []}
+    return [result, dict(result)]
+
+
+@patch('app.lib.sphinxapi.SphinxClient.RunQueries', side_effect=empty_results)
+@patch('app.lib.sphinxapi.SphinxClient.AddQuery')
+class TestBboxCoverSearch(BaseSearchTest):
+
+    def search(self, **kwargs):
+        response = self.app.get(
+            url_for(
+                'search_server',
+                topic='ech',
+                type='locations',
+                searchText='wald',
+                bbox='599000,199000,601000,201000',
+                **kwargs
+            ),
+            headers=self.origin_headers["allowed"]
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_single_cell(self, mock_add_query, _mock_run_queries):
+        self.search()
+        query = mock_add_query.call_args_list[0][0][0]
+        self.assertIn('@geom_quadindex 021* | @geom_quadindex 02 | @geom_quadindex 0)', query)
+
+    @patch('app.search.SEARCH_LOCATIONS_BBOX_COVER', 4)
+    def test_cover(self, mock_add_query, _mock_run_queries):
+        self.search(sortbbox='false')
+        query = mock_add_query.call_args_list[0][0][0]
+        for key in ('021211311', '021211313', '021300200', '021300202'):
+            self.assertIn(f'@geom_quadindex {key}*', query)
+        self.assertNotIn('@geom_quadindex 021*', query)
+        self.assertIn('@geom_quadindex 021 |', query)
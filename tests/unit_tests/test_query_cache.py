@@ -0,0 +1,133 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from nose2.tools import params
+
+from app.helpers.index_version import IndexVersion
+from app.helpers.query_cache import QueryCache
+from app.lib import sphinxapi
+from tests.unit_tests.sphinxapi_patch import patch_sphinx_server
+
+# pylint: disable=protected-access
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.version = '1'
+        self.cache = QueryCache(2, 60, version=lambda: self.version)
+
+    def test_lru(self):
+        self.cache.set(b'wald', b'1')
+        self.cache.set(b'bern', b'2')
+        self.assertEqual(self.cache.get(b'wald'), b'1')
+        self.cache.set(b'thun', b'3')
+        self.assertIsNone(self.cache.get(b'bern'))
+        self.assertEqual(self.cache.get(b'wald'), b'1')
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.stats, {'hits': 2, 'misses': 1, 'expired': 0, 'invalidated': 0})
+
+    def test_ttl(self):
+        cache = QueryCache(2, 0, version=lambda: self.version)
+        cache.set(b'wald', b'1')
+        self.assertIsNone(cache.get(b'wald'))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats['expired'], 1)
+
+    def test_index_version(self):
+        self.cache.set(b'wald', b'1')
+        self.version = '2'
+        self.assertIsNone(self.cache.get(b'wald'))
+        self.assertEqual(self.cache.stats['invalidated'], 1)
+        self.cache.set(b'wald', b'2')
+        self.assertEqual(self.cache.get(b'wald'), b'2')
+
+
+class TestIndexVersion(unittest.TestCase):
+
+    def test_index_version(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'version.txt')
+            index_version = IndexVersion(path, 0)
+            self.assertEqual(index_version.get(), 'unknown')
+            with open(path, 'w', encoding='utf-8') as version_file:
+                version_file.write('2024-01-01\n')
+            self.assertEqual(index_version.get(), '2024-01-01')
+            with open(path, 'w', encoding='utf-8') as version_file:
+                version_file.write('2024-01-02\n')
+            os.utime(path, ns=(0, 1))
+            self.assertEqual(index_version.get(), '2024-01-02')
+            # the file is not checked again within the interval
+            index_version.interval = 60
+            os.remove(path)
+            self.assertEqual(index_version.get(), '2024-01-02')
+
+    def test_listeners(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'version.txt')
+            index_version = IndexVersion(path, 0)
+            cache = QueryCache(2, 60, version=index_version.get)
+            index_version.subscribe(cache.invalidate)
+            cache.set(b'wald', b'1')
+            cache.set(b'bern', b'2')
+            with open(path, 'w', encoding='utf-8') as version_file:
+                version_file.write('2024-01-01\n')
+            # all the responses of the previous version are dropped at once
+            self.assertIsNone(cache.get(b'wald'))
+            self.assertEqual(len(cache), 0)
+            self.assertEqual(cache.stats['invalidated'], 2)
+            cache.set(b'wald', b'1')
+            self.assertEqual(cache.get(b'wald'), b'1')
+
+
+class TestSphinxResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = QueryCache(10, 60, version=lambda: '1')
+
+    def run_queries(self, client, query='bern', lazy=False):
+        client.SetLazyMatches(lazy)
+        client.AddQuery(query, 'swisssearch')
+        return client.RunQueries()
+
+    @params(0, 64)
+    def test_result_cache(self, chunk_size):
+        mock = patch_sphinx_server.MOCK_QUERY_SOCK_3
+        sock = patch_sphinx_server.MockSocket(mock.status, mock.data, chunk_size)
+        with patch.object(sphinxapi.SphinxClient, '_Connect', return_value=sock) as connect:
+            client = sphinxapi.SphinxClient()
+            client.SetResultCache(self.cache)
+            results = self.run_queries(client)
+            self.assertEqual(connect.call_count, 1)
+            self.assertEqual(len(self.cache), 1)
+
+            self.assertEqual(self.run_queries(client), results)
+            self.assertEqual(
+                self.run_queries(client, lazy=True)[0]['matches'], results[0]['matches']
+            )
+            self.assertEqual(connect.call_count, 1)
+            self.assertEqual(self.cache.stats['hits'], 2)
+            self.assertEqual(client.GetLastError(), '')
+
+            # the warning of a previous query is not reported for the cached response
+            client._warning = 'previous warning'
+            self.run_queries(client)
+            self.assertEqual(client.GetLastWarning(), '')
+
+            # another query is not cached yet
+            self.run_queries(client, query='thun')
+            self.assertEqual(connect.call_count, 2)
+
+    def test_result_cache_error(self):
+        sock = patch_sphinx_server.mock_search_socket([])
+        sock.data = b'\x00\x00\x00\x01\x00\x00\x00\x05error'
+        sock.status = sock.status[:4] + len(sock.data).to_bytes(4, 'big')
+        with patch.object(sphinxapi.SphinxClient, '_Connect', return_value=sock) as connect:
+            client = sphinxapi.SphinxClient()
+            client.SetResultCache(self.cache)
+            self.assertEqual(self.run_queries(client)[0]['error'], 'error')
+            self.run_queries(client)
+            self.assertEqual(connect.call_count, 2)
+            self.assertEqual(len(self.cache), 0)
@@ -0,0 +1,91 @@
+import unittest
+
+from nose2.tools import params
+
+from app.helpers.query_compiler import Alternatives
+from app.helpers.query_compiler import Keywords
+from app.helpers.query_compiler import Phrase
+from app.helpers.query_compiler import compile_query
+from app.helpers.query_compiler import digit_or_term
+from app.helpers.query_compiler import quadindex_filter
+from app.helpers.query_compiler import query_fields
+from app.helpers.query_compiler import render_query
+
+
+class TestQueryCompiler(unittest.TestCase):
+
+    @params(
+        (('wald',),
+         '@detail "wald" | @detail "^wald" | @detail "wald$" | @detail "^wald$" | '
+         '@detail "wald"~5 | @detail "wald*" | @detail "^wald*" | @detail "wald*"~5 | '
+         '@detail "*wald*" | @detail "^*wald*" | @detail "*wald*"~5'),
+        (('342',),
+         '@detail "342" | @detail "^342" | @detail "342$" | @detail "^342$" | '
+         '@detail "342*" | @detail "^342*" | @detail "342*" | @detail "342*"~5 | '
+         '@detail "342*"'),
+        (('4a', 'wald'),
+         '@detail "4a wald" | @detail "^4a wald" | @detail "4a wald$" | @detail "^4a wald$" | '
+         '@detail "4a wald" | @detail "^4a wald" | @detail "4a wald$" | @detail "^4a wald$" | '
+         '@detail "4a wald"~5 | @detail "4a wald*" | @detail "^4a wald*" | '
+         '@detail "4a wald*"~5 | @detail "4a *wald*" | @detail "^4a *wald*" | '
+         '@detail "4a *wald*"~5 | @detail "4a* wald" | @detail "^4a* wald" | '
+         '@detail "4a* wald*" | @detail "4a* wald*"~5 | @detail "4a* *wald*"'),
+        ((), ''),
+    )
+    def test_query_fields(self, tokens, expected):
+        self.assertEqual(query_fields('@detail', tokens), expected)
+
+    @params(
+        (('bern', '4a'), '@detail "bern (4|4a)"/0.7'),
+        (('waldh',), '@detail "waldh"/0.7'),
+        (
+            ('waldhof',),
+            '@detail "waldhof"/0.7 | @detail ((waldho) | (waldh))',
+        ),
+        (('1234567',), '@detail "1234567"/0.7 | @detail 1234567'),
+    )
+    def test_query_fields_fuzzy(self, tokens, expected):
+        self.assertEqual(query_fields('@detail', tokens, True), expected)
+
+    def test_compile_query(self):
+        branches = compile_query(('waldhof',), fuzzy=True)
+        self.assertEqual(
+            branches,
+            (
+                Phrase(('waldhof',), False, False, '/0.7'),
+                Alternatives((Keywords(('waldho',)), Keywords(('waldh',)))),
+            )
+        )
+        self.assertEqual(
+            render_query('@(title,detail,layer)', branches[:1]),
+            '@(title,detail,layer) "waldhof"/0.7'
+        )
+
+    def test_digit_or_term(self):
+        self.assertEqual(digit_or_term('4a'), '(4|4a)')
+        self.assertEqual(digit_or_term('342'), '342')
+        self.assertEqual(digit_or_term('sometext'), 'sometext')
+
+    def test_query_fields_memoized(self):
+        query_fields.cache_clear()
+        query = query_fields('@detail', ('wald',))
+        self.assertIs(query_fields('@detail', ('wald',)), query)
+        self.assertNotEqual(query_fields('@detail', ('wald',), True), query)
+        self.assertNotEqual(query_fields('@title', ('wald',)), query)
+        cache_info = query_fields.cache_info()  # pylint: disable=no-value-for-parameter
+        self.assertEqual(cache_info.hits, 1)
+        self.assertEqual(cache_info.misses, 3)
+
+    def test_quadindex_filter(self):
+        self.assertEqual(quadindex_filter(('0',)), '@geom_quadindex 0*')
+        self.assertEqual(
+            quadindex_filter(('021',)),
+            '@geom_quadindex 021* | @geom_quadindex 02 | @geom_quadindex 0'
+        )
+        # the common parents are only filtered once
+        self.assertEqual(
+            quadindex_filter(('021', '030')),
+            '@geom_quadindex 021* | @geom_quadindex 030* | @geom_quadindex 02 | '
+            '@geom_quadindex 03 | @geom_quadindex 0'
+        )
+        self.assertIs(quadindex_filter(('021',)), quadindex_filter(('021',)))
@@ -0,0 +1,183 @@
+import unittest
+from unittest.mock import patch
+
+from flask import url_for
+
+from app.helpers.query_compiler import QueryPlan
+from app.helpers.query_compiler import query_fields
+from app.helpers.query_planner import KeywordStats
+from app.helpers.query_planner import likely_misspelled
+from app.helpers.query_planner import plan_query
+from tests.unit_tests.base_test import BaseSearchTest
+
+
+class TestQueryPlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = KeywordStats(3)
+
+    def test_keyword_stats(self):
+        self.stats.update('swisssearch', [{'word': 'wald*', 'docs': 10, 'hits': 12}])
+        self.stats.update('layers_de', [{'word': 'wald*', 'docs': 2, 'hits': 2}])
+        self.assertEqual(self.stats.docs('swisssearch', 'wald*'), 10)
+        self.assertEqual(self.stats.docs('layers_de', 'wald*'), 2)
+        self.assertIsNone(self.stats.docs('swisssearch', 'bern*'))
+        # least recently updated keywords are evicted
+        self.stats.update(
+            'swisssearch', [{
+                'word': 'bern*', 'docs': 1, 'hits': 1
+            }, {
+                'word': 'wald*', 'docs': 11, 'hits': 12
+            }]
+        )
+        self.assertEqual(len(self.stats), 3)
+        self.stats.update('swisssearch', [{'word': 'thun*', 'docs': 1, 'hits': 1}])
+        self.assertIsNone(self.stats.docs('layers_de', 'wald*'))
+        self.assertEqual(self.stats.docs('swisssearch', 'wald*'), 11)
+
+    def test_plan_query(self):
+        self.assertIsNone(plan_query(('wald', 'bern'), 'swisssearch', self.stats))
+        # single keyword: no proximity
+        self.assertEqual(
+            plan_query(('wald',), 'swisssearch', self.stats), QueryPlan((True,), False)
+        )
+        # short tokens are not infix expanded, digits are never infix expanded anyway
+        self.assertEqual(
+            plan_query(('ab', '4a', 'bern'), 'swisssearch', self.stats),
+            QueryPlan((False, True, True), True)
+        )
+        # frequent prefixes are not infix expanded
+        self.stats.update('swisssearch', [{'word': 'bern*', 'docs': 50000, 'hits': 90000}])
+        self.assertEqual(
+            plan_query(('wald', 'bern'), 'swisssearch', self.stats), QueryPlan((True, False), True)
+        )
+        self.assertIsNone(plan_query(('wald', 'bern'), 'layers_de', self.stats))
+
+    def test_likely_misspelled(self):
+        self.assertFalse(likely_misspelled(('wald', '4a'), 'swisssearch', self.stats))
+        self.assertTrue(likely_misspelled(('Brnhf',), 'swisssearch', self.stats))
+        self.assertFalse(likely_misspelled(('Brig', '1234'), 'swisssearch', self.stats))
+        # a prefix typed before matched nothing
+        self.stats.update('swisssearch', [{'word': '*bahnx*', 'docs': 0, 'hits': 0}])
+        self.assertTrue(likely_misspelled(('Bahnxhof',), 'swisssearch', self.stats))
+        self.assertFalse(likely_misspelled(('bahnhof',), 'swisssearch', self.stats))
+        self.assertFalse(likely_misspelled(('bahnxhof',), 'layers_de', self.stats))
+        # too short prefixes are not expanded by searchd
+        self.stats.update('swisssearch', [{'word': 'bz*', 'docs': 0, 'hits': 0}])
+        self.assertFalse(likely_misspelled(('bzaa',), 'swisssearch', self.stats))
+
+    def test_pruned_query(self):
+        self.assertEqual(
+            query_fields('@detail', ('wald',), False, QueryPlan((False,), False)),
+            '@detail "wald" | @detail "^wald" | @detail "wald$" | @detail "^wald$" | '
+            '@detail "wald*" | @detail "^wald*"'
+        )
+        self.assertEqual(
+            query_fields('@detail', ('ab', 'wald'), False, QueryPlan((False, True), True)),
+            '@detail "ab wald" | @detail "^ab wald" | @detail "ab wald$" | @detail "^ab wald$" | '
+            '@detail "ab wald"~5 | @detail "ab* wald*" | @detail "^ab* wald*" | '
+            '@detail "ab* wald*"~5 | @detail "ab* *wald*" | @detail "^ab* *wald*" | '
+            '@detail "ab* *wald*"~5'
+        )
+        self.assertEqual(
+            query_fields('@detail', ('4a', 'wald'), False, QueryPlan((True, False), True)),
+            '@detail "4a wald" | @detail "^4a wald" | @detail "4a wald$" | @detail "^4a wald$" | '
+            '@detail "4a wald" | @detail "^4a wald" | @detail "4a wald$" | @detail "^4a wald$" | '
+            '@detail "4a wald"~5 | @detail "4a wald*" | @detail "^4a wald*" | '
+            '@detail "4a wald*"~5 | @detail "4a* wald" | @detail "^4a* wald" | '
+            '@detail "4a* wald*" | @detail "4a* wald*"~5'
+        )
+
+
+def search_result(matches, words=()):
+    return {'status': 0, 'error': '', 'warning': '', 'matches': matches, 'words': list(words)}
+
+
+LOCATION = {
+    'id': 1,
+    'weight': 1200,
+    'attrs': {
+        'origin': 'gazetteer',
+        'feature_id': '',
+        'detail': 'bahnhof',
+        'label': '<b>Bahnhof</b>',
+        'geom_st_box2d': 'BOX(600000 200000,600000 200000)',
+        'x': 200000.0,
+        'y': 600000.0,
+        'lat': 46.9,
+        'lon': 7.4,
+    }
+}
+
+
+@patch('app.search.SEARCH_QUERY_PLANNER', True)
+@patch('app.lib.sphinxapi.SphinxClient.RunQueries')
+@patch('app.lib.sphinxapi.SphinxClient.AddQuery')
+class TestQueryPlannerSearch(BaseSearchTest):
+
+    def search(self, search_text):
+        response = self.app.get(
+            url_for('search_server', topic='ech', type='locations', searchText=search_text),
+            headers=self.origin_headers["allowed"]
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json
+
+    def test_swiss_search_planned(self, mock_add_query, mock_run_queries):
+        stats = KeywordStats(10)
+        words = [{'word': 'bahnhofstrasse*', 'docs': 20000, 'hits': 20001}]
+        mock_run_queries.return_value = [
+            {
+                'status': 0, 'error': '', 'warning': '', 'matches': [], 'words': words
+            },
+            {
+                'status': 0, 'error': '', 'warning': '', 'matches': [], 'words': []
+            },
+        ]
+        with patch('app.search.get_keyword_stats', return_value=stats):
+            self.search('bahnhofstrasse')
+            first_query = mock_add_query.call_args_list[0][0][0]
+            self.assertIn('"*bahnhofstrasse*"', first_query)
+            self.assertNotIn('~5', first_query)
+            self.assertEqual(stats.docs('swisssearch', 'bahnhofstrasse*'), 20000)
+
+            mock_add_query.reset_mock()
+            self.search('bahnhofstrasse')
+            first_query = mock_add_query.call_args_list[0][0][0]
+            self.assertNotIn('*bahnhofstrasse*', first_query)
+            self.assertIn('"^bahnhofstrasse*"', first_query)
+
+    @patch('app.search.SEARCH_FUZZY_SPECULATIVE', True)
+    def test_swiss_search_speculative_fuzzy(self, mock_add_query, mock_run_queries):
+        stats = KeywordStats(10)
+        stats.update('swisssearch', [{'word': '*bahnx*', 'docs': 0, 'hits': 0}])
+        with patch('app.search.get_keyword_stats', return_value=stats):
+            # likely misspelled, the fuzzy result set is used in the same round trip
+            mock_run_queries.return_value = [
+                search_result([]), search_result([]), search_result([LOCATION])
+            ]
+            results = self.search('bahnxhof')
+            self.assertEqual(mock_run_queries.call_count, 1)
+            self.assertEqual(
+                [call.kwargs['index'] for call in mock_add_query.call_args_list],
+                ['swisssearch', 'swisssearch', 'swisssearch_fuzzy'],
+            )
+            self.assertEqual(results['fuzzy'], 'true')
+            self.assertEqual(results['results'][0]['attrs']['detail'], 'bahnhof')
+
+            # the fuzzy result set is ignored when the standard queries found something
+            mock_run_queries.reset_mock()
+            mock_run_queries.return_value = [
+                search_result([]), search_result([LOCATION]), search_result([])
+            ]
+            results = self.search('bahnxhof')
+            self.assertEqual(mock_run_queries.call_count, 1)
+            self.assertNotIn('fuzzy', results)
+            self.assertEqual(len(results['results']), 1)
+
+            # not misspelled, no speculative query
+            mock_add_query.reset_mock()
+            mock_run_queries.reset_mock()
+            mock_run_queries.return_value = [search_result([]), search_result([LOCATION])]
+            self.search('bahnhof')
+            self.assertEqual(len(mock_add_query.call_args_list), 2)
@@ -0,0 +1,220 @@
+import gzip
+from unittest.mock import patch
+
+from flask import url_for
+
+from app.helpers.response_cache import ResponseCache
+from tests.unit_tests.base_test import BaseSearchTest
+from tests.unit_tests.sphinxapi_patch import patch_search_layers_run_queries
+
+
+class TestResponseCache(BaseSearchTest):
+
+    def setUp(self):
+        super().setUp()
+        self.version = '1'
+        self.cache = ResponseCache(0, 60, version=lambda: self.version)
+
+    def response(self, body):
+        return self.context.app.response_class(body, mimetype='application/json')
+
+    def test_lru_by_bytes(self):
+        self.cache.max_bytes = 1000
+        self.cache.set('a', self.response('a' * 10))
+        self.cache.set('b', self.response('b' * 10))
+        size = self.cache.bytes
+        # room for two responses
+        self.cache.max_bytes = size + 1
+        self.assertEqual(self.cache.get('a').get_data(), b'a' * 10)
+        self.cache.set('c', self.response('c' * 10))
+        self.assertLessEqual(self.cache.bytes, self.cache.max_bytes)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a').content_type, 'application/json')
+        self.assertEqual(self.cache.stats['evicted'], 1)
+        # too large responses are not cached
+        self.cache.set('d', self.response('d' * size))
+        self.assertIsNone(self.cache.get('d'))
+        self.assertEqual(self.cache.bytes, size)
+
+    def test_index_version(self):
+        self.cache.max_bytes = 1000
+        self.cache.set('a', self.response('a'))
+        self.version = '2'
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats['invalidated'], 1)
+        self.assertEqual(self.cache.bytes, 0)
+
+    def test_invalidate(self):
+        self.cache.max_bytes = 1000
+        self.cache.set('a', self.response('a'))
+        self.cache.set('b', self.response('b'))
+        self.cache.invalidate()
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.bytes, 0)
+        self.assertEqual(self.cache.stats['invalidated'], 2)
+
+    def test_stale_while_revalidate(self):
+        self.cache.max_bytes = 1000
+        self.cache.stale = 60
+        self.cache.set('a', self.response('a'))
+        expires = self.cache._entries['a'].expires  # pylint: disable=protected-access
+        with patch('app.helpers.response_cache.time.monotonic', return_value=expires + 1):
+            # the first request refreshes the response, the others get the stale one
+            self.assertIsNone(self.cache.get('a'))
+            stale = self.cache.get('a')
+            self.assertEqual(stale.get_data(), b'a')
+            self.assertEqual(stale.headers['X-Cache-Status'], 'STALE')
+        with patch('app.helpers.response_cache.time.monotonic', return_value=expires + 10):
+            # the refresh did not complete, another request retries it
+            self.assertIsNone(self.cache.get('a'))
+            self.cache.set('a', self.response('refreshed'))
+            fresh = self.cache.get('a')
+            self.assertEqual(fresh.get_data(), b'refreshed')
+            self.assertNotIn('X-Cache-Status', fresh.headers)
+        with patch('app.helpers.response_cache.time.monotonic', return_value=expires + 200):
+            # out of the stale period
+            self.assertIsNone(self.cache.get_stale('a'))
+            self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats['stale'], 1)
+        self.assertEqual(self.cache.stats['expired'], 1)
+
+    def test_stale_if_error(self):
+        self.cache.max_bytes = 1000
+        self.cache.stale = 60
+        self.assertIsNone(self.cache.get_stale('a'))
+        self.cache.set('a', self.response('a'))
+        # a fresh response whose refresh ahead failed
+        self.assertNotIn('X-Cache-Status', self.cache.get_stale('a').headers)
+        expires = self.cache._entries['a'].expires  # pylint: disable=protected-access
+        with patch('app.helpers.response_cache.time.monotonic', return_value=expires + 1):
+            self.assertIsNone(self.cache.get('a'))
+            self.assertEqual(self.cache.get_stale('a').headers['X-Cache-Status'], 'STALE')
+            # no other refresh before the retry delay
+            self.assertIsNotNone(self.cache.get('a'))
+        self.version = '2'
+        self.assertIsNone(self.cache.get_stale('a'))
+
+
+@patch('app.lib.sphinxapi.SphinxClient.RunQueries')
+class TestResponseCacheRoute(BaseSearchTest):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = ResponseCache(10**6, 60, version=lambda: '1')
+        self.patcher = patch('app.routes.get_response_cache', return_value=self.cache)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def search(self, headers=None, **kwargs):
+        return self.app.get(
+            url_for('search_server', topic='inspire', type='layers', **kwargs),
+            headers=dict(self.origin_headers["allowed"], **(headers or {}))
+        )
+
+    def test_response_cache(self, mock):
+        mock.return_value = patch_search_layers_run_queries.results
+        response = self.search(searchText='wand', lang='de')
+        self.assertEqual(response.status_code, 200)
+        cached = self.search(lang='de', searchText='wand')
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(cached.get_data(), response.get_data())
+        self.assertEqual(cached.content_type, response.content_type)
+        self.assertCacheControl(cached)
+        self.assertEqual(cached.headers['Access-Control-Allow-Origin'], '*')
+        self.assertEqual(self.cache.stats['hits'], 1)
+        not_modified = self.search({'If-None-Match': cached.headers['ETag']},
+                                   searchText='wand',
+                                   lang='de')
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(mock.call_count, 1)
+
+        # the gzip body is cached separately
+        headers = {'Accept-Encoding': 'gzip'}
+        compressed = self.search(headers, searchText='wand', lang='de')
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.get_data()), response.get_data())
+        cached = self.search(headers, searchText='wand', lang='de')
+        self.assertEqual(cached.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(cached.get_data(), compressed.get_data())
+        self.assertEqual(mock.call_count, 2)
+
+        # the language without lang parameter is negotiated
+        self.search({'Accept-Language': 'fr'}, searchText='wand')
+        self.search({'Accept-Language': 'it'}, searchText='wand')
+        self.assertEqual(mock.call_count, 4)
+
+    def test_response_cache_jsonp(self, mock):
+        mock.return_value = patch_search_layers_run_queries.results
+        response = self.search(searchText='wand', callback='cb')
+        cached = self.search(searchText='wand', callback='cb')
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(cached.get_data(), response.get_data())
+        self.assertEqual(cached.content_type, response.content_type)
+
+    def test_response_cache_error(self, mock):
+        mock.return_value = None
+        self.assertEqual(self.search(searchText='wand').status_code, 503)
+        self.search(searchText='wand')
+        self.assertEqual(mock.call_count, 2)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_response_cache_stale_on_error(self, mock):
+        self.cache.stale = 60
+        mock.return_value = patch_search_layers_run_queries.results
+        response = self.search(searchText='wand')
+        # searchd fails once the response expired
+        mock.return_value = None
+        entry = next(iter(self.cache._entries.values()))  # pylint: disable=protected-access
+        with patch('app.helpers.response_cache.time.monotonic', return_value=entry.expires + 1):
+            stale = self.search(searchText='wand')
+        self.assertEqual(stale.status_code, 200)
+        self.assertEqual(stale.get_data(), response.get_data())
+        self.assertEqual(stale.headers['X-Cache-Status'], 'STALE')
+        self.assertEqual(stale.headers['Cache-Control'], 'public, max-age=10')
+        self.assertEqual(mock.call_count, 2)
+        # without stale response the error is returned
+        self.assertEqual(self.search(searchText='wald').status_code, 503)
+
+
+class TestResponseCacheHotKeys(BaseSearchTest):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = ResponseCache(1000, 60, version=lambda: '1', hot_keys=4)
+
+    def response(self, body):
+        return self.context.app.response_class(body, mimetype='application/json')
+
+    def request(self, key, body):
+        response = self.cache.get(key)
+        if response is None:
+            self.cache.set(key, self.response(body))
+
+    def test_pinned(self):
+        for i in range(10):
+            self.request('bern', 'b' * 100)
+            self.request(f'tail{i}', 't' * 100)
+        self.assertTrue(self.cache.is_pinned('bern'))
+        self.assertFalse(self.cache.is_pinned('tail9'))
+        self.assertEqual(self.cache.top(1)[0]['key'], 'bern')
+        # bern is the least recently used response but is not evicted
+        self.cache.get('tail9')
+        for i in range(10):
+            self.request(f'other{i}', 'o' * 100)
+        self.assertIsNotNone(self.cache.get('bern'))
+        self.assertGreater(self.cache.stats['evicted'], 0)
+
+    def test_refresh_ahead(self):
+        for _ in range(10):
+            self.request('bern', 'b')
+        entry = self.cache._entries['bern']  # pylint: disable=protected-access
+        # in the last 10% of the ttl
+        with patch('app.helpers.response_cache.time.monotonic', return_value=entry.expires - 5):
+            # the first request refreshes the response, the others still get the cached one
+            self.assertIsNone(self.cache.get('bern'))
+            self.assertIsNotNone(self.cache.get('bern'))
+            self.cache.set('bern', self.response('refreshed'))
+            self.assertEqual(self.cache.get('bern').get_data(), b'refreshed')
+        self.assertEqual(self.cache.stats['refreshed'], 1)
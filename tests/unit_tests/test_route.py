@@ -37,6 +37,31 @@ class TestSearchService(BaseSearchTest):
         self.assertAttrs('layers', response.json['results'][0]['attrs'], 21781)
         self.assertCacheControl(response)
 
+    def test_search_layers_etag(self, mock):
+        mock.return_value = patch_search_layers_run_queries.results
+        url = url_for('search_server', topic='inspire', type='layers', searchText='wand')
+        response = self.app.get(url, headers=self.origin_headers["allowed"])
+        etag, weak = response.get_etag()
+        self.assertFalse(weak)
+        response = self.app.get(
+            url, headers=dict(self.origin_headers["allowed"], **{'If-None-Match': f'"{etag}"'})
+        )
+        # answered without searching
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+        self.assertEqual(response.get_etag(), (etag, False))
+        self.assertCacheControl(response)
+        self.assertEqual(mock.call_count, 1)
+        # the ETag depends on the request and the index version
+        other = self.app.get(url + '&lang=fr', headers=self.origin_headers["allowed"])
+        self.assertNotEqual(other.get_etag()[0], etag)
+        with patch('app.routes.get_index_version', return_value='new'):
+            response = self.app.get(
+                url, headers=dict(self.origin_headers["allowed"], **{'If-None-Match': f'"{etag}"'})
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.get_etag()[0], etag)
+
     def test_search_layers_with_callback(self, mock):
         mock.return_value = patch_search_layers_run_queries.results
         response = self.app.get(
@@ -0,0 +1,138 @@
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+
+from flask_caching import Cache
+from shapely.geometry import Point
+
+from flask import Flask
+
+from app.helpers.shared_cache import HEADER
+from app.helpers.shared_cache import PROBES
+from app.helpers.shared_cache import SLOT_HEADER
+from app.helpers.shared_cache import SharedMemoryCache
+from app.helpers.shared_cache import key_hash
+from app.settings import CACHE_SHARED_SIZE
+from app.settings import CACHE_SHARED_SLOT_SIZE
+
+
+def set_in_child(path, key, value):
+    # the cache of the parent process, as inherited by a forked gunicorn worker
+    SharedMemoryCache(path, 8 * 256, 256).set(key, value)
+
+
+class TestSharedMemoryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.path = os.path.join(self.directory.name, 'cache')
+        self.cache = SharedMemoryCache(self.path, PROBES * 256, 256)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('topics'))
+        self.assertTrue(self.cache.set('topics', ['ech', 'inspire']))
+        self.assertEqual(self.cache.get('topics'), ['ech', 'inspire'])
+        self.assertTrue(self.cache.set('topics', ['ech']))
+        self.assertEqual(self.cache.get('topics'), ['ech'])
+        self.assertFalse(self.cache.add('topics', ['inspire']))
+        self.assertTrue(self.cache.add('lang', 'de'))
+        self.assertTrue(self.cache.has('lang'))
+        self.assertEqual(len(self.cache), 2)
+        self.assertTrue(self.cache.delete('lang'))
+        self.assertFalse(self.cache.delete('lang'))
+        self.assertFalse(self.cache.has('lang'))
+        self.assertTrue(self.cache.clear())
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.stats['hits'], 2)
+
+    def test_timeout(self):
+        self.cache.set('topics', ['ech'], timeout=1)
+        self.cache.set('lang', 'de', timeout=0)
+        self.assertEqual(self.cache.get('topics'), ['ech'])
+        time.sleep(1.1)
+        self.assertIsNone(self.cache.get('topics'))
+        self.assertEqual(self.cache.get('lang'), 'de')
+
+    def test_too_large(self):
+        self.assertFalse(self.cache.set('topics', 'x' * 256))
+        self.assertEqual(self.cache.stats['too_large'], 1)
+        self.assertIsNone(self.cache.get('topics'))
+
+    def test_span(self):
+        cache = SharedMemoryCache(self.path, HEADER.size + 64 * (SLOT_HEADER.size + 256), 256)
+        self.assertEqual(cache.nslots, 64)
+        # the first slot of the entry is the last slot of the table
+        key = next(f'key{i}' for i in range(10000) if key_hash(f'key{i}'.encode()) % 64 == 63)
+        self.assertTrue(cache.set(key, 'x' * 1000))
+        self.assertEqual(cache.get(key), 'x' * 1000)
+        self.assertEqual(len(cache), 1)
+        self.assertFalse(cache.set('key', 'x' * 2048))
+        self.assertEqual(cache.stats['too_large'], 1)
+
+    def test_span_evicted(self):
+        cache = SharedMemoryCache(self.path, HEADER.size + 64 * (SLOT_HEADER.size + 256), 256)
+        values = {f'key{i}': chr(65 + i % 26) * (i % 7 * 250 + 1) for i in range(200)}
+        for key, value in values.items():
+            self.assertTrue(cache.set(key, value))
+        # the entries in the way of the later ones are evicted entirely
+        cached = {key: cache.get(key) for key in values}
+        self.assertEqual({
+            key: value for key, value in cached.items() if value is not None
+        }, {
+            key: values[key] for key, value in cached.items() if value is not None
+        })
+        self.assertEqual(len(cache), sum(1 for value in cached.values() if value is not None))
+        self.assertEqual(cached['key199'], values['key199'])
+
+    def test_default_settings_geometry(self):
+        cache = SharedMemoryCache(self.path, CACHE_SHARED_SIZE, CACHE_SHARED_SLOT_SIZE)
+        # a transformed municipality boundary with 2049 vertices
+        geometry = Point(2600000, 1200000).buffer(5000, 512)
+        self.assertTrue(cache.set('geometries:boundary', geometry))
+        self.assertTrue(cache.get('geometries:boundary').equals(geometry))
+        self.assertEqual(cache.stats['too_large'], 0)
+
+    def test_lru(self):
+        for i in range(PROBES):
+            self.cache.set(f'key{i}', i)
+        self.assertEqual(self.cache.get('key0'), 0)
+        self.cache.set('key', -1)
+        self.assertEqual(self.cache.stats['evicted'], 1)
+        self.assertIsNone(self.cache.get('key1'))
+        self.assertEqual(self.cache.get('key0'), 0)
+        self.assertEqual(self.cache.get('key'), -1)
+
+    def test_shared_between_processes(self):
+        process = multiprocessing.get_context('fork').Process(
+            target=set_in_child, args=(self.path, 'topics', ['ech'])
+        )
+        process.start()
+        process.join()
+        self.assertEqual(self.cache.get('topics'), ['ech'])
+
+    def test_flask_caching_backend(self):
+        app = Flask(__name__)
+        app.config.update(
+            CACHE_TYPE='app.helpers.shared_cache.SharedMemoryCache',
+            CACHE_SHARED_PATH=self.path,
+            CACHE_SHARED_SIZE=PROBES * 256,
+            CACHE_SHARED_SLOT_SIZE=256,
+        )
+        cache = Cache(app)
+        calls = []
+
+        @cache.memoize()
+        def translation(msg_id):
+            calls.append(msg_id)
+            return msg_id.upper()
+
+        with app.app_context():
+            self.assertEqual(translation('wald'), 'WALD')
+            self.assertEqual(translation('wald'), 'WALD')
+            self.assertIsInstance(cache.cache, SharedMemoryCache)
+        self.assertEqual(calls, ['wald'])
@@ -0,0 +1,116 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from werkzeug.exceptions import ServiceUnavailable
+
+from flask import url_for
+
+from app.helpers.single_flight import SingleFlight
+from app.search import Search
+from tests.unit_tests.base_test import BaseSearchTest
+from tests.unit_tests.sphinxapi_patch import patch_search_layers_run_queries
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.release = threading.Event()
+        self.calls = 0
+        self.results = []
+
+    def function(self):
+        self.calls += 1
+        self.release.wait()
+        return {'results': [self.calls]}
+
+    def failing_function(self):
+        self.calls += 1
+        self.release.wait()
+        raise ServiceUnavailable('Search Sphinx Server not available')
+
+    def run_concurrently(self, keys, function):
+
+        def call(key):
+            try:
+                self.results.append(self.single_flight.do(key, function))
+            except ServiceUnavailable as error:
+                self.results.append(error)
+
+        threads = [threading.Thread(target=call, args=(key,)) for key in keys]
+        for thread in threads:
+            thread.start()
+        # wait until the identical calls are all waiting for the in-flight ones
+        while self.single_flight.stats['waits'] + self.single_flight.stats['calls'] < len(keys):
+            time.sleep(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+
+    def test_coalesced(self):
+        self.run_concurrently(['wald', 'wald', 'wald', 'bern'], self.function)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.single_flight.stats, {'calls': 2, 'waits': 2, 'hits': 2})
+        self.assertEqual(len(self.single_flight), 0)
+        # the identical calls share the same result object
+        self.assertEqual(len({id(result) for result in self.results}), 2)
+
+    def test_exception_shared(self):
+        self.run_concurrently(['wald', 'wald'], self.failing_function)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.single_flight.stats, {'calls': 1, 'waits': 1, 'hits': 0})
+        self.assertTrue(all(isinstance(result, ServiceUnavailable) for result in self.results))
+        # nothing is kept once the call finished
+        self.release.clear()
+        self.run_concurrently(['wald'], self.function)
+        self.assertEqual(self.calls, 2)
+
+
+class TestSearchKey(BaseSearchTest):
+
+    def search_key(self, **kwargs):
+        with self.context.app.test_request_context(query_string=kwargs) as context:
+            return Search(context.request, 'ech').search_key()
+
+    def test_search_key(self):
+        key = self.search_key(type='locations', searchText='bern  bahnhof', lang='de')
+        self.assertEqual(key, self.search_key(type='locations', searchText=' bern bahnhof'))
+        self.assertEqual(
+            key, self.search_key(type='locations', searchText='bern bahnhof', callback='cb')
+        )
+        for name, value in [
+            ('lang', 'fr'),
+            ('sr', '2056'),
+            ('limit', '5'),
+            ('origins', 'address'),
+            ('bbox', '600000,200000,610000,210000'),
+            ('geometryFormat', 'geojson'),
+            ('returnGeometry', 'false'),
+        ]:
+            params = {'type': 'locations', 'searchText': 'bern bahnhof', name: value}
+            self.assertNotEqual(key, self.search_key(**params))
+
+
+@patch('app.lib.sphinxapi.SphinxClient.RunQueries')
+class TestSingleFlightSearch(BaseSearchTest):
+
+    def test_single_flight_search(self, mock):
+        mock.return_value = patch_search_layers_run_queries.results
+        single_flight = SingleFlight()
+        with patch('app.search.SEARCH_SINGLE_FLIGHT', True), \
+            patch('app.search.get_single_flight', return_value=single_flight):
+            response = self.app.get(
+                url_for('search_server', topic='inspire', type='layers', searchText='wand'),
+                headers=self.origin_headers["allowed"]
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(single_flight.stats, {'calls': 1, 'waits': 0, 'hits': 0})
+
+    def test_stats(self, mock):  # pylint: disable=unused-argument
+        response = self.app.get(url_for('stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        self.assertEqual(set(response.json['single_flight']), {'calls', 'waits', 'hits'})
+        self.assertIn('reused', response.json['sphinx_pool'])
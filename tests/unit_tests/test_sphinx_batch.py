@@ -0,0 +1,149 @@
+import re
+import socket
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from werkzeug.exceptions import GatewayTimeout
+
+from app.helpers.sphinx_pool import SphinxConnectionPool
+from app.lib import sphinxapi
+from tests.unit_tests.sphinxapi_patch import patch_sphinx_server
+
+# pylint: disable=protected-access
+
+ATTRS = [('label', sphinxapi.SPH_ATTR_STRING)]
+
+
+class KilledError(Exception):
+    '''The greenlet of a caller killed (e.g. client disconnect, gevent Timeout)'''
+
+
+class BatchMockSocket(patch_sphinx_server.MockSocket):
+    '''Answer each query `qN` of the batch with a result set with the match N'''
+
+    def __init__(self):
+        super().__init__(b'', b'')
+        self.batches = []
+
+    def send(self, *args, **kwargs):
+        queries = [int(n) for n in re.findall(rb'\x00\x00\x00\x02q(\d)', bytes(args[0]))]
+        self.batches.append(queries)
+        socket_ = patch_sphinx_server.mock_search_socket([
+            (['label'], ATTRS, [(n, 1, [f'match {n}'])]) for n in queries
+        ])
+        self.status, self.data = socket_.status, socket_.data
+        return super().send(*args, **kwargs)
+
+
+class TestSearchBatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = SphinxConnectionPool('localhost', 9312, 2, 60, 1, 0.05, 3)
+        self.sock = BatchMockSocket()
+        self.results = {}
+
+    def run_queries(self, queries):
+        with self.pool.client() as client:
+            for n in queries:
+                client.AddQuery(f'q{n}', 'swisssearch')
+            try:
+                results = client.RunQueries()
+            except (IOError, GatewayTimeout, KilledError) as error:
+                results = error
+            self.results[queries] = (results, client.GetLastError())
+
+    def run_concurrently(self, *callers):
+        threads = [threading.Thread(target=self.run_queries, args=(c,)) for c in callers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_queries_batched(self):
+        with patch.object(sphinxapi.SphinxClient, '_Connect', return_value=self.sock):
+            self.run_concurrently((1, 2), (3,))
+        self.assertEqual(len(self.sock.batches), 1)
+        self.assertCountEqual(self.sock.batches[0], [1, 2, 3])
+        for queries, (results, error) in self.results.items():
+            self.assertEqual(error, '')
+            self.assertEqual([result['matches'][0]['id'] for result in results], list(queries))
+        self.assertEqual(self.pool.batcher.stats, {'batches': 1, 'queries': 3, 'callers': 2})
+
+    def test_max_queries(self):
+        with patch.object(sphinxapi.SphinxClient, '_Connect', return_value=self.sock):
+            self.run_concurrently((1, 2), (3, 4), (5,), (6, 7, 8, 9))
+        # the queries of a caller are never split
+        self.assertEqual(sorted(map(len, self.sock.batches)), [2, 3, 4])
+        for queries, (results, _) in self.results.items():
+            self.assertEqual([result['matches'][0]['id'] for result in results], list(queries))
+        self.assertEqual(self.pool.batcher.stats['callers'], 4)
+
+    def test_connect_failed(self):
+
+        def connect(client):
+            client._error = 'connection to localhost;9312 failed'
+
+        with patch.object(sphinxapi.SphinxClient, '_Connect', autospec=True, side_effect=connect):
+            self.run_concurrently((1,), (2,))
+        for results, error in self.results.values():
+            self.assertIsNone(results)
+            self.assertEqual(error, 'connection to localhost;9312 failed')
+
+    def test_timeout(self):
+        with patch.object(sphinxapi.SphinxClient, '_Connect', side_effect=socket.timeout()):
+            self.run_concurrently((1,), (2,))
+        for results, _ in self.results.values():
+            self.assertIsInstance(results, socket.timeout)
+
+    def run_leader_first(self, sleep):
+        with patch.object(sphinxapi.SphinxClient, '_Connect', return_value=self.sock), \
+                patch('app.helpers.sphinx_batch.time') as mock_time:
+            mock_time.sleep.side_effect = sleep
+            leader = threading.Thread(target=self.run_queries, args=((1,),))
+            follower = threading.Thread(target=self.run_queries, args=((2,),))
+            leader.start()
+            while not self.pool.batcher._pending:
+                time.sleep(0.001)
+            follower.start()
+            leader.join()
+            follower.join()
+
+    def test_leader_killed(self):
+
+        def sleep(_):
+            # killed during the window, once the follower is queued
+            while len(self.pool.batcher._pending) < 2:
+                time.sleep(0.001)
+            raise KilledError()
+
+        self.run_leader_first(sleep)
+        self.assertIsInstance(self.results[(1,)][0], KilledError)
+        # the follower is promoted and dispatches its queries alone
+        self.assertEqual(self.sock.batches, [[2]])
+        self.assertEqual(self.results[(2,)][0][0]['matches'][0]['id'], 2)
+        self.assertEqual(self.pool.batcher._pending, [])
+
+    def test_wait_timeout(self):
+        self.pool.batcher.timeout = 0.05
+
+        def sleep(_):
+            # the leader is stuck longer than the follower waits
+            while not isinstance(self.results.get((2,), (None,))[0], GatewayTimeout):
+                time.sleep(0.001)
+
+        self.run_leader_first(sleep)
+        self.assertIsInstance(self.results[(2,)][0], GatewayTimeout)
+        # the queries of the follower left the queue
+        self.assertEqual(self.sock.batches, [[1]])
+        self.assertEqual(self.results[(1,)][0][0]['matches'][0]['id'], 1)
+        self.assertEqual(self.pool.batcher._pending, [])
+
+    def test_batching_disabled(self):
+        pool = SphinxConnectionPool('localhost', 9312, 2, 60, 1)
+        self.assertIsNone(pool.batcher)
+        with pool.client() as client:
+            self.assertIsNone(client._dispatcher)
+        with self.pool.client(dispatch=False) as client:
+            self.assertIsNone(client._dispatcher)
@@ -0,0 +1,108 @@
+import socket
+import unittest
+from unittest.mock import patch
+
+from app.helpers.sphinx_pool import SphinxConnectionPool
+from app.helpers.sphinx_pool import get_sphinx_pool
+from app.helpers.sphinx_pool import is_alive
+
+# pylint: disable=protected-access
+
+
+class TestSphinxConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = SphinxConnectionPool('localhost', 9312, 2, 60, 1)
+        self.peers = []
+
+    def tearDown(self):
+        self.pool.clear()
+        for peer in self.peers:
+            peer.close()
+
+    def _connect(self, client):
+        # simulate a lazily opened persistent connection
+        sock, peer = socket.socketpair()
+        self.peers.append(peer)
+        client._socket = sock
+        return sock
+
+    def test_fresh_client_settings(self):
+        with self.pool.client() as client:
+            self.assertEqual(client._host, 'localhost')
+            self.assertEqual(client._port, 9312)
+            self.assertTrue(client._persistent)
+            self.assertIsNone(client._socket)
+            client.SetLimits(0, 5)
+        with self.pool.client() as client:
+            self.assertEqual(client._limit, 20)
+
+    def test_connection_reused(self):
+        with self.pool.client() as client:
+            sock = self._connect(client)
+        self.assertEqual(len(self.pool), 1)
+        self.assertIsNone(client._socket)
+        with self.pool.client() as client:
+            self.assertIs(client._socket, sock)
+            self.assertEqual(len(self.pool), 0)
+        self.assertEqual(self.pool.stats['opened'], 1)
+        self.assertEqual(self.pool.stats['reused'], 1)
+
+    def test_connection_discarded_on_error(self):
+        with self.pool.client() as client:
+            sock = self._connect(client)
+            client._error = 'searchd error'
+        self.assertEqual(len(self.pool), 0)
+        self.assertEqual(sock.fileno(), -1)
+
+        with self.assertRaises(IOError):
+            with self.pool.client() as client:
+                sock = self._connect(client)
+                raise IOError('timeout')
+        self.assertEqual(len(self.pool), 0)
+        self.assertEqual(sock.fileno(), -1)
+        self.assertEqual(self.pool.stats['discarded'], 2)
+
+    def test_pool_size(self):
+        with self.pool.client() as client1, self.pool.client() as client2, \
+            self.pool.client() as client3:
+            for client in (client1, client2, client3):
+                self._connect(client)
+        self.assertEqual(len(self.pool), 2)
+        self.assertEqual(self.pool.stats['discarded'], 1)
+
+    def test_dead_connection_evicted(self):
+        with self.pool.client() as client:
+            self._connect(client)
+        # searchd closed the connection
+        self.peers[0].close()
+        with self.pool.client() as client:
+            self.assertIsNone(client._socket)
+        self.assertEqual(self.pool.stats['evicted'], 1)
+
+    def test_idle_connection_evicted(self):
+        with self.pool.client() as client:
+            self._connect(client)
+        with patch('app.helpers.sphinx_pool.time.monotonic', return_value=1e12):
+            with self.pool.client() as client:
+                self.assertIsNone(client._socket)
+        self.assertEqual(self.pool.stats['evicted'], 1)
+
+    def test_pool_disabled(self):
+        pool = SphinxConnectionPool('localhost', 9312, 0, 60, 1)
+        with pool.client() as client:
+            self.assertFalse(client._persistent)
+
+    def test_is_alive(self):
+        sock, peer = socket.socketpair()
+        self.assertTrue(is_alive(sock))
+        peer.close()
+        self.assertFalse(is_alive(sock))
+        sock.close()
+        self.assertFalse(is_alive(sock))
+
+    def test_get_sphinx_pool_per_process(self):
+        pool = get_sphinx_pool()
+        self.assertIs(get_sphinx_pool(), pool)
+        with patch('app.helpers.sphinx_pool.os.getpid', return_value=-1):
+            self.assertIsNot(get_sphinx_pool(), pool)
@@ -1,3 +1,4 @@
+import json
 import unittest
 from unittest.mock import patch
 
@@ -6,6 +7,17 @@ from nose2.tools import params
 from app.lib import sphinxapi
 from tests.unit_tests.sphinxapi_patch import patch_sphinx_server
 
+MOCK_MIXED_ATTRS_SOCK = patch_sphinx_server.mock_search_socket([(
+    ['detail'],
+    [
+        ('label', sphinxapi.SPH_ATTR_STRING),
+        ('years', sphinxapi.SPH_ATTR_MULTI),
+        ('rank', sphinxapi.SPH_ATTR_INTEGER),
+        ('x', sphinxapi.SPH_ATTR_FLOAT),
+    ],
+    [(1, 2, ['a', [], 3, 1.5]), (2, 3, ['', [1, 2, 3], 0, -1.0])],
+)])
+
 
 class SpinxApiBaseTest(unittest.TestCase):
 
@@ -61,6 +73,154 @@ class TestSphinxApi(SpinxApiBaseTest):
         res3 = api.EscapeString(esc_str)
         self.assertEqual(res3, r'hi\$toto')
 
+    def test_sphinx_api_add_query(self):
+        # pylint: disable=protected-access
+        api = self.get_sphinx_client()
+        api.SetFilter('rank', [1, 2])
+        api.AddQuery('wald', 'swisssearch', 'c')
+        self.assertEqual(
+            api._reqs[0],
+            b'\x00\x00\x00@\x00\x00\x00\x00\x00\x00\x00\x14\x00\x00\x00\x04' + b'\x00' * 15 +
+            b'\x04wald\x00\x00\x00\x00\x00\x00\x00\x0bswisssearch\x00\x00\x00\x01' + b'\x00' * 19 +
+            b'\x01\x00\x00\x00\x04rank\x00\x00\x00\x00\x00\x00\x00\x02\x00\x00\x00\x00'
+            b'\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x02' + b'\x00' * 14 +
+            b'\x03\xe8\x00\x00\x00\x0b@group desc' + b'\x00' * 35 +
+            b'\x01c\x00\x00\x00\x00\x00\x00\x00\x01*' + b'\x00' * 16
+        )
+
+    def test_sphinx_api_request_template(self):
+        # pylint: disable=protected-access
+        sphinxapi.GetRequestTemplate.cache_clear()
+        first = self.get_sphinx_client()
+        first.SetFilter('rank', [1, 2])
+        first.AddQuery('wald', 'swisssearch')
+        first.AddQuery('bern', 'swisssearch_fuzzy', 'comment')
+        api = self.get_sphinx_client()
+        api.SetFilter('rank', [1, 2])
+        api.AddQuery('wald', 'swisssearch')
+        # the settings are serialized once
+        cache_info = sphinxapi.GetRequestTemplate.cache_info()  # pylint: disable=no-value-for-parameter
+        self.assertEqual(cache_info.misses, 1)
+        self.assertEqual(cache_info.hits, 2)
+        self.assertEqual(api._reqs[0], first._reqs[0])
+        self.assertIn(b'\x00\x00\x00\x04bern', first._reqs[1])
+        self.assertIn(b'\x00\x00\x00\x11swisssearch_fuzzy', first._reqs[1])
+        self.assertTrue(
+            first._reqs[1].
+            endswith(b'\x00\x00\x00\x07comment' + b'\x00' * 7 + b'\x01*' + b'\x00' * 16)
+        )
+
+        for configure in (
+            lambda api: api.SetFilter('rank', [1, 3]),
+            lambda api: api.SetFilterRange('rank', 1, 3),
+            lambda api: api.SetGeoAnchor('lat', 'lon', 0.5, 0.1),
+            lambda api: api.SetFieldWeights({'detail': 2}),
+            lambda api: api.SetLimits(0, 10),
+        ):
+            other = self.get_sphinx_client()
+            configure(other)
+            other.AddQuery('wald', 'swisssearch')
+            self.assertNotEqual(other._reqs[0], api._reqs[0])
+        self.assertEqual(sphinxapi.GetRequestTemplate.cache_info().misses, 6)  # pylint: disable=no-value-for-parameter
+
+    @params(
+        patch_sphinx_server.MOCK_SEARCH_QUERY_SOCK,
+        patch_sphinx_server.MOCK_QUERY_SOCK_1,
+        patch_sphinx_server.MOCK_QUERY_SOCK_2,
+        patch_sphinx_server.MOCK_QUERY_SOCK_3,
+        patch_sphinx_server.MOCK_QUERY_OVERRIDES_SOCK,
+        MOCK_MIXED_ATTRS_SOCK,
+    )
+    def test_sphinx_api_compiled_match_decoder(self, mocker):
+        # pylint: disable=protected-access
+        response = memoryview(mocker.data * 3)
+        sphinxapi.GetMatchDecoder.cache_clear()
+        generic = sphinxapi.SphinxClient._ParseSearchResponse(response, 3, compiled=False)
+        compiled = sphinxapi.SphinxClient._ParseSearchResponse(response, 3)
+        self.assertEqual(compiled, generic)
+        # the decoder is compiled once per schema
+        cache_info = sphinxapi.GetMatchDecoder.cache_info()  # pylint: disable=no-value-for-parameter
+        self.assertEqual(cache_info.misses, 1)
+        self.assertEqual(cache_info.hits, 2)
+
+    @params(
+        patch_sphinx_server.MOCK_SEARCH_QUERY_SOCK,
+        patch_sphinx_server.MOCK_QUERY_SOCK_3,
+        patch_sphinx_server.MOCK_QUERY_OVERRIDES_SOCK,
+        MOCK_MIXED_ATTRS_SOCK,
+    )
+    def test_sphinx_api_lazy_matches(self, mocker):
+        # pylint: disable=protected-access
+        response = memoryview(mocker.data * 2)
+        decoded = sphinxapi.SphinxClient._ParseSearchResponse(response, 2)
+        lazy = sphinxapi.SphinxClient._ParseSearchResponse(response, 2, lazy=True)
+        self.assertEqual(lazy, decoded)
+        for result, lazy_result in zip(decoded, lazy):
+            for match, lazy_match in zip(result.get('matches', []), lazy_result.get('matches', [])):
+                self.assertIsInstance(lazy_match, sphinxapi.Match)
+                self.assertIsInstance(lazy_match['attrs'], sphinxapi.LazyAttrs)
+                self.assertEqual(
+                    json.dumps(dict(lazy_match['attrs']), sort_keys=True),
+                    json.dumps(match['attrs'], sort_keys=True)
+                )
+
+    def test_sphinx_api_lazy_attrs(self):
+        # pylint: disable=protected-access
+        response = memoryview(MOCK_MIXED_ATTRS_SOCK.data)
+        match = sphinxapi.SphinxClient._ParseSearchResponse(response, 1, lazy=True)[0]['matches'][1]
+        attrs = match['attrs']
+        self.assertEqual(list(attrs), ['label', 'years', 'rank', 'x'])
+        # the attributes are decoded on access, in any order
+        self.assertEqual(attrs['x'], -1.0)
+        self.assertEqual(attrs['years'], [1, 2, 3])
+        self.assertEqual(attrs.get('unknown'), None)
+        attrs['label'] = 'b'
+        attrs['links'] = []
+        del attrs['rank']
+        self.assertNotIn('rank', attrs)
+        self.assertEqual(attrs.pop('years'), [1, 2, 3])
+        self.assertEqual(dict(attrs), {'label': 'b', 'x': -1.0, 'links': []})
+        with self.assertRaises(KeyError):
+            del attrs['rank']
+        # the match keys are fixed
+        match['weight'] += 99
+        self.assertEqual(match['weight'], 102)
+        with self.assertRaises(KeyError):
+            match['other'] = 1
+        self.assertEqual(dict(match), {'id': 2, 'weight': 102, 'attrs': attrs})
+
+    @params(
+        patch_sphinx_server.MOCK_SEARCH_QUERY_SOCK,
+        patch_sphinx_server.MOCK_QUERY_SOCK_1,
+        patch_sphinx_server.MOCK_QUERY_SOCK_3,
+        MOCK_MIXED_ATTRS_SOCK,
+    )
+    def test_sphinx_api_match_encoder(self, mocker):
+        # pylint: disable=protected-access
+        response = memoryview(mocker.data)
+        transform = sphinxapi.AttrsTransform(
+            rename=[('x_lv95', 'x')],
+            copy=[('feature_id', 'featureId')],
+            drop=['detail', 'years'],
+            keep=['label', 'unknown']
+        )
+        decoded = sphinxapi.SphinxClient._ParseSearchResponse(response, 1)[0]
+        encoded = sphinxapi.SphinxClient._ParseSearchResponse(response, 1, transform=transform)[0]
+        self.assertEqual(encoded['attrs'], decoded['attrs'])
+        self.assertEqual(len(encoded['matches']), len(decoded['matches']))
+        for match, encoded_match in zip(decoded['matches'], encoded['matches']):
+            attrs = match['attrs']
+            if 'x_lv95' in attrs:
+                attrs['x'] = attrs.pop('x_lv95')
+            if 'feature_id' in attrs:
+                attrs['featureId'] = attrs['feature_id']
+            attrs.pop('detail', None)
+            attrs.pop('years', None)
+            self.assertEqual(
+                encoded_match.dumps(), json.dumps(match, sort_keys=True, separators=(',', ':'))
+            )
+            self.assertEqual(encoded_match.values, (attrs.get('label'), None))
+
 
 @patch('app.lib.sphinxapi.SphinxClient._Connect')
 class TestSphinxApiCommunication(SpinxApiBaseTest):
@@ -215,6 +375,113 @@ class TestSphinxApiCommunication(SpinxApiBaseTest):
         )
         self.assertEqual(res['words'], [{'word': 'bern', 'docs': 63407, 'hits': 88901}])
 
+    def test_sphinx_api_run_queries_attr_types(self, mock_socket):
+        attrs = [
+            ('label', sphinxapi.SPH_ATTR_STRING),
+            ('rank', sphinxapi.SPH_ATTR_INTEGER),
+            ('x', sphinxapi.SPH_ATTR_FLOAT),
+            ('big', sphinxapi.SPH_ATTR_BIGINT),
+            ('empty', sphinxapi.SPH_ATTR_STRING),
+            ('years', sphinxapi.SPH_ATTR_MULTI),
+            ('ids', sphinxapi.SPH_ATTR_MULTI64),
+        ]
+        mock_socket.return_value = patch_sphinx_server.mock_search_socket([
+            (['detail'], attrs, [(2**40, 7, ['Bärn', 3, 0.5, -2**40, '', [2010, 2020], [2**33]])]),
+            (['detail'], attrs[:2], []),
+        ])
+        api = self.get_sphinx_client()
+        api.AddQuery('bern', index='swisssearch')
+        api.AddQuery('bern', index='swisssearch')
+        res = api.RunQueries()
+        self.assertEqual(len(res), 2)
+        self.assertEqual(
+            res[0]['matches'],
+            [{
+                'id': 2**40,
+                'weight': 7,
+                'attrs': {
+                    'label': 'Bärn',
+                    'rank': 3,
+                    'x': 0.5,
+                    'big': -2**40,
+                    'empty': '',
+                    'years': [2010, 2020],
+                    'ids': [2**33]
+                }
+            }]
+        )
+        self.assertEqual(res[0]['attrs'], [list(attr) for attr in attrs])
+        self.assertEqual(res[0]['words'], [{'word': 'bern', 'docs': 10, 'hits': 12}])
+        self.assertEqual(res[1]['matches'], [])
+        self.assertEqual(res[1]['total_found'], 0)
+
+    @params(
+        (patch_sphinx_server.MOCK_SEARCH_QUERY_SOCK, 1, 1),
+        (patch_sphinx_server.MOCK_SEARCH_QUERY_SOCK, 1, 4096),
+        (patch_sphinx_server.MOCK_QUERY_SOCK_3, 3, 13),
+        (patch_sphinx_server.MOCK_QUERY_SOCK_3, 3, 1460),
+    )
+    def test_sphinx_api_run_queries_streamed(self, mocker, nreqs, chunk_size, mock_socket):
+        # pylint: disable=protected-access
+        data = mocker.data * nreqs
+        expected = sphinxapi.SphinxClient._ParseSearchResponse(memoryview(data), nreqs)
+        # the response arrives in small chunks, the reader buffer is compacted and grows for
+        # the items (warning, long matches) larger than the buffer
+        mock_socket.return_value = patch_sphinx_server.MockSocket(
+            sphinxapi._HEADER.pack(sphinxapi.SEARCHD_OK, sphinxapi.VER_COMMAND_SEARCH, len(data)),
+            data,
+            chunk_size
+        )
+        api = self.get_sphinx_client()
+        for _ in range(nreqs):
+            api.AddQuery('bern', index='swisssearch')
+        with patch('app.lib.sphinxapi.RESPONSE_CHUNK_SIZE', 256):
+            res = api.RunQueries()
+        self.assertEqual(res, expected)
+        self.assertEqual(api.GetLastError(), '')
+
+    def test_sphinx_api_run_queries_connection_closed(self, mock_socket):
+        # searchd closes the connection in the middle of the response
+        mock_socket.return_value = patch_sphinx_server.MockSocket(
+            MOCK_MIXED_ATTRS_SOCK.status, MOCK_MIXED_ATTRS_SOCK.data[:-20]
+        )
+        api = self.get_sphinx_client()
+        api.AddQuery('bern', index='swisssearch')
+        self.assertIsNone(api.RunQueries())
+        self.assertTrue(api.GetLastError().startswith('failed to read searchd response'))
+
+    def test_sphinx_api_run_queries_garbled(self, mock_socket):
+        # pylint: disable=protected-access
+        # an invalid utf-8 string in the response of a persistent connection
+        garbled = MOCK_MIXED_ATTRS_SOCK.data.replace(b'\x00\x00\x00\x01a', b'\x00\x00\x00\x01\xff')
+        self.assertNotEqual(garbled, MOCK_MIXED_ATTRS_SOCK.data)
+        sock = patch_sphinx_server.MockSocket(MOCK_MIXED_ATTRS_SOCK.status, garbled)
+        mock_socket.return_value = sock
+        api = self.get_sphinx_client()
+        api._socket = sock
+        api.AddQuery('bern', index='swisssearch')
+        self.assertIsNone(api.RunQueries())
+        self.assertTrue(api.GetLastError().startswith('failed to read searchd response'))
+        # the connection is never reused
+        self.assertIsNone(api._socket)
+
+    def test_sphinx_api_run_queries_warning(self, mock_socket):
+        # pylint: disable=protected-access
+        data = MOCK_MIXED_ATTRS_SOCK.data
+        warning = b'index swisssearch: outdated'
+        data = sphinxapi._UINT.pack(len(warning)) + warning + data
+        # searchd older than the client and with a warning
+        mock_socket.return_value = patch_sphinx_server.MockSocket(
+            sphinxapi._HEADER.pack(
+                sphinxapi.SEARCHD_WARNING, sphinxapi.VER_COMMAND_SEARCH - 1, len(data)
+            ),
+            data
+        )
+        api = self.get_sphinx_client()
+        api.AddQuery('bern', index='swisssearch')
+        self.assertEqual(len(api.RunQueries()[0]['matches']), 2)
+        self.assertEqual(api.GetLastWarning(), 'index swisssearch: outdated')
+
     def test_query_build_keywords(self, mock_socket):
         mock_socket.return_value = patch_sphinx_server.MOCK_QUERY_BUILD_KEYWORDS_SOCK
         api = self.get_sphinx_client()